@@ -1,14 +1,24 @@
+import time
+_t_import = time.perf_counter()
+import uuid
 from pathlib import Path
 from typing import List
 import streamlit as st
-from config import DEFAULT_INDEX_ROOT, K_RETRIEVE_DEFAULT
-from project import Project
+from config import DEFAULT_INDEX_ROOT, K_RETRIEVE_DEFAULT, WARMUP_ON_START
+from project import Project, start_chat_compactor
+from registry import ProjectRegistry
+from scheduler import DueIndex, end_of_today
 from views import (
     render_new_project_view,
     render_chat_view,
     render_wrongbook_view,
     render_export_view,
 )
+from warmup import record_timing, start_warmup
+import metrics
+
+# 只有进程内第一次执行时这些 import 才真正发生，之后的重跑里都是命中 sys.modules
+record_timing("app_import_s", time.perf_counter() - _t_import, first="app_import_cold_s")
 
 st.set_page_config(page_title="RAG学习助手", page_icon="📘", layout="wide")
 
@@ -21,16 +31,55 @@ if "project_id" not in st.session_state:
     st.session_state["project_id"] = None
 if "view" not in st.session_state:
         st.session_state["view"] = "新建项目"   # 默认页
+if "session_id" not in st.session_state:
+    st.session_state["session_id"] = uuid.uuid4().hex   # 后台对话轮次按会话登记（turns.py）
+
+# 会话级耗时直方图：本次重跑里的埋点同时记进这个会话自己的 MetricSet
+if "metrics" not in st.session_state:
+    st.session_state["metrics"] = metrics.MetricSet()
+metrics.bind_session(st.session_state["metrics"])
 
 INDEX_ROOT = Path(st.session_state["index_root"]).resolve()
 INDEX_ROOT.mkdir(parents=True, exist_ok=True)
 
-# 列出所有项目
-projects: List[Project] = []
-for p in sorted(INDEX_ROOT.glob("*/project.json")):
-    proj = Project(p.parent)
-    proj.load_meta()
-    projects.append(proj)
+
+@st.cache_resource(show_spinner=False)
+def _chat_compactor(root: str):
+    # 每个进程、每个 INDEX_ROOT 只起一个后台压缩线程
+    return start_chat_compactor(Path(root))
+
+
+_chat_compactor(str(INDEX_ROOT))
+
+
+@st.cache_resource(show_spinner=False)
+def _warmup(root: str):
+    # 进程级预热：只在第一个会话打开时启动一次，在后台线程里跑，不阻塞页面
+    return start_warmup(Path(root))
+
+
+if WARMUP_ON_START:
+    _warmup(str(INDEX_ROOT))
+
+
+@st.cache_resource(show_spinner=False)
+def _metrics_writer():
+    # 设置了 RAG_METRICS_PROM 时，进程内唯一的后台线程定期写 Prometheus 文本文件
+    return metrics.start_prom_writer()
+
+
+_metrics_writer()
+
+# 项目列表走注册表（进程内缓存 + 目录 mtime 校验），侧边栏分页
+PROJECTS_PER_PAGE = 20
+registry = ProjectRegistry(INDEX_ROOT)
+if "proj_page" not in st.session_state:
+    st.session_state["proj_page"] = 0
+page_entries, n_projects = registry.page(st.session_state["proj_page"], PROJECTS_PER_PAGE)
+if not page_entries and st.session_state["proj_page"] > 0:
+    st.session_state["proj_page"] = 0
+    page_entries, n_projects = registry.page(0, PROJECTS_PER_PAGE)
+projects: List[Project] = [Project.from_registry(INDEX_ROOT, e) for e in page_entries]
 
 
 # ============= 侧边栏导航 =============
@@ -49,11 +98,26 @@ else:
             st.session_state["project_id"] = p.root.name
             st.session_state["view"] = "对话"
             st.rerun()
+    n_pages = (n_projects + PROJECTS_PER_PAGE - 1) // PROJECTS_PER_PAGE
+    if n_pages > 1:
+        cur = st.session_state["proj_page"]
+        c1, c2, c3 = st.sidebar.columns([1, 2, 1])
+        if c1.button("‹", key="proj_prev", disabled=cur == 0):
+            st.session_state["proj_page"] = cur - 1
+            st.rerun()
+        c2.caption(f"{cur + 1} / {n_pages}（共 {n_projects} 个）")
+        if c3.button("›", key="proj_next", disabled=cur >= n_pages - 1):
+            st.session_state["proj_page"] = cur + 1
+            st.rerun()
 
 st.sidebar.markdown("### 工具")
 if st.sidebar.button("错题本"):
     st.session_state["view"] = "错题本"
     st.rerun()
+# 只读 INDEX_ROOT/due_index.json，不逐个打开项目
+_due_today = DueIndex(INDEX_ROOT).due_counts(end_of_today())
+if _due_today:
+    st.sidebar.caption(f"今日待复习：{sum(_due_today.values())} 题（{len(_due_today)} 个项目）")
 
 if st.sidebar.button("导出与备份"):
     st.session_state["view"] = "导出与备份"
@@ -61,18 +125,59 @@ if st.sidebar.button("导出与备份"):
 
 st.sidebar.markdown("### 设置")
 st.sidebar.checkbox("开发者模式", key="dev_mode")
+# 本次重跑是否剖析：取按钮渲染之前的状态，点按钮那一次重跑本身不算
+profile_this_run = st.session_state["dev_mode"] and st.session_state.get("profile_armed", False)
+if st.session_state["dev_mode"]:
+    # 点一下只是“上膛”，真正剖析的是下一次重跑（比如下一轮提问）
+    if st.sidebar.button("剖析下一次重跑", disabled=st.session_state.get("profile_armed", False)):
+        st.session_state["profile_armed"] = True
+    if st.session_state.get("profile_armed"):
+        st.sidebar.caption("已开启：下一次交互会被采样剖析")
 
 # 当前视图
 view = st.session_state["view"]
 
+
+def render_view():
+    if view == "新建项目":
+        render_new_project_view(projects, INDEX_ROOT)
+    elif view == "对话":
+        render_chat_view(INDEX_ROOT)
+    elif view == "错题本":
+        render_wrongbook_view(INDEX_ROOT)
+    elif view == "导出与备份":
+        render_export_view(INDEX_ROOT)
+    else:
+        st.error(f"未知视图：{view}")
+
+
+def render_profiled_view():
+    # 只有上膛的这次重跑才导入剖析器；不开时这里什么都不多做
+    from profiler import SamplingProfiler
+    st.session_state["profile_armed"] = False
+    # 本地模式下提问的那一轮在后台线程池里跑，对话视图看到这个标记会让 TurnExecutor 单独剖析那一轮
+    st.session_state["profiling"] = True
+    prof = SamplingProfiler().start()
+    try:
+        render_view()
+    finally:
+        # st.rerun() / st.stop() 也走这里，剖析结果照样保存
+        prof.stop()
+        st.session_state["profiling"] = False
+        pid = st.session_state.get("project_id")
+        out_dir = INDEX_ROOT / pid / "profiles" if pid else INDEX_ROOT / "_profiles"
+        st.session_state["last_profile"] = prof.summary(prof.save(out_dir, label=view))
+
+
 # ============ 路由到各视图 ============
-if view == "新建项目":
-    render_new_project_view(projects, INDEX_ROOT)
-elif view == "对话":
-    render_chat_view(INDEX_ROOT)
-elif view == "错题本":
-    render_wrongbook_view(INDEX_ROOT)
-elif view == "导出与备份":
-    render_export_view(INDEX_ROOT)
+if profile_this_run:
+    render_profiled_view()
 else:
-    st.error(f"未知视图：{view}")
\ No newline at end of file
+    render_view()
+
+if st.session_state["dev_mode"] and st.session_state.get("last_profile"):
+    _prof = st.session_state["last_profile"]
+    with st.sidebar.expander("最近一次剖析", expanded=False):
+        st.caption(f"耗时 {_prof['wall_s']}s，{_prof['samples']} 个样本，{_prof['threads']} 个线程")
+        st.caption(f"火焰图（speedscope.app 打开）：{_prof['path']}")
+        st.dataframe(_prof["hotspots"], use_container_width=True)
\ No newline at end of file
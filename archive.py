@@ -0,0 +1,103 @@
+"""
+项目索引的导出 / 恢复：
+- export_archive: 点击时才打包，直接流式写到磁盘 <项目>/exports/index_<stamp>.zip；
+  索引版本（stamp.json）不变就复用同一个文件。FAISS 向量文件和原始文档本身已很紧凑，
+  用 ZIP_STORED 只存不压，只有 pkl / json 这类文本才 deflate
+- import_archive: 从导出包恢复成一个新项目，索引原样解出，不需要重新计算向量
+"""
+import json
+import os
+import tempfile
+import zipfile
+from pathlib import Path
+from typing import BinaryIO, Optional
+from project import Project
+from rag_core import index_version
+from utils import slugify_name, now_ts
+
+_DEFLATE_SUFFIXES = {".pkl", ".json", ".jsonl", ".txt"}
+_ARCHIVE_FORMAT = 1
+
+
+def _compress_type(path: Path) -> int:
+    return zipfile.ZIP_DEFLATED if path.suffix.lower() in _DEFLATE_SUFFIXES else zipfile.ZIP_STORED
+
+
+def archive_path(proj: Project) -> Path:
+    return proj.root / "exports" / f"index_{index_version(proj.index_dir) or 'nostamp'}.zip"
+
+
+def cached_archive(proj: Project) -> Optional[Path]:
+    """当前索引版本已打过包就返回路径，否则 None（不触发打包）。"""
+    p = archive_path(proj)
+    return p if p.exists() else None
+
+
+def export_archive(proj: Project, include_files: bool = True) -> Path:
+    """
+    打包 project.json + index/（+ files/ 原始文档，用于依据预览），返回 zip 路径。
+    先写同目录下的唯一临时文件再改名（并发导出同一版本互不干扰），旧版本的包顺手删掉。
+    """
+    out = archive_path(proj)
+    if out.exists():
+        return out
+    out.parent.mkdir(parents=True, exist_ok=True)
+    dirs = [proj.index_dir] + ([proj.files_dir] if include_files and proj.files_dir.exists() else [])
+    tmp = tempfile.NamedTemporaryFile(dir=out.parent, prefix=out.name + ".", suffix=".tmp", delete=False)
+    try:
+        with tmp, zipfile.ZipFile(tmp, "w") as zf:
+            zf.writestr("archive.json", json.dumps({"format": _ARCHIVE_FORMAT, "exported_at": now_ts()}))
+            if proj.meta_path.exists():
+                zf.write(proj.meta_path, "project.json", compress_type=zipfile.ZIP_DEFLATED)
+            for d in dirs:
+                for root, _, files in os.walk(d):
+                    for f in files:
+                        full = Path(root) / f
+                        zf.write(full, full.relative_to(proj.root).as_posix(), compress_type=_compress_type(full))
+        os.replace(tmp.name, out)
+    except BaseException:
+        Path(tmp.name).unlink(missing_ok=True)
+        raise
+    for old in out.parent.glob("index_*.zip"):
+        if old != out:
+            old.unlink(missing_ok=True)
+    return out
+
+
+def import_archive(fp: BinaryIO, index_root: Path, name: Optional[str] = None) -> Project:
+    """
+    从导出包恢复项目：目录名由项目名生成，重名时加后缀；只接受 project.json / index/ / files/ 下的条目。
+    """
+    with zipfile.ZipFile(fp) as zf:
+        members = zf.namelist()
+        if "index/index.faiss" not in members or "index/index.pkl" not in members:
+            raise ValueError("不是有效的索引导出包（缺少 index/index.faiss 或 index/index.pkl）")
+        meta = json.loads(zf.read("project.json")) if "project.json" in members else {}
+        display = (name or meta.get("name") or "restored").strip()
+        base = slugify_name(display)
+        dir_name, n = base, 1
+        while (index_root / dir_name).exists():
+            n += 1
+            dir_name = f"{base}_{n}"
+        proj = Project(index_root / dir_name)
+        root = proj.root.resolve()
+        for m in members:
+            if m.endswith("/") or not (m.startswith("index/") or m.startswith("files/")):
+                continue
+            dest = (proj.root / m).resolve()
+            if root not in dest.parents:
+                raise ValueError(f"导出包中有非法路径：{m}")
+            dest.parent.mkdir(parents=True, exist_ok=True)
+            with zf.open(m) as src, open(dest, "wb") as dst:
+                while True:
+                    buf = src.read(1 << 20)
+                    if not buf:
+                        break
+                    dst.write(buf)
+    # 原始文件路径指向旧项目目录，改写成新目录下的同名文件
+    meta["files"] = [str(proj.files_dir / Path(f).name) for f in meta.get("files", [])]
+    meta.update({"name": display, "dir_name": dir_name, "restored_at": now_ts()})
+    meta.setdefault("created_at", now_ts())
+    proj.meta = meta
+    proj.save_meta()
+    return proj
@@ -0,0 +1,203 @@
+"""
+批量预生成（不开页面）：读一个 JSONL 请求文件，每行一个
+  {"project": "项目目录名", "mode": "answer|quiz|card|map", "topic": "...", "n": 5, "id": "可选"}
+用 tools.generate_tool 生成，结果按行写进输出 JSONL（records 与 chats.jsonl 的记录格式相同）：
+  {"id", "project", "mode", "topic", "status": "ok|error", "records": [...], "errors": [...], "elapsed_s"}
+- 并发：--concurrency 个工作线程（LLM 请求数另受 LLM_MAX_CONCURRENCY 限制）
+- 限速：--rpm 每分钟最多开始多少个请求（令牌桶，0 不限）
+- 断点续跑：输出文件里已是 ok 的 id 直接跳过，失败的重跑；单个请求失败按 --retries 重试
+- --to-chats：同时把 用户消息 + 生成的记录 追加进项目的聊天记录
+
+用法：python batch_qa.py requests.jsonl -o results.jsonl [--index-root ./projects] [--concurrency 4] [--rpm 60]
+"""
+import argparse
+import hashlib
+import json
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+from typing import Any, Dict, List, Set
+from config import DEFAULT_INDEX_ROOT
+from project import Project
+from utils import now_ts
+from turns import new_turn_id
+
+_MODES = ("answer", "quiz", "card", "map")
+# 写进聊天记录时的用户消息，与页面里的指令写法一致
+_MODE_PREFIX = {"answer": "", "quiz": "/quiz ", "card": "/card ", "map": "/map "}
+
+
+class RateLimiter:
+    """令牌桶：每分钟 rpm 个，最多攒 burst 个；acquire 阻塞到拿到令牌。"""
+
+    def __init__(self, rpm: float, burst: int = 1):
+        self.rate = rpm / 60.0
+        self.burst = max(1, burst)
+        self.tokens = float(self.burst)
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        if self.rate <= 0:
+            return
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+                self.last = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+def request_id(req: Dict[str, Any], lineno: int) -> str:
+    """没给 id 时按内容 + 行号生成，重跑同一个文件时保持不变。"""
+    if req.get("id"):
+        return str(req["id"])
+    key = json.dumps([req.get("project"), req.get("mode"), req.get("topic"), req.get("n"), lineno], ensure_ascii=False)
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()[:16]
+
+
+def load_requests(path: Path) -> List[Dict[str, Any]]:
+    reqs = []
+    with open(path, "r", encoding="utf-8") as f:
+        for lineno, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            req = json.loads(line)
+            req["id"] = request_id(req, lineno)
+            req.setdefault("mode", "answer")
+            if req["mode"] not in _MODES:
+                raise ValueError(f"第 {lineno} 行：未知的 mode {req['mode']}")
+            if not req.get("project") or not req.get("topic"):
+                raise ValueError(f"第 {lineno} 行：缺少 project 或 topic")
+            reqs.append(req)
+    return reqs
+
+
+def finished_ids(out_path: Path) -> Set[str]:
+    """输出文件里已成功的请求 id（最后一行为准；写了一半的尾行忽略）。"""
+    status: Dict[str, str] = {}
+    if out_path.exists():
+        with open(out_path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    row = json.loads(line)
+                except ValueError:
+                    continue
+                status[row.get("id")] = row.get("status")
+    return {k for k, v in status.items() if v == "ok"}
+
+
+def run_one(req: Dict[str, Any], index_root: Path, llm, limiter: RateLimiter, retries: int, to_chats: bool) -> Dict[str, Any]:
+    from rag_core import load_index
+    from tools import generate_tool
+
+    proj = Project(index_root / req["project"])
+    row = {k: req.get(k) for k in ("id", "project", "mode", "topic")}
+    t0 = time.perf_counter()
+    errors: List[str] = []
+    records: List[Dict[str, Any]] = []
+    if not proj.exists():
+        errors.append(f"项目 {req['project']} 不存在")
+    else:
+        vs = load_index(proj.index_dir)
+        for attempt in range(retries + 1):
+            if vs is None:
+                errors = ["索引未找到"]
+                break
+            limiter.acquire()
+            errors = []
+            devlog: Dict[str, Any] = {}
+            records = generate_tool(
+                req["mode"], proj, vs, llm,
+                user_msg=req["topic"],
+                topic=req["topic"],
+                devlog=devlog,
+                strictness=req.get("strictness", "strict"),
+                instruction=req.get("instruction", ""),
+                n_questions=int(req.get("n") or 1),
+                on_error=errors.append,
+            )
+            if records and not errors:
+                break
+            if not errors:
+                errors.append("没有生成任何记录")
+            if attempt < retries:
+                time.sleep(min(2 ** attempt, 30))
+    ok = bool(records) and not errors
+    if ok and to_chats:
+        turn_id = new_turn_id()
+        proj.append_chat({
+            "t": now_ts(),
+            "role": "user",
+            "kind": "msg",
+            "text": _MODE_PREFIX[req["mode"]] + req["topic"],
+            "turn": turn_id,
+        })
+        for rec in records:
+            proj.append_chat({**rec, "turn": turn_id})
+    row.update({
+        "status": "ok" if ok else "error",
+        "records": records if ok else [],
+        "errors": errors,
+        "elapsed_s": round(time.perf_counter() - t0, 3),
+    })
+    return row
+
+
+def run_batch(
+    in_path: Path,
+    out_path: Path,
+    index_root: Path,
+    concurrency: int = 4,
+    rpm: float = 0,
+    retries: int = 1,
+    to_chats: bool = False,
+) -> Dict[str, int]:
+    from ds_client import get_transport
+
+    reqs = load_requests(in_path)
+    done = finished_ids(out_path)
+    todo = [r for r in reqs if r["id"] not in done]
+    limiter = RateLimiter(rpm, burst=concurrency)
+    llm = get_transport()
+    stats = {"total": len(reqs), "skipped": len(reqs) - len(todo), "ok": 0, "error": 0}
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(out_path, "a", encoding="utf-8") as out, ThreadPoolExecutor(max_workers=concurrency) as pool:
+        futs = {pool.submit(run_one, r, index_root, llm, limiter, retries, to_chats): r for r in todo}
+        for fut in as_completed(futs):
+            try:
+                row = fut.result()
+            except Exception as e:
+                r = futs[fut]
+                row = {k: r.get(k) for k in ("id", "project", "mode", "topic")}
+                row.update({"status": "error", "records": [], "errors": [f"{type(e).__name__}: {e}"]})
+            # 每完成一个就落盘，中途中断后重跑只补没完成的
+            out.write(json.dumps(row, ensure_ascii=False) + "\n")
+            out.flush()
+            stats[row["status"]] += 1
+            print(f"[{stats['ok'] + stats['error']}/{len(todo)}] {row['status']} {row['id']} {row['project']} {row['mode']} {row['topic']}",
+                  file=sys.stderr)
+    return stats
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="批量预生成回答 / 练习题 / 卡片 / 思维导图")
+    ap.add_argument("input", help="请求 JSONL")
+    ap.add_argument("-o", "--output", required=True, help="结果 JSONL（已存在时断点续跑）")
+    ap.add_argument("--index-root", default=str(DEFAULT_INDEX_ROOT))
+    ap.add_argument("--concurrency", type=int, default=4)
+    ap.add_argument("--rpm", type=float, default=0, help="每分钟最多开始的请求数，0 不限")
+    ap.add_argument("--retries", type=int, default=1)
+    ap.add_argument("--to-chats", action="store_true", help="同时写进项目聊天记录")
+    args = ap.parse_args()
+    result = run_batch(
+        Path(args.input), Path(args.output), Path(args.index_root).resolve(),
+        concurrency=args.concurrency, rpm=args.rpm, retries=args.retries, to_chats=args.to_chats,
+    )
+    print(json.dumps(result, ensure_ascii=False))
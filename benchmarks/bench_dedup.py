@@ -0,0 +1,119 @@
+"""
+近似重复块合并（dedup.py）的效果：同一份语料分别不去重 / 去重建索引，对比
+- 块数 / 向量数、索引目录大小、去重本身的耗时
+- 检索多样性：每个查询 top-k 里互不重复（不属于同一近似重复组）的片段占比，以及覆盖到的出处数
+  （去重后的块把被合并块的出处也算上）
+语料默认带重复的页脚和议程页（corpus.py --boilerplate），并把 TXT 讲义再上传一份改名副本。
+
+用法：python benchmarks/bench_dedup.py [--files 2] [--pages 30] [--copies 1] [--k 6] [--embeddings hf|hash]
+"""
+import argparse
+import json
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Dict, List
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from bench_pipeline import RESULTS_DIR, _QUESTIONS, _git_rev, hash_embeddings  # noqa: E402
+from corpus import make_corpus  # noqa: E402
+
+_BOILERPLATE_QUERIES = ["本讲议程有哪些内容", "课程讲义的使用说明", "课堂练习和小结"]
+
+
+def dir_bytes(path: Path) -> int:
+    return sum(p.stat().st_size for p in path.rglob("*") if p.is_file())
+
+
+def diversity(vs, queries: List[str], k: int) -> Dict[str, float]:
+    from dedup import near_duplicate_groups
+    distinct, sources = [], []
+    for q in queries:
+        hits = vs.similarity_search(q, k=k)
+        if not hits:
+            continue
+        distinct.append(len(near_duplicate_groups([d.page_content for d in hits])) / len(hits))
+        locs = set()
+        for d in hits:
+            for m in [d.metadata] + list(d.metadata.get("dup_sources") or []):
+                locs.add((m.get("source"), m.get("page"), m.get("slide")))
+        sources.append(len(locs))
+    return {
+        "distinct_ratio": round(statistics.mean(distinct), 4) if distinct else 0.0,
+        "sources_per_query": round(statistics.mean(sources), 2) if sources else 0.0,
+    }
+
+
+def bench_variant(chunks, index_dir: Path, queries: List[str], k: int) -> Dict[str, Any]:
+    import rag_core
+    t0 = time.perf_counter()
+    vs = rag_core.build_index_from_chunks(chunks)
+    build_s = time.perf_counter() - t0
+    rag_core.save_index(vs, index_dir)
+    return {
+        "vectors": vs.index.ntotal,
+        "index_bytes": dir_bytes(index_dir),
+        "build_s": round(build_s, 3),
+        **diversity(vs, queries, k),
+    }
+
+
+def main():
+    ap = argparse.ArgumentParser(description="近似重复块合并的基准")
+    ap.add_argument("--files", type=int, default=2, help="每种格式的文件数")
+    ap.add_argument("--pages", type=int, default=30)
+    ap.add_argument("--copies", type=int, default=1, help="TXT 讲义额外上传几份改名副本")
+    ap.add_argument("--k", type=int, default=6)
+    ap.add_argument("--embeddings", choices=["hf", "hash"], default="hf")
+    ap.add_argument("--out", default="")
+    args = ap.parse_args()
+
+    import rag_core
+    from dedup import dedup_chunks
+    from ingest import read_any
+    if args.embeddings == "hash":
+        _emb = hash_embeddings()
+        rag_core.get_embeddings = lambda: _emb
+
+    queries = _QUESTIONS + _BOILERPLATE_QUERIES
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        paths = make_corpus(tmp / "corpus", args.files, args.pages, types=("pptx", "docx", "txt"), boilerplate=True)
+        for src in [p for p in paths if p.suffix == ".txt"]:
+            for c in range(args.copies):
+                dst = src.with_name(f"{src.stem}_copy{c + 1}{src.suffix}")
+                shutil.copyfile(src, dst)
+                paths.append(dst)
+        docs = []
+        for p in paths:
+            docs += read_any(p.read_bytes(), p.name)
+        chunks = rag_core.split_docs(docs)
+
+        t0 = time.perf_counter()
+        kept, stats = dedup_chunks(chunks)
+        dedup_s = time.perf_counter() - t0
+
+        before = bench_variant(chunks, tmp / "index_plain", queries, args.k)
+        after = bench_variant(kept, tmp / "index_dedup", queries, args.k)
+
+    report = {
+        "meta": {"time": time.strftime("%Y-%m-%d %H:%M:%S"), "git": _git_rev(), "args": vars(args)},
+        "dedup": {**stats, "dedup_s": round(dedup_s, 3), "chunks_per_s": round(len(chunks) / dedup_s, 1) if dedup_s else 0},
+        "before": before,
+        "after": after,
+        "index_bytes_reduction": round(1 - after["index_bytes"] / before["index_bytes"], 4),
+    }
+    out_path = Path(args.out) if args.out else RESULTS_DIR / f"dedup_{time.strftime('%Y%m%d_%H%M%S')}.json"
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+    out_path.write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8")
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    print(f"结果已写入 {out_path}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
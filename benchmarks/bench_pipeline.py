@@ -0,0 +1,246 @@
+"""
+端到端基准：合成语料 → 解析 → 切分 → 嵌入 → 建索引 → 加载 → 检索 → 各工具生成（本地模拟 LLM）。
+- read_* / split_docs / 嵌入 / 建索引 的吞吐，索引加载耗时，retrieve 的 p50 / p99
+- 在 benchmarks/mock_llm.py 起的 OpenAI 兼容服务上跑 answer / quiz / card / map 和整轮 plan（execute_plan），
+  首 token 延迟与生成速率由 --ttft / --tps 控制；走的是 generate_tool（run_tool 去掉渲染后的同一条路径）
+- 结果写成 JSON（benchmarks/results/pipeline_<时间>.json），--compare 与上一次结果逐项对比
+
+嵌入默认用真实的 HF 模型（config.EMB_MODEL）；--embeddings hash 换成确定性的哈希向量，
+没有模型 / 没有 GPU 的机器上也能跑完整条链路（嵌入吞吐这项就不具参考意义）。
+
+用法：python benchmarks/bench_pipeline.py [--files 2] [--pages 20] [--embeddings hf|hash]
+                                          [--ttft 0.3] [--tps 80] [--turns 5] [--compare 旧结果.json]
+"""
+import argparse
+import hashlib
+import json
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from corpus import make_corpus  # noqa: E402
+from mock_llm import MockLLM  # noqa: E402
+
+RESULTS_DIR = Path(__file__).resolve().parent / "results"
+
+_QUESTIONS = ["什么是梯度下降", "解释一下矩阵的秩", "概率分布的期望怎么算", "递归和迭代的区别",
+              "为什么要做交叉验证", "极限的定义是什么", "损失函数有哪些", "复杂度如何分析"]
+
+
+def pct(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    s = sorted(values)
+    return s[min(len(s) - 1, int(round(q * (len(s) - 1))))]
+
+
+def timed(fn: Callable) -> float:
+    t0 = time.perf_counter()
+    fn()
+    return time.perf_counter() - t0
+
+
+def hash_embeddings():
+    """确定性哈希向量（字符二元组哈希到 384 维后归一化）；只用于没有模型时跑通链路。"""
+    from langchain_core.embeddings import Embeddings
+
+    class HashEmbeddings(Embeddings):
+        dim = 384
+
+        def _embed(self, text: str) -> List[float]:
+            v = [0.0] * self.dim
+            for i in range(len(text) - 1):
+                h = int.from_bytes(hashlib.blake2b(text[i:i + 2].encode("utf-8"), digest_size=4).digest(), "little")
+                v[h % self.dim] += 1.0 if h & 1 else -1.0
+            n = sum(x * x for x in v) ** 0.5 or 1.0
+            return [x / n for x in v]
+
+        def embed_documents(self, texts: List[str]) -> List[List[float]]:
+            return [self._embed(t) for t in texts]
+
+        def embed_query(self, text: str) -> List[float]:
+            return self._embed(text)
+
+    return HashEmbeddings()
+
+
+def bench_ingest(paths: List[Path], res: Dict[str, Any]):
+    import rag_core
+    from ingest import read_any
+
+    docs_all = []
+    by_ext: Dict[str, List[Path]] = {}
+    for p in paths:
+        by_ext.setdefault(p.suffix.lstrip("."), []).append(p)
+    for ext, ps in by_ext.items():
+        data = [(p.read_bytes(), p.name) for p in ps]
+        t0 = time.perf_counter()
+        for b, name in data:
+            docs_all += read_any(b, name)
+        dt = time.perf_counter() - t0
+        mb = sum(len(b) for b, _ in data) / 1e6
+        res[f"read_{ext}_mb_per_s"] = round(mb / dt, 3)
+
+    t0 = time.perf_counter()
+    chunks = rag_core.split_docs(docs_all)
+    res["split_chunks_per_s"] = round(len(chunks) / (time.perf_counter() - t0), 1)
+    res["n_docs"] = len(docs_all)
+    res["n_chunks"] = len(chunks)
+
+    emb = rag_core.get_embeddings()
+    texts = [c.page_content for c in chunks]
+    t0 = time.perf_counter()
+    vectors = emb.embed_documents(texts)
+    res["embed_chunks_per_s"] = round(len(chunks) / (time.perf_counter() - t0), 1)
+
+    from langchain_community.vectorstores import FAISS
+    t0 = time.perf_counter()
+    vs = FAISS.from_embeddings(list(zip(texts, vectors)), emb, metadatas=[c.metadata for c in chunks])
+    res["index_build_ms"] = round((time.perf_counter() - t0) * 1000, 2)
+    return vs
+
+
+def bench_index(vs, index_dir: Path, n_queries: int, res: Dict[str, Any]):
+    import rag_core
+    res["index_save_ms"] = round(timed(lambda: rag_core.save_index(vs, index_dir)) * 1000, 2)
+    # 不走 load_index 的进程内缓存，测的是从磁盘反序列化
+    loads = [timed(lambda: rag_core.try_load_index(index_dir)) for _ in range(3)]
+    res["index_load_ms"] = round(statistics.median(loads) * 1000, 2)
+
+    lat = []
+    for i in range(n_queries):
+        q = _QUESTIONS[i % len(_QUESTIONS)]
+        lat.append(timed(lambda: rag_core.retrieve(vs, q, 6)) * 1000)
+    res["retrieve_p50_ms"] = round(pct(lat, 0.5), 3)
+    res["retrieve_p99_ms"] = round(pct(lat, 0.99), 3)
+
+
+def bench_tools(proj, vs, llm, turns: int, res: Dict[str, Any]):
+    from tools import generate_tool, execute_plan, llm_stream_plan
+
+    for mode in ("answer", "quiz", "card", "map"):
+        lat, ttft, errors = [], [], 0
+        for i in range(turns):
+            q = _QUESTIONS[i % len(_QUESTIONS)]
+            devlog: Dict[str, Any] = {}
+            first: List[float] = []
+            t0 = time.perf_counter()
+            recs = generate_tool(
+                mode, proj, vs, llm, q, q, devlog,
+                on_text=lambda t: first or first.append(time.perf_counter() - t0),
+                on_error=lambda msg: None,
+            )
+            lat.append((time.perf_counter() - t0) * 1000)
+            if first:
+                ttft.append(first[0] * 1000)
+            errors += not recs or any(k.startswith("error") for k in devlog)
+        res[f"tool_{mode}_p50_ms"] = round(pct(lat, 0.5), 1)
+        res[f"tool_{mode}_p99_ms"] = round(pct(lat, 0.99), 1)
+        res[f"tool_{mode}_ttft_p50_ms"] = round(pct(ttft, 0.5), 1)
+        res[f"tool_{mode}_errors"] = errors
+
+    lat, steps = [], []
+    for i in range(max(1, turns // 2)):
+        q = f"帮我系统复习{_QUESTIONS[i % len(_QUESTIONS)]}"
+        devlog = {}
+        t0 = time.perf_counter()
+        recs = execute_plan(llm_stream_plan(llm, q, devlog), proj, vs, llm, q, devlog, headless=True)
+        lat.append((time.perf_counter() - t0) * 1000)
+        steps.append(len(recs))
+    res["plan_turn_p50_ms"] = round(pct(lat, 0.5), 1)
+    res["plan_turn_p99_ms"] = round(pct(lat, 0.99), 1)
+    res["plan_records_mean"] = round(statistics.mean(steps), 2)
+
+
+def _git_rev() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, text=True).strip()
+    except Exception:
+        return ""
+
+
+def compare(old: Dict[str, Any], new: Dict[str, Any]) -> List[str]:
+    """逐项对比；_per_s 越大越好，_ms 越小越好，变差超过 10% 标 ⚠。"""
+    lines = []
+    for k, v in new["results"].items():
+        o = old.get("results", {}).get(k)
+        if not isinstance(v, (int, float)) or not isinstance(o, (int, float)) or not o:
+            continue
+        change = (v - o) / o
+        worse = change < -0.1 if k.endswith("_per_s") else change > 0.1 if k.endswith("_ms") else False
+        lines.append(f"{'⚠' if worse else ' '} {k:32s} {o:>12} -> {v:>12}  ({change:+.1%})")
+    return lines
+
+
+def main():
+    ap = argparse.ArgumentParser(description="端到端性能基准")
+    ap.add_argument("--files", type=int, default=2, help="每种格式的文件数")
+    ap.add_argument("--pages", type=int, default=20)
+    ap.add_argument("--embeddings", choices=["hf", "hash"], default="hf")
+    ap.add_argument("--queries", type=int, default=200)
+    ap.add_argument("--ttft", type=float, default=0.3)
+    ap.add_argument("--tps", type=float, default=80.0)
+    ap.add_argument("--turns", type=int, default=5)
+    ap.add_argument("--skip-llm", action="store_true")
+    ap.add_argument("--out", default="", help="结果文件；默认 benchmarks/results/pipeline_<时间>.json")
+    ap.add_argument("--compare", default="", help="与之前的结果文件对比")
+    args = ap.parse_args()
+
+    import rag_core
+    from project import Project
+    if args.embeddings == "hash":
+        _emb = hash_embeddings()
+        rag_core.get_embeddings = lambda: _emb
+
+    res: Dict[str, Any] = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        t0 = time.perf_counter()
+        paths = make_corpus(tmp / "corpus", args.files, args.pages)
+        res["corpus_bytes"] = sum(p.stat().st_size for p in paths)
+        res["corpus_gen_ms"] = round((time.perf_counter() - t0) * 1000, 1)
+
+        vs = bench_ingest(paths, res)
+        proj = Project(tmp / "projects" / "bench")
+        proj.meta = {"name": "bench"}
+        proj.save_meta()
+        bench_index(vs, proj.index_dir, args.queries, res)
+
+        if not args.skip_llm:
+            from ds_client import LLMTransport
+            with MockLLM(ttft=args.ttft, tps=args.tps) as url:
+                llm = LLMTransport(api_key="mock", base_url=url, hedge_after=0)
+                bench_tools(proj, vs, llm, args.turns, res)
+                llm.close()
+
+    out = {
+        "meta": {
+            "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "git": _git_rev(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "args": vars(args),
+        },
+        "results": res,
+    }
+    out_path = Path(args.out) if args.out else RESULTS_DIR / f"pipeline_{time.strftime('%Y%m%d_%H%M%S')}.json"
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+    out_path.write_text(json.dumps(out, ensure_ascii=False, indent=2), encoding="utf-8")
+    print(json.dumps(out, ensure_ascii=False, indent=2))
+    print(f"结果已写入 {out_path}", file=sys.stderr)
+    if args.compare:
+        old = json.loads(Path(args.compare).read_text(encoding="utf-8"))
+        print("\n".join(compare(old, out)))
+
+
+if __name__ == "__main__":
+    main()
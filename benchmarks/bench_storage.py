@@ -0,0 +1,62 @@
+"""
+对比 JSONL 与 SQLite 两种项目存储后端：
+- 追加聊天记录吞吐
+- 读取最近 200 条
+- 加载全部错题
+- 单条错题更新（“掌握”按钮）
+
+用法：python benchmarks/bench_storage.py [--chats 20000] [--wrong 2000]
+结果以 JSON 打印到 stdout。
+"""
+import argparse
+import json
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from chatlog import JsonlStore  # noqa: E402
+from storage_sqlite import SqliteStore  # noqa: E402
+
+
+def _timed(fn, repeat: int = 1) -> float:
+    t0 = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - t0) / repeat * 1000
+
+
+def bench(store, n_chats: int, n_wrong: int) -> dict:
+    chat = {"role": "assistant", "kind": "answer", "t": 0, "content": "示例回答" * 40}
+    res = {}
+    t0 = time.perf_counter()
+    for i in range(n_chats):
+        store.append_chat({**chat, "t": i})
+    res["append_chat_per_s"] = round(n_chats / (time.perf_counter() - t0))
+    res["tail_200_ms"] = round(_timed(lambda: store.page_chats(None, 200), 20), 3)
+
+    for i in range(n_wrong):
+        store.log_wrong({"id": f"w{i}", "t": i, "q": f"题目 {i}", "opts": ["A", "B", "C", "D"], "ans": "A"})
+    res["load_wrong_ms"] = round(_timed(store.load_wrong, 10), 3)
+    items = store.load_wrong()
+    target = items[len(items) // 2]
+    res["update_wrong_ms"] = round(_timed(lambda: store.update_wrong({**target, "box": 2, "last": time.time()}), 10), 3)
+    return res
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--chats", type=int, default=20000)
+    ap.add_argument("--wrong", type=int, default=2000)
+    args = ap.parse_args()
+    out = {}
+    for name, cls in (("jsonl", JsonlStore), ("sqlite", SqliteStore)):
+        with tempfile.TemporaryDirectory() as d:
+            out[name] = bench(cls(Path(d)), args.chats, args.wrong)
+    print(json.dumps(out, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
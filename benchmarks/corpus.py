@@ -0,0 +1,144 @@
+"""
+合成测试语料：按给定规模生成 PDF / PPTX / DOCX / TXT 文件，基准测试和压测共用。
+- 文本用固定词表 + 随机种子拼出，同样的参数每次生成的内容完全一样，结果可在多次运行间对比
+- PDF 不依赖额外库，手写一个只含 Helvetica 文本的最小 PDF（pypdf 能正常抽取文字），所以 PDF 内容是英文
+- DOCX / PPTX 用 python-docx / python-pptx（与 io_readers 读取用的库相同）
+
+用法：python benchmarks/corpus.py <输出目录> [--files 2] [--pages 20]
+"""
+import argparse
+import random
+from pathlib import Path
+from typing import List
+
+_ZH_WORDS = ("定义 性质 定理 证明 推导 例题 习题 概念 模型 方法 条件 结论 假设 变量 函数 矩阵 向量 "
+             "概率 分布 期望 方差 收敛 极限 导数 积分 算法 复杂度 结构 递归 迭代 优化 约束 误差 "
+             "实验 数据 样本 估计 检验 回归 分类 特征 参数 梯度 损失 训练 验证 泛化").split()
+_EN_WORDS = ("definition theorem proof lemma example exercise concept model method condition result "
+             "assumption variable function matrix vector probability distribution expectation variance "
+             "limit derivative integral algorithm complexity structure recursion iteration optimization "
+             "constraint error sample estimate gradient loss training validation").split()
+
+
+def zh_text(rng: random.Random, n_chars: int) -> str:
+    out, size = [], 0
+    while size < n_chars:
+        sent = "".join(rng.choice(_ZH_WORDS) for _ in range(rng.randint(6, 14))) + rng.choice("。；，")
+        out.append(sent)
+        size += len(sent)
+    return "".join(out)
+
+
+def en_lines(rng: random.Random, n_lines: int, width: int = 80) -> List[str]:
+    lines = []
+    for _ in range(n_lines):
+        line = ""
+        while len(line) < width - 12:
+            line += rng.choice(_EN_WORDS) + " "
+        lines.append(line.strip())
+    return lines
+
+
+def write_txt(path: Path, rng: random.Random, pages: int, chars_per_page: int = 1500):
+    path.write_text("\n\n".join(zh_text(rng, chars_per_page) for _ in range(pages)), encoding="utf-8")
+
+
+def write_docx(path: Path, rng: random.Random, pages: int, chars_per_page: int = 1500):
+    import docx
+    doc = docx.Document()
+    for p in range(pages):
+        doc.add_heading(f"第 {p + 1} 节", level=2)
+        for _ in range(4):
+            doc.add_paragraph(zh_text(rng, chars_per_page // 4))
+    doc.save(str(path))
+
+
+_AGENDA = "本讲议程：一、课程回顾；二、核心概念与定义；三、典型例题；四、课堂练习；五、小结与作业。"
+_FOOTER = "《机器学习导论》课程讲义 · 仅供本课程学习使用 · 请勿外传"
+
+
+def write_pptx(path: Path, rng: random.Random, pages: int, chars_per_page: int = 400, boilerplate: bool = False):
+    """boilerplate=True 时模拟真实课件：每页带同样的页脚，每 5 页插一张一模一样的议程页。"""
+    from pptx import Presentation
+    prs = Presentation()
+    layout = prs.slide_layouts[1]   # 标题 + 正文
+    for p in range(pages):
+        slide = prs.slides.add_slide(layout)
+        body = slide.placeholders[1].text_frame
+        if boilerplate and p % 5 == 0:
+            slide.shapes.title.text = "本讲议程"
+            body.text = _AGENDA
+            body.add_paragraph().text = _FOOTER
+            continue
+        slide.shapes.title.text = f"第 {p + 1} 讲"
+        body.text = zh_text(rng, chars_per_page // 4)
+        for _ in range(3):
+            body.add_paragraph().text = zh_text(rng, chars_per_page // 4)
+        if boilerplate:
+            body.add_paragraph().text = _FOOTER
+    prs.save(str(path))
+
+
+def write_pdf(path: Path, rng: random.Random, pages: int, lines_per_page: int = 45):
+    """最小 PDF：每页一个内容流，Helvetica 10pt 逐行输出。"""
+    objs: List[bytes] = []
+    page_ids = []
+    n_fixed = 3   # 1 Catalog, 2 Pages, 3 Font
+    for p in range(pages):
+        text = [b"BT /F1 10 Tf 12 TL 50 800 Td"]
+        for line in en_lines(rng, lines_per_page):
+            esc = line.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+            text.append(f"({esc}) '".encode("latin-1"))
+        text.append(b"ET")
+        stream = b"\n".join(text)
+        content_id = n_fixed + 2 * p + 1
+        page_id = content_id + 1
+        objs.append(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+        objs.append(b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+                    b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % content_id)
+        page_ids.append(page_id)
+    kids = b" ".join(b"%d 0 R" % i for i in page_ids)
+    fixed = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        b"<< /Type /Pages /Kids [" + kids + b"] /Count %d >>" % pages,
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    body = b"%PDF-1.4\n"
+    offsets = []
+    for i, obj in enumerate(fixed + objs, start=1):
+        offsets.append(len(body))
+        body += b"%d 0 obj\n" % i + obj + b"\nendobj\n"
+    xref = len(body)
+    body += b"xref\n0 %d\n0000000000 65535 f \n" % (len(offsets) + 1)
+    body += b"".join(b"%010d 00000 n \n" % o for o in offsets)
+    body += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(offsets) + 1, xref)
+    path.write_bytes(body)
+
+
+WRITERS = {"pdf": write_pdf, "pptx": write_pptx, "docx": write_docx, "txt": write_txt}
+
+
+def make_corpus(out_dir: Path, files_per_type: int = 2, pages: int = 20, types=tuple(WRITERS), seed: int = 42,
+                boilerplate: bool = False) -> List[Path]:
+    out_dir.mkdir(parents=True, exist_ok=True)
+    rng = random.Random(seed)
+    paths = []
+    for ext in types:
+        for i in range(files_per_type):
+            path = out_dir / f"synthetic_{i + 1}.{ext}"
+            kw = {"boilerplate": True} if boilerplate and ext == "pptx" else {}
+            WRITERS[ext](path, rng, pages, **kw)
+            paths.append(path)
+    return paths
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="生成合成测试语料")
+    ap.add_argument("out_dir")
+    ap.add_argument("--files", type=int, default=2, help="每种格式的文件数")
+    ap.add_argument("--pages", type=int, default=20, help="每个文件的页数 / 幻灯片数")
+    ap.add_argument("--seed", type=int, default=42)
+    ap.add_argument("--boilerplate", action="store_true", help="PPTX 带重复的页脚和议程页（去重基准用）")
+    args = ap.parse_args()
+    for p in make_corpus(Path(args.out_dir), args.files, args.pages, seed=args.seed, boilerplate=args.boilerplate):
+        print(p, p.stat().st_size)
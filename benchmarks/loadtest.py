@@ -0,0 +1,363 @@
+"""
+多会话并发压测：模拟 N 个学生同时使用，逐级加压（--sessions 1,5,10,25,50），每级跑 --duration 秒。
+每个会话循环执行一套真实流程（步骤间有 --think 秒的思考时间）：
+  open     打开项目：读元数据、取索引（共享缓存）、读最近一页聊天记录
+  ask      普通提问（路由 → 回答），写聊天记录
+  plan     “系统复习”类提问（流式 plan → 多工具），写聊天记录
+  quiz     出题并作答，答错写错题本
+  evidence 打开回答的依据（按块 id 取原文）
+默认直接调用核心函数（与 Streamlit 进程里同一套代码、同一个 LLM 连接池）；
+--service URL 时改为通过 service_client 压 RAG 服务（INDEX_ROOT 需与服务共享）；
+--service spawn 时压测自己起一个 service.py 子进程，用同一个 INDEX_ROOT、同样的 --embeddings，
+LLM 通过 RAG_MODEL_BASE_URL 指向模拟服务。压外部已启动的服务时，服务须以
+RAG_MODEL_BASE_URL=<模拟服务地址> 启动（配合 --mock-port 固定端口），否则对话会打到真实 API。
+LLM 用 benchmarks/mock_llm.py 的本地模拟服务，延迟由 --ttft / --tps 控制。
+
+每级输出：完成的流程数与吞吐、各步骤 p50 / p95 / p99、错误率、RSS 增长、聊天记录是否完整，
+结果写成 JSON（benchmarks/results/loadtest_<时间>.json）。
+
+用法：python benchmarks/loadtest.py [--sessions 1,5,10,25,50] [--duration 30] [--projects 2]
+                                    [--embeddings hf|hash] [--ttft 0.3] [--tps 80] [--service URL|spawn]
+"""
+import argparse
+import json
+import os
+import random
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import traceback
+from collections import Counter, defaultdict
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from bench_pipeline import RESULTS_DIR, hash_embeddings, pct, _git_rev  # noqa: E402
+from corpus import make_corpus  # noqa: E402
+from mock_llm import MockLLM  # noqa: E402
+from utils import now_ts  # noqa: E402
+
+_ASK = ["什么是梯度下降", "解释一下矩阵的秩", "概率分布的期望怎么算", "递归和迭代的区别", "为什么要做交叉验证"]
+_PLAN = ["帮我系统复习梯度和优化", "来一套练习巩固概率分布", "完整复习一下极限与导数"]
+
+
+def rss_mb() -> float:
+    """当前常驻内存（MB）；读不到 /proc 时退回峰值 RSS。"""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class Recorder:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.lat: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Counter = Counter()
+        self.error_samples: List[str] = []
+        self.flows = 0
+        self.appended: Counter = Counter()   # 项目 -> 本地写入的聊天记录条数
+
+    def step(self, name: str, fn) -> bool:
+        t0 = time.perf_counter()
+        try:
+            fn()
+        except Exception as e:
+            with self.lock:
+                self.errors[name] += 1
+                if len(self.error_samples) < 5:
+                    self.error_samples.append(f"{name}: {type(e).__name__}: {e}\n{traceback.format_exc(limit=3)}")
+            return False
+        with self.lock:
+            self.lat[name].append((time.perf_counter() - t0) * 1000)
+        return True
+
+
+class LocalSession:
+    """直接调用核心函数，和 Streamlit 页面里的一次交互做同样的事。"""
+
+    def __init__(self, index_root: Path, pid: str, llm, rec: Recorder):
+        self.index_root, self.pid, self.llm, self.rec = index_root, pid, llm, rec
+        self.proj = self.vs = None
+        self.last_answer: Optional[Dict[str, Any]] = None
+
+    def open(self):
+        from project import Project
+        from rag_core import load_index
+        from config import CHAT_WINDOW_RECORDS
+        self.proj = Project(self.index_root / self.pid)
+        self.proj.load_meta()
+        self.vs = load_index(self.proj.index_dir)
+        if self.vs is None:
+            raise RuntimeError("索引未找到")
+        self.proj.load_chats_page(None, CHAT_WINDOW_RECORDS)
+
+    def _turn(self, msg: str) -> List[Dict[str, Any]]:
+        from tools import run_chat_turn
+        from turns import new_turn_id
+        devlog: Dict[str, Any] = {}
+        history = self.proj.load_chats(limit=20)
+        turn_id = new_turn_id()
+        self.proj.append_chat({"t": now_ts(), "role": "user", "kind": "msg", "text": msg, "turn": turn_id})
+        records = run_chat_turn(self.proj, self.vs, self.llm, msg, devlog, history)
+        for r in records:
+            self.proj.append_chat({**r, "turn": turn_id})
+        with self.rec.lock:
+            self.rec.appended[self.pid] += 1 + len(records)
+        if devlog.get("errors"):
+            raise RuntimeError("; ".join(devlog["errors"]))
+        return records
+
+    def ask(self):
+        recs = self._turn(random.choice(_ASK))
+        self.last_answer = next((r for r in recs if r.get("kind") == "answer"), self.last_answer)
+
+    def plan(self):
+        recs = self._turn(random.choice(_PLAN))
+        items = [i for r in recs for i in (r.get("items") or [r])]
+        self.last_answer = next((r for r in items if r.get("kind") == "answer"), self.last_answer)
+
+    def quiz(self):
+        recs = self._turn("/quiz " + random.choice(_ASK))
+        mcq = next((r for r in recs if r.get("kind") == "mcq"), None)
+        if mcq and random.random() < 0.5:   # 一半答错，进错题本
+            data = mcq.get("data") or {}
+            self.proj.log_wrong({
+                "t": now_ts(), "q": data.get("question"), "opts": data.get("options"),
+                "ans": (data.get("answer") or "A")[:1], "ua": "D", "rationale": data.get("rationale", ""),
+                "box": 1, "last": now_ts(),
+            })
+
+    def evidence(self):
+        from rag_core import record_hits
+        if self.last_answer is not None and not record_hits(self.vs, self.last_answer):
+            raise RuntimeError("依据为空")
+
+
+class ServiceSession(LocalSession):
+    """通过 RAG 服务执行对话；错题本仍写本地共享的 INDEX_ROOT。"""
+
+    def __init__(self, index_root: Path, pid: str, client, rec: Recorder):
+        super().__init__(index_root, pid, None, rec)
+        self.client = client
+
+    def open(self):
+        from project import Project
+        from service_client import RemoteIndex
+        from config import CHAT_WINDOW_RECORDS
+        self.proj = Project(self.index_root / self.pid)
+        self.vs = RemoteIndex(self.client, self.pid)
+        self.client.load_chats_page(self.pid, None, CHAT_WINDOW_RECORDS)
+
+    def _turn(self, msg: str) -> List[Dict[str, Any]]:
+        records, errors = [], []
+        for ev in self.client.chat(self.pid, msg):
+            if ev["type"] == "error":
+                errors.append(ev["message"])
+            elif ev["type"] == "done":
+                records = ev.get("records") or []
+        if errors:
+            raise RuntimeError("; ".join(errors))
+        return records
+
+
+def run_level(n: int, duration: float, think: float, make_session, pids: List[str]) -> Dict[str, Any]:
+    rec = Recorder()
+    start_barrier = threading.Barrier(n + 1)
+    deadline = [0.0]
+
+    def worker(i: int):
+        s = make_session(pids[i % len(pids)], rec)
+        start_barrier.wait()
+        while time.perf_counter() < deadline[0]:
+            if not rec.step("open", s.open):
+                time.sleep(think)
+                continue
+            for name in ("ask", "evidence", "quiz", "plan", "evidence"):
+                if time.perf_counter() >= deadline[0]:
+                    return
+                rec.step(name, getattr(s, name))
+                time.sleep(random.uniform(0.5, 1.5) * think)
+            with rec.lock:
+                rec.flows += 1
+
+    threads = [threading.Thread(target=worker, args=(i,), daemon=True) for i in range(n)]
+    for t in threads:
+        t.start()
+    rss0 = rss_mb()
+    t0 = time.perf_counter()
+    deadline[0] = t0 + duration
+    start_barrier.wait()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - t0
+    total_steps = sum(len(v) for v in rec.lat.values()) + sum(rec.errors.values())
+    return {
+        "sessions": n,
+        "elapsed_s": round(elapsed, 2),
+        "flows": rec.flows,
+        "flows_per_min": round(rec.flows / elapsed * 60, 2),
+        "steps_per_s": round(total_steps / elapsed, 2),
+        "error_rate": round(sum(rec.errors.values()) / total_steps, 4) if total_steps else 0.0,
+        "errors": dict(rec.errors),
+        "error_samples": rec.error_samples,
+        "rss_start_mb": round(rss0, 1),
+        "rss_end_mb": round(rss_mb(), 1),
+        "rss_growth_mb": round(rss_mb() - rss0, 1),
+        "steps": {
+            name: {"n": len(v), "p50_ms": round(pct(v, 0.5), 1), "p95_ms": round(pct(v, 0.95), 1),
+                   "p99_ms": round(pct(v, 0.99), 1)}
+            for name, v in sorted(rec.lat.items())
+        },
+        "appended": dict(rec.appended),
+    }
+
+
+def chat_counts(index_root: Path, pids: List[str]) -> Dict[str, int]:
+    from project import Project
+    return {pid: Project(index_root / pid).count_chats() for pid in pids}
+
+
+def check_chats(before: Dict[str, int], after: Dict[str, int], appended: Dict[str, int]) -> Dict[str, Any]:
+    """本地写入模式下核对聊天记录条数：并发追加有没有丢行 / 写坏。"""
+    out = {}
+    for pid, n0 in before.items():
+        expected = n0 + appended.get(pid, 0)
+        out[pid] = {"expected": expected, "actual": after[pid], "ok": after[pid] == expected}
+    return out
+
+
+def build_projects(index_root: Path, n: int, files: int, pages: int) -> List[str]:
+    from ingest import build_project
+    pids = []
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = make_corpus(Path(tmp), files, pages)
+        data = [(p.name, p.read_bytes()) for p in paths]
+        for i in range(n):
+            pids.append(build_project(index_root, f"loadtest_{i + 1}", data).root.name)
+    return pids
+
+
+def spawn_service(index_root: Path, llm_url: str, embeddings: str, timeout: float = 120.0):
+    """起一个指向模拟 LLM 的 service.py 子进程（本脚本的 --serve 模式），等 /health 通了返回 (进程, 地址)。"""
+    import httpx
+    from config import API_ENV_KEY
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    env = {**os.environ, "RAG_MODEL_BASE_URL": llm_url, API_ENV_KEY: "mock"}
+    proc = subprocess.Popen([sys.executable, __file__, "--serve", str(port), "--index-root", str(index_root),
+                             "--embeddings", embeddings], env=env)
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"RAG 服务子进程退出（{proc.returncode}）")
+        try:
+            if httpx.get(url + "/health", timeout=1.0).status_code == 200:
+                return proc, url
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    proc.terminate()
+    raise RuntimeError("RAG 服务子进程启动超时")
+
+
+def serve(port: int, index_root: Path):
+    """--serve 模式：在本进程里跑 service.py（--embeddings 的替换已生效）。"""
+    from aiohttp import web
+    from service import make_app
+    web.run_app(make_app(index_root), host="127.0.0.1", port=port, print=None)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="多会话并发压测")
+    ap.add_argument("--sessions", default="1,5,10,25,50", help="逐级加压的并发会话数")
+    ap.add_argument("--duration", type=float, default=30, help="每级持续秒数")
+    ap.add_argument("--think", type=float, default=1.0, help="步骤间平均思考时间（秒）")
+    ap.add_argument("--projects", type=int, default=2, help="会话轮流分到这几个项目上")
+    ap.add_argument("--files", type=int, default=1)
+    ap.add_argument("--pages", type=int, default=10)
+    ap.add_argument("--embeddings", choices=["hf", "hash"], default="hf")
+    ap.add_argument("--ttft", type=float, default=0.3)
+    ap.add_argument("--tps", type=float, default=80.0)
+    ap.add_argument("--index-root", default="", help="已有的 INDEX_ROOT（--service 时必须与服务共享）；默认临时目录")
+    ap.add_argument("--service", default="",
+                    help="压 RAG 服务（service.py）而不是直接调核心函数；spawn 表示自己起一个指向模拟 LLM 的服务")
+    ap.add_argument("--mock-port", type=int, default=0, help="模拟 LLM 服务的端口（压外部服务时固定下来）")
+    ap.add_argument("--serve", type=int, default=0, help=argparse.SUPPRESS)
+    ap.add_argument("--out", default="")
+    args = ap.parse_args()
+
+    import rag_core
+    if args.embeddings == "hash":
+        _emb = hash_embeddings()
+        rag_core.get_embeddings = lambda: _emb
+    if args.serve:
+        serve(args.serve, Path(args.index_root).resolve())
+        return
+
+    levels = [int(x) for x in args.sessions.split(",") if x.strip()]
+    tmp = tempfile.TemporaryDirectory() if not args.index_root else None
+    index_root = Path(args.index_root or tmp.name).resolve()
+    proc = None
+    report: Dict[str, Any] = {
+        "meta": {"time": time.strftime("%Y-%m-%d %H:%M:%S"), "git": _git_rev(), "cpus": os.cpu_count(), "args": vars(args)},
+        "levels": [],
+    }
+    try:
+        pids = build_projects(index_root, args.projects, args.files, args.pages)
+        with MockLLM(port=args.mock_port, ttft=args.ttft, tps=args.tps) as url:
+            if args.service == "spawn":
+                proc, service_url = spawn_service(index_root, url, args.embeddings)
+            elif args.service:
+                service_url = args.service
+                print(f"模拟 LLM：{url}（外部服务须以 RAG_MODEL_BASE_URL={url} 启动）", file=sys.stderr)
+            if args.service:
+                from service_client import RagClient
+                client = RagClient(service_url)
+
+                def make_session(pid, rec):
+                    return ServiceSession(index_root, pid, client, rec)
+            else:
+                from ds_client import LLMTransport
+                llm = LLMTransport(api_key="mock", base_url=url)
+
+                def make_session(pid, rec):
+                    return LocalSession(index_root, pid, llm, rec)
+
+            for n in levels:
+                print(f"== {n} 个会话，{args.duration:.0f}s ==", file=sys.stderr)
+                before = chat_counts(index_root, pids)
+                level = run_level(n, args.duration, args.think, make_session, pids)
+                if not args.service:
+                    level["chat_integrity"] = check_chats(before, chat_counts(index_root, pids), level["appended"])
+                report["levels"].append(level)
+                print(json.dumps({k: level[k] for k in ("sessions", "flows_per_min", "steps_per_s", "error_rate",
+                                                         "rss_growth_mb")}, ensure_ascii=False), file=sys.stderr)
+    finally:
+        if proc is not None:
+            proc.terminate()
+            proc.wait()
+        if tmp is not None:
+            tmp.cleanup()
+
+    out_path = Path(args.out) if args.out else RESULTS_DIR / f"loadtest_{time.strftime('%Y%m%d_%H%M%S')}.json"
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+    out_path.write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8")
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    print(f"结果已写入 {out_path}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
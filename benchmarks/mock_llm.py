@@ -0,0 +1,214 @@
+"""
+本地 OpenAI 兼容的模拟 LLM 服务（基准测试 / 压测用，不花钱、延迟可控）：
+- POST /v1/chat/completions，支持 stream=True（SSE）与 stream_options.include_usage
+- 按 system prompt 认出是哪个调用（路由 / 是否 plan / plan / 改写 / 出题 / 批量出题 / 卡片 / 导图 / 回答），
+  返回能被 tools.py / llm.py 正常解析的内容
+- --ttft 首 token 延迟（秒），--tps 每秒 token 数，--jitter 延迟随机抖动比例
+- GET /stats 返回累计请求数与在飞请求数
+
+用法：python benchmarks/mock_llm.py [--port 8901] [--ttft 0.3] [--tps 80]
+代码里：with MockLLM(ttft=0.1, tps=200) as url: LLMTransport(api_key="mock", base_url=url)
+"""
+import argparse
+import asyncio
+import json
+import random
+import re
+import threading
+import time
+from typing import Any, Dict, List, Optional
+from aiohttp import web
+
+_PARA = ("这一部分介绍的核心概念需要结合定义、性质与典型例题来理解。"
+         "先给出直观解释，再说明适用条件和常见误区，最后总结要点。")
+
+
+def _user_text(messages: List[Dict[str, str]]) -> str:
+    user = next((m["content"] for m in reversed(messages) if m.get("role") == "user"), "")
+    m = re.search(r"用户输入是：(.*?)(?:\n|$)", user)
+    return (m.group(1) if m else user).strip()
+
+
+def _mcq(i: int, topic: str) -> Dict[str, Any]:
+    ans = "ABCD"[i % 4]
+    return {
+        "question": f"关于「{topic[:20]}」，下列说法正确的是？（第 {i + 1} 题）",
+        "options": [f"{c}. 选项 {c}：{_PARA[:16]}" for c in "ABCD"],
+        "answer": ans,
+        "rationale": f"根据讲义中的定义，正确答案是 {ans}。",
+    }
+
+
+def respond(messages: List[Dict[str, str]], answer_tokens: int = 200) -> str:
+    """按 prompt 类型生成可解析的假回复。"""
+    system = next((m["content"] for m in messages if m.get("role") == "system"), "")
+    text = _user_text(messages)
+    if "路由器" in system:
+        tool = ("quiz" if re.search(r"/quiz|出题|练习|测一测", text) else
+                "card" if re.search(r"/card|卡片|知识点", text) else
+                "map" if re.search(r"/map|导图|框架|结构", text) else "answer")
+        return json.dumps({"tool": tool, "topic": text[:40]}, ensure_ascii=False)
+    if "use_plan" in system:
+        return json.dumps({"use_plan": bool(re.search(r"系统复习|综合训练|一套|完整复习", text))})
+    if '"steps"' in system:
+        q = re.sub(r"\s+", " ", text)[:30]
+        return json.dumps({"steps": [
+            {"id": 1, "tool": "answer", "topic": q, "instruction": "先讲解核心概念"},
+            {"id": 2, "tool": "quiz", "topic": q, "instruction": "出一组巩固题", "n_questions": 3},
+            {"id": 3, "tool": "card", "topic": q, "instruction": "总结成知识卡片"},
+        ]}, ensure_ascii=False, indent=2)
+    if "查询改写" in system:
+        m = re.search(r"\[当前问题\]\n(.*)", text, re.S)
+        return (m.group(1) if m else text).strip()
+    if "JSON数组" in system:
+        n = int((re.search(r"(\d+)\s*道", text) or [None, 3])[1])
+        return json.dumps([_mcq(i, text) for i in range(n)], ensure_ascii=False)
+    if "JSON样式" in system:
+        return json.dumps(_mcq(0, text), ensure_ascii=False)
+    if "思维导图" in system:
+        return "# 主题\n" + "".join(f"## 分支 {i}\n- 要点 {i}.1\n- 要点 {i}.2\n" for i in range(1, 5))
+    if "卡片" in system:
+        return "# 知识卡片\n" + "".join(f"- **要点 {i}**：{_PARA[:30]}\n" for i in range(1, 6))
+    # 普通回答：大约 answer_tokens 个 token（按 2 字一个 token 估）
+    body = (_PARA * (answer_tokens * 2 // len(_PARA) + 1))[: answer_tokens * 2]
+    return body + "\n\n[1] 参考依据。"
+
+
+def _tokens(text: str) -> List[str]:
+    """每两个字符算一个伪 token。"""
+    return [text[i:i + 2] for i in range(0, len(text), 2)]
+
+
+class MockLLMApp:
+    def __init__(self, ttft: float = 0.3, tps: float = 80.0, jitter: float = 0.1, answer_tokens: int = 200):
+        self.ttft = ttft
+        self.tps = tps
+        self.jitter = jitter
+        self.answer_tokens = answer_tokens
+        self.requests = 0
+        self.inflight = 0
+        self.max_inflight = 0
+
+    def _delay(self, base: float) -> float:
+        return max(0.0, base * (1 + random.uniform(-self.jitter, self.jitter)))
+
+    async def stats(self, request: web.Request) -> web.Response:
+        return web.json_response({"requests": self.requests, "inflight": self.inflight, "max_inflight": self.max_inflight})
+
+    async def completions(self, request: web.Request) -> web.StreamResponse:
+        body = await request.json()
+        messages = body.get("messages") or []
+        self.requests += 1
+        self.inflight += 1
+        self.max_inflight = max(self.max_inflight, self.inflight)
+        try:
+            content = respond(messages, self.answer_tokens)
+            toks = _tokens(content)
+            prompt_tokens = sum(len(m.get("content", "")) for m in messages) // 2
+            usage = {"prompt_tokens": prompt_tokens, "completion_tokens": len(toks),
+                     "total_tokens": prompt_tokens + len(toks), "prompt_cache_hit_tokens": 0}
+            rid = f"mock-{self.requests}"
+            created = int(time.time())
+            model = body.get("model", "mock")
+            per_tok = 1.0 / self.tps if self.tps > 0 else 0.0
+            await asyncio.sleep(self._delay(self.ttft))
+
+            if not body.get("stream"):
+                await asyncio.sleep(self._delay(per_tok * len(toks)))
+                return web.json_response({
+                    "id": rid, "object": "chat.completion", "created": created, "model": model,
+                    "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+                    "usage": usage,
+                })
+
+            resp = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+            await resp.prepare(request)
+
+            async def send(obj):
+                await resp.write(f"data: {json.dumps(obj, ensure_ascii=False)}\n\n".encode("utf-8"))
+
+            def chunk(delta, finish=None):
+                return {"id": rid, "object": "chat.completion.chunk", "created": created, "model": model,
+                        "choices": [{"index": 0, "delta": delta, "finish_reason": finish}]}
+
+            await send(chunk({"role": "assistant", "content": ""}))
+            # 每 4 个 token 发一次，速率按 tps 控制
+            for i in range(0, len(toks), 4):
+                await send(chunk({"content": "".join(toks[i:i + 4])}))
+                await asyncio.sleep(self._delay(per_tok * 4))
+            await send(chunk({}, "stop"))
+            if (body.get("stream_options") or {}).get("include_usage"):
+                await send({"id": rid, "object": "chat.completion.chunk", "created": created, "model": model,
+                            "choices": [], "usage": usage})
+            await resp.write(b"data: [DONE]\n\n")
+            await resp.write_eof()
+            return resp
+        finally:
+            self.inflight -= 1
+
+    def make_app(self) -> web.Application:
+        app = web.Application()
+        app.add_routes([
+            web.post("/v1/chat/completions", self.completions),
+            web.post("/chat/completions", self.completions),
+            web.get("/stats", self.stats),
+        ])
+        return app
+
+
+class MockLLM:
+    """在后台线程里起模拟服务；with 块内返回 base_url（形如 http://127.0.0.1:PORT/v1）。"""
+
+    def __init__(self, port: int = 0, **kwargs):
+        self.port = port
+        self.app = MockLLMApp(**kwargs)
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._runner: Optional[web.AppRunner] = None
+        self._ready = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _serve(self):
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        self._runner = web.AppRunner(self.app.make_app())
+        self._loop.run_until_complete(self._runner.setup())
+        site = web.TCPSite(self._runner, "127.0.0.1", self.port)
+        self._loop.run_until_complete(site.start())
+        self.port = site._server.sockets[0].getsockname()[1]
+        self._ready.set()
+        self._loop.run_forever()
+        self._loop.run_until_complete(self._runner.cleanup())
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.port}/v1"
+
+    def start(self) -> str:
+        self._thread = threading.Thread(target=self._serve, name="mock-llm", daemon=True)
+        self._thread.start()
+        self._ready.wait(10)
+        return self.url
+
+    def stop(self):
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+        if self._thread is not None:
+            self._thread.join(5)
+
+    def __enter__(self) -> str:
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="OpenAI 兼容的模拟 LLM 服务")
+    ap.add_argument("--port", type=int, default=8901)
+    ap.add_argument("--ttft", type=float, default=0.3, help="首 token 延迟（秒）")
+    ap.add_argument("--tps", type=float, default=80.0, help="每秒 token 数")
+    ap.add_argument("--jitter", type=float, default=0.1)
+    ap.add_argument("--answer-tokens", type=int, default=200)
+    args = ap.parse_args()
+    app = MockLLMApp(args.ttft, args.tps, args.jitter, args.answer_tokens)
+    web.run_app(app.make_app(), host="127.0.0.1", port=args.port)
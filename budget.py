@@ -0,0 +1,192 @@
+# budget.py
+"""
+按真实 token 数控制 prompt 长度，取代散落各处的字符截断。
+- get_tokenizer: 进程内缓存的 tokenizer（优先 DeepSeek 官方，其次 tiktoken，最后按字符估算）；
+  只读本地文件 / 缓存，不在第一次提问时联网下载，warmup 里提前加载
+- fit_pieces: 把若干片段压进 max_tokens，短的保留原样，剩余额度平均分给长的
+- TokenBudget: 按份额把一次调用的预算分给 检索上下文 / 黑板产物 / 指示，用不完的额度让给其他部分
+"""
+import hashlib
+import os
+import re
+import tempfile
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, List, Optional
+from config import TOKENIZER_NAME, TOKENIZER_PATH, PROMPT_TOKEN_BUDGET, BUDGET_SHARES
+
+_CJK = re.compile(r"[\u3000-\u303f\u3400-\u9fff\uff00-\uffef]")
+
+
+class _HFTokenizer:
+    name = "hf"
+
+    def __init__(self, tok):
+        self.tok = tok
+
+    def count(self, text: str) -> int:
+        return len(self.tok.encode(text, add_special_tokens=False).ids)
+
+    def truncate(self, text: str, n: int) -> str:
+        enc = self.tok.encode(text, add_special_tokens=False)
+        if len(enc.ids) <= n:
+            return text
+        return text[:enc.offsets[n - 1][1]] if n > 0 else ""
+
+
+class _TiktokenTokenizer:
+    name = "tiktoken"
+
+    def __init__(self, enc):
+        self.enc = enc
+
+    def count(self, text: str) -> int:
+        return len(self.enc.encode(text, disallowed_special=()))
+
+    def truncate(self, text: str, n: int) -> str:
+        ids = self.enc.encode(text, disallowed_special=())
+        if len(ids) <= n:
+            return text
+        return self.enc.decode_bytes(ids[:n]).decode("utf-8", errors="ignore")
+
+
+class _CharEstimator:
+    """没有可用 tokenizer 时的估算：中文约 0.6 token/字，其余约 0.3 token/字符（DeepSeek 文档口径）。"""
+    name = "estimate"
+
+    @staticmethod
+    def _cost(ch: str) -> float:
+        return 0.6 if _CJK.match(ch) else 0.3
+
+    def count(self, text: str) -> int:
+        return int(sum(self._cost(ch) for ch in text) + 0.999)
+
+    def truncate(self, text: str, n: int) -> str:
+        acc = 0.0
+        for i, ch in enumerate(text):
+            acc += self._cost(ch)
+            if acc > n:
+                return text[:i]
+        return text
+
+
+_TIKTOKEN_BLOB = "https://openaipublic.blob.core.windows.net/encodings/cl100k_base.tiktoken"
+
+
+def _local_tokenizer_file() -> Optional[str]:
+    """RAG_TOKENIZER_PATH，或 HF 缓存里已下载的 TOKENIZER_NAME；都没有返回 None（不联网）。"""
+    if TOKENIZER_PATH:
+        p = Path(TOKENIZER_PATH)
+        p = p / "tokenizer.json" if p.is_dir() else p
+        return str(p) if p.is_file() else None
+    try:
+        from huggingface_hub import try_to_load_from_cache
+    except ImportError:
+        return None
+    path = try_to_load_from_cache(TOKENIZER_NAME, "tokenizer.json")
+    return path if isinstance(path, str) else None
+
+
+def _tiktoken_cached() -> bool:
+    """tiktoken 的编码表已在本地缓存里（与 tiktoken.load.read_file_cached 的缓存位置一致）。"""
+    cache_dir = (os.environ.get("TIKTOKEN_CACHE_DIR") or os.environ.get("DATA_GYM_CACHE_DIR")
+                 or os.path.join(tempfile.gettempdir(), "data-gym-cache"))
+    return os.path.exists(os.path.join(cache_dir, hashlib.sha1(_TIKTOKEN_BLOB.encode()).hexdigest()))
+
+
+@lru_cache(maxsize=1)
+def get_tokenizer():
+    path = _local_tokenizer_file()
+    if path:
+        try:
+            from tokenizers import Tokenizer
+            return _HFTokenizer(Tokenizer.from_file(path))
+        except Exception:
+            pass
+    if _tiktoken_cached():
+        try:
+            import tiktoken
+            return _TiktokenTokenizer(tiktoken.get_encoding("cl100k_base"))
+        except Exception:
+            pass
+    return _CharEstimator()
+
+
+@lru_cache(maxsize=4096)
+def count_tokens(text: str) -> int:
+    # 检索片段、黑板产物会在多次调用间重复出现，按文本缓存计数
+    return get_tokenizer().count(text) if text else 0
+
+
+def truncate_tokens(text: str, n: int) -> str:
+    if n <= 0:
+        return ""
+    if count_tokens(text) <= n:
+        return text
+    return get_tokenizer().truncate(text, n)
+
+
+def _water_fill(demands: Dict[str, int], weights: Dict[str, float], total: int) -> Dict[str, int]:
+    """按权重分配 total：需求小于份额的先满足，省下的额度继续按权重分给其余部分。"""
+    alloc = {k: 0 for k in demands}
+    active = {k for k, d in demands.items() if d > 0}
+    remaining = total
+    while active and remaining > 0:
+        wsum = sum(weights.get(k, 0.0) or 1e-9 for k in active)
+        satisfied = {
+            k for k in active
+            if demands[k] <= remaining * (weights.get(k, 0.0) or 1e-9) / wsum
+        }
+        if not satisfied:
+            for k in active:
+                alloc[k] = int(remaining * (weights.get(k, 0.0) or 1e-9) / wsum)
+            break
+        for k in satisfied:
+            alloc[k] = demands[k]
+            remaining -= demands[k]
+        active -= satisfied
+    return alloc
+
+
+def fit_pieces(pieces: List[str], max_tokens: int) -> List[str]:
+    """把多个片段压进 max_tokens，每段至少保留开头部分，不会整段丢弃后面的片段。"""
+    demands = {str(i): count_tokens(p) for i, p in enumerate(pieces)}
+    if sum(demands.values()) <= max_tokens:
+        return list(pieces)
+    alloc = _water_fill(demands, {k: 1.0 for k in demands}, max_tokens)
+    return [truncate_tokens(p, alloc[str(i)]) for i, p in enumerate(pieces)]
+
+
+class TokenBudget:
+    def __init__(self, total: int = PROMPT_TOKEN_BUDGET, shares: Optional[Dict[str, float]] = None):
+        self.total = total
+        self.shares = dict(shares or BUDGET_SHARES)
+        self.report: Dict[str, int] = {}
+
+    def cap(self, part: str) -> int:
+        """某一部分在“其他部分都用满”时的保底额度。"""
+        return int(self.total * self.shares.get(part, 0.0))
+
+    def fit(self, parts: Dict[str, List[str]]) -> Dict[str, List[str]]:
+        """
+        parts: {"context": [...], "artifacts": [...], "instruction": [...]}，每部分是若干片段。
+        返回同结构、已按预算截断的片段，最终 token 数记在 self.report 里。
+        """
+        demands = {k: sum(count_tokens(p) for p in v) for k, v in parts.items()}
+        alloc = _water_fill(demands, self.shares, self.total)
+        out = {k: fit_pieces(v, alloc[k]) for k, v in parts.items()}
+        self.report = {k: sum(count_tokens(p) for p in v) for k, v in out.items()}
+        self.report["total"] = sum(self.report.values())
+        return out
+
+    def to_devlog(self, devlog: Dict[str, object], tag: str):
+        used = ", ".join(f"{k}={v}" for k, v in self.report.items())
+        devlog[f"{tag}_token_budget"] = f"{used} / budget={self.total} ({get_tokenizer().name})"
+
+
+if __name__ == "__main__":
+    # 部署时执行一次：把 TOKENIZER_NAME 下载进 HF 缓存，之后 get_tokenizer 离线加载
+    from huggingface_hub import hf_hub_download
+    print(hf_hub_download(TOKENIZER_NAME, "tokenizer.json"))
+    get_tokenizer.cache_clear()
+    print(f"tokenizer: {get_tokenizer().name}")
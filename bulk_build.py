@@ -0,0 +1,149 @@
+"""
+离线批量建项目：给一个目录树，每个子文件夹（一门课）建 / 更新一个项目。
+- 目录名用 slugify_name(文件夹名)，显示名就是文件夹名；注册表里已有同名项目时沿用它的目录
+- 源文件哈希（sha256）记在 project.json 的 source_hashes 里，没变的文件夹直接跳过；
+  变了的整体重建索引（聊天记录 / 错题本保留）
+- 多进程并行建索引：每个工作进程只加载一次向量模型（rag_core.get_embeddings 的进程内缓存），
+  并按进程数平分 CPU 线程，避免多个模型抢同一批核；设置了 RAG_EMBED_SOCKET 时各进程共用
+  embed_server.py 里的那一份模型，请求在服务端合批
+
+用法：python bulk_build.py <课程目录> [--index-root ./projects] [--workers 2] [--force] [--dry-run]
+"""
+import argparse
+import hashlib
+import json
+import multiprocessing as mp
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from typing import Any, Dict, List, Tuple
+from config import DEFAULT_INDEX_ROOT
+from ingest import SUPPORTED_EXTS
+from project import Project
+from registry import ProjectRegistry
+from utils import slugify_name
+
+
+def file_sha256(path: Path) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for buf in iter(lambda: f.read(1 << 20), b""):
+            h.update(buf)
+    return h.hexdigest()
+
+
+def scan_course(folder: Path) -> Dict[str, Path]:
+    """文件夹内（含子目录）所有支持的文件：{存储文件名: 路径}；子目录用 __ 拼进文件名，避免重名。"""
+    found = {}
+    for p in sorted(folder.rglob("*")):
+        if p.is_file() and p.suffix.lower().lstrip(".") in SUPPORTED_EXTS and not p.name.startswith("."):
+            found[p.relative_to(folder).as_posix().replace("/", "__")] = p
+    return found
+
+
+def plan_builds(src_root: Path, index_root: Path, force: bool = False) -> List[Dict[str, Any]]:
+    """每个子文件夹一项：{name, dir_name, files, hashes, action: create|update|skip}。"""
+    by_name = {e["name"]: e["id"] for e in ProjectRegistry(index_root).list()}
+    taken = set()
+    jobs = []
+    for folder in sorted(p for p in src_root.iterdir() if p.is_dir() and not p.name.startswith(".")):
+        files = scan_course(folder)
+        if not files:
+            continue
+        name = folder.name
+        dir_name = by_name.get(name)
+        if not dir_name:
+            # 新项目：slug 与别的项目（或本次已分配的）撞名时加后缀
+            base = slugify_name(name)
+            dir_name, n = base, 1
+            while dir_name in taken or (index_root / dir_name).exists():
+                n += 1
+                dir_name = f"{base}_{n}"
+        taken.add(dir_name)
+        hashes = {fname: file_sha256(p) for fname, p in files.items()}
+        proj = Project(index_root / dir_name)
+        if not proj.exists():
+            action = "create"
+        else:
+            proj.load_meta()
+            unchanged = proj.meta.get("source_hashes") == hashes and proj.index_dir.exists()
+            action = "skip" if unchanged and not force else "update"
+        jobs.append({
+            "name": name,
+            "dir_name": dir_name,
+            "files": {k: str(v) for k, v in files.items()},
+            "hashes": hashes,
+            "action": action,
+        })
+    return jobs
+
+
+def _init_worker(threads: int):
+    """工作进程启动时加载一次向量模型，之后这个进程里的所有项目共用。"""
+    try:
+        import torch
+        torch.set_num_threads(threads)
+    except ImportError:
+        pass
+    from rag_core import get_embeddings
+    get_embeddings()
+
+
+def _build_one(index_root: str, job: Dict[str, Any]) -> Tuple[str, float]:
+    from ingest import build_project
+    t0 = time.perf_counter()
+    files = [(fname, Path(path).read_bytes()) for fname, path in job["files"].items()]
+    build_project(
+        Path(index_root), job["name"], files,
+        dir_name=job["dir_name"],
+        update=True,
+        extra_meta={"source_hashes": job["hashes"]},
+    )
+    return job["dir_name"], time.perf_counter() - t0
+
+
+def bulk_build(src_root: Path, index_root: Path, workers: int = 2, force: bool = False, dry_run: bool = False) -> Dict[str, Any]:
+    index_root.mkdir(parents=True, exist_ok=True)
+    jobs = plan_builds(src_root, index_root, force)
+    todo = [j for j in jobs if j["action"] != "skip"]
+    for j in jobs:
+        print(f"{j['action']:6s} {j['dir_name']}  ({j['name']}, {len(j['files'])} 个文件)", file=sys.stderr)
+    result: Dict[str, Any] = {
+        "folders": len(jobs),
+        "skipped": len(jobs) - len(todo),
+        "built": [],
+        "failed": {},
+    }
+    if dry_run or not todo:
+        return result
+
+    workers = max(1, min(workers, len(todo)))
+    threads = max(1, (os.cpu_count() or 1) // workers)
+    # spawn：FAISS / torch 的线程状态不适合 fork 复制
+    ctx = mp.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=ctx, initializer=_init_worker, initargs=(threads,)) as pool:
+        futs = {pool.submit(_build_one, str(index_root), j): j for j in todo}
+        for fut in as_completed(futs):
+            j = futs[fut]
+            try:
+                dir_name, secs = fut.result()
+                result["built"].append(dir_name)
+                print(f"完成 {dir_name}  {secs:.1f}s", file=sys.stderr)
+            except Exception as e:
+                result["failed"][j["dir_name"]] = f"{type(e).__name__}: {e}"
+                print(f"失败 {j['dir_name']}  {e}", file=sys.stderr)
+    return result
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="按子文件夹批量建 / 更新项目索引")
+    ap.add_argument("src", help="课程目录，每个子文件夹一个项目")
+    ap.add_argument("--index-root", default=str(DEFAULT_INDEX_ROOT))
+    ap.add_argument("--workers", type=int, default=2, help="并行进程数（每个进程各加载一份向量模型）")
+    ap.add_argument("--force", action="store_true", help="忽略哈希，全部重建")
+    ap.add_argument("--dry-run", action="store_true", help="只列出要建 / 更新 / 跳过的项目")
+    args = ap.parse_args()
+    out = bulk_build(Path(args.src).resolve(), Path(args.index_root).resolve(), args.workers, args.force, args.dry_run)
+    print(json.dumps(out, ensure_ascii=False, indent=2))
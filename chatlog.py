@@ -0,0 +1,483 @@
+import gzip
+import hashlib
+import json
+import os
+import struct
+import threading
+from functools import lru_cache
+from pathlib import Path
+from typing import Callable, Dict, Any, List, Optional, Tuple
+from utils import file_lock, wrong_due_at
+from config import CHAT_ACTIVE_MAX_RECORDS, CHAT_ACTIVE_KEEP_RECORDS, CHAT_SEGMENT_RECORDS
+
+try:
+    import zstandard as _zstd
+except Exception:       # 没装 zstandard 时退回标准库 gzip
+    _zstd = None
+
+_OFF = struct.Struct("<Q")
+_locks: Dict[str, threading.RLock] = {}
+_locks_guard = threading.Lock()
+
+
+def _lock_for(path: Path) -> threading.RLock:
+    # 可重入：分段日志在持锁压缩时还会调用尾段自身的读写方法
+    key = str(path.resolve())
+    with _locks_guard:
+        if key not in _locks:
+            _locks[key] = threading.RLock()
+        return _locks[key]
+
+
+class JsonlLog:
+    """
+    追加写的 JSONL 文件 + 偏移量索引（同目录下 <文件名>.idx，每条记录 8 字节起始偏移）。
+    - append: 写记录的同时追加偏移
+    - tail(n) / page(before, n): 按偏移直接 seek，只读需要的 n 条，与文件总长度无关
+    - 索引缺失或落后（老项目、写到一半中断）时，从已索引的末尾往后补扫，不会整文件重扫
+    - 写入与补扫索引都持有跨进程文件锁（locked），多个进程同时写同一个项目也不会错位
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.idx_path = path.with_name(path.name + ".idx")
+        self._lock = _lock_for(path)
+
+    def locked(self):
+        """线程锁 + 跨进程文件锁（锁 <文件名>.lock：日志本身会被 os.replace 换掉，不能锁它）。"""
+        return file_lock(self.path.with_name(self.path.name + ".lock"), self._lock)
+
+    # --- 索引维护 ---
+    def _read_offsets(self, start: int, end: int) -> List[int]:
+        with open(self.idx_path, "rb") as f:
+            f.seek(start * _OFF.size)
+            buf = f.read((end - start) * _OFF.size)
+        return [o for (o,) in _OFF.iter_unpack(buf)]
+
+    def _rebuild_from(self, n_keep: int, pos: int):
+        """保留前 n_keep 条偏移，从文件位置 pos 开始扫描补齐后面的行。"""
+        offsets: List[int] = []
+        with open(self.path, "rb") as f:
+            f.seek(pos)
+            while True:
+                line = f.readline()
+                if not line:
+                    break
+                if line.endswith(b"\n"):
+                    if line.strip():
+                        offsets.append(pos)
+                    pos += len(line)
+                else:
+                    break   # 末尾半行（写入中断），等下次补全再索引
+        mode = "r+b" if self.idx_path.exists() else "wb"
+        with open(self.idx_path, mode) as f:
+            f.truncate(n_keep * _OFF.size)
+            f.seek(n_keep * _OFF.size)
+            f.write(b"".join(_OFF.pack(o) for o in offsets))
+
+    def _sync(self) -> int:
+        """保证索引覆盖文件中所有完整的行，返回记录条数。"""
+        if not self.path.exists():
+            return 0
+        size = self.path.stat().st_size
+        n = self.idx_path.stat().st_size // _OFF.size if self.idx_path.exists() else 0
+        if n == 0:
+            if size:
+                self._rebuild_from(0, 0)
+            return self._count()
+        last = self._read_offsets(n - 1, n)[0]
+        if last >= size:
+            # 文件被截断或整体改写过，索引失效
+            self._rebuild_from(0, 0)
+            return self._count()
+        with open(self.path, "rb") as f:
+            f.seek(last)
+            end = last + len(f.readline())
+        if end < size:
+            self._rebuild_from(n, end)
+        return self._count()
+
+    def _count(self) -> int:
+        return self.idx_path.stat().st_size // _OFF.size if self.idx_path.exists() else 0
+
+    # --- 读写 ---
+    def append(self, record: Dict[str, Any]):
+        data = (json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8")
+        with self.locked():
+            self._sync()
+            with open(self.path, "ab") as f:
+                off = f.seek(0, os.SEEK_END)
+                f.write(data)
+            with open(self.idx_path, "ab") as f:
+                f.write(_OFF.pack(off))
+
+    def count(self) -> int:
+        with self.locked():
+            return self._sync()
+
+    def read_range(self, start: int, end: int) -> List[Dict[str, Any]]:
+        """读第 [start, end) 条记录；坏行跳过。读文件也在锁内：放锁后别的进程可能整体改写，偏移就对不上了。"""
+        out: List[Dict[str, Any]] = []
+        with self.locked():
+            total = self._sync()
+            start, end = max(0, start), min(end, total)
+            if start >= end:
+                return []
+            offsets = self._read_offsets(start, end)
+            with open(self.path, "rb") as f:
+                # 偏移递增且基本连续，只在有空行间隔时才重新 seek
+                f.seek(offsets[0])
+                for off in offsets:
+                    if f.tell() != off:
+                        f.seek(off)
+                    line = f.readline()
+                    try:
+                        out.append(json.loads(line))
+                    except Exception:
+                        pass
+        return out
+
+    def tail(self, n: int) -> List[Dict[str, Any]]:
+        return self.page(None, n)[0]
+
+    def page(self, before: Optional[int], n: int) -> Tuple[List[Dict[str, Any]], int]:
+        """
+        取第 before 条之前的 n 条（before=None 表示从末尾算起）。
+        返回 (记录列表, 第一条的序号)；序号为 0 说明已经到最早的记录。
+        """
+        with self.locked():   # 条数和读取用同一次加锁，中间不会被改写
+            end = self.count() if before is None else before
+            start = max(0, end - n)
+            return self.read_range(start, end), start
+
+    def read_all(self) -> List[Dict[str, Any]]:
+        with self.locked():
+            return self.read_range(0, self.count())
+
+    def rewrite(self, records: List[Dict[str, Any]]):
+        """整体改写（压缩 / 迁移用），文件与索引一起原子替换。"""
+        tmp = self.path.with_name(self.path.name + ".tmp")
+        tmp_idx = self.idx_path.with_name(self.idx_path.name + ".tmp")
+        with self.locked():
+            offsets: List[int] = []
+            with open(tmp, "wb") as f:
+                for rec in records:
+                    offsets.append(f.tell())
+                    f.write((json.dumps(rec, ensure_ascii=False) + "\n").encode("utf-8"))
+            tmp_idx.write_bytes(b"".join(_OFF.pack(o) for o in offsets))
+            # 先删旧索引：中途崩溃时最多触发一次全量重建，不会留下错位的索引
+            self.idx_path.unlink(missing_ok=True)
+            os.replace(tmp, self.path)
+            os.replace(tmp_idx, self.idx_path)
+
+
+def _compress(data: bytes) -> Tuple[bytes, str]:
+    if _zstd is not None:
+        return _zstd.ZstdCompressor(level=10).compress(data), "zst"
+    return gzip.compress(data, compresslevel=6), "gz"
+
+
+def _decompress(data: bytes, codec: str) -> bytes:
+    if codec == "zst":
+        if _zstd is None:
+            raise RuntimeError("读取 .zst 分段需要安装 zstandard")
+        return _zstd.ZstdDecompressor().decompressobj().decompress(data)
+    return gzip.decompress(data)
+
+
+def _digest(rec: Dict[str, Any]) -> str:
+    return hashlib.sha1(json.dumps(rec, ensure_ascii=False, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+_seg_cache: Dict[str, Tuple[int, List[Dict[str, Any]]]] = {}
+
+
+@lru_cache(maxsize=8)
+def _read_segment(path: str, codec: str, mtime_ns: int) -> Tuple[Dict[str, Any], ...]:
+    # 按 (路径, mtime) 缓存最近读过的几个分段，翻页时不反复解压
+    raw = _decompress(Path(path).read_bytes(), codec)
+    out = []
+    for line in raw.splitlines():
+        try:
+            out.append(json.loads(line))
+        except Exception:
+            pass
+    return tuple(out)
+
+
+class SegmentedChatLog:
+    """
+    分段的聊天日志：
+    - 活跃尾段：chats.jsonl（JsonlLog，未压缩，追加写）
+    - 历史分段：chats.d/seg-<起始序号>.jsonl.zst（或 .gz），每段旁边有 seg-<起始序号>.json 小索引，
+      记录 序号范围 / 条数 / 时间范围 / 压缩前后大小
+    - compact(): 活跃段超过 CHAT_ACTIVE_MAX_RECORDS 条时，把较早的记录滚成若干压缩分段，
+      只留最近 CHAT_ACTIVE_KEEP_RECORDS 条在尾段
+    - page / export 按序号或时间范围只读相关的分段
+    """
+
+    def __init__(self, root: Path):
+        self.active = JsonlLog(root / "chats.jsonl")
+        self.seg_dir = root / "chats.d"
+        self._lock = self.active._lock
+
+    def locked(self):
+        return self.active.locked()
+
+    # --- 分段索引 ---
+    def segments(self) -> List[Dict[str, Any]]:
+        """所有分段的小索引（按序号排序）；分段目录没变时直接用进程内缓存。"""
+        if not self.seg_dir.exists():
+            return []
+        key = str(self.seg_dir)
+        mtime = self.seg_dir.stat().st_mtime_ns
+        cached = _seg_cache.get(key)
+        if cached and cached[0] == mtime:
+            return cached[1]
+        out = []
+        for p in sorted(self.seg_dir.glob("seg-*.json")):
+            try:
+                out.append(json.loads(p.read_text(encoding="utf-8")))
+            except Exception:
+                pass
+        _seg_cache[key] = (mtime, out)
+        return out
+
+    def _seg_records(self, seg: Dict[str, Any]) -> Tuple[Dict[str, Any], ...]:
+        path = self.seg_dir / seg["file"]
+        return _read_segment(str(path), seg["codec"], path.stat().st_mtime_ns)
+
+    def _archived(self) -> int:
+        segs = self.segments()
+        return segs[-1]["first"] + segs[-1]["count"] if segs else 0
+
+    # --- 读写 ---
+    def append(self, record: Dict[str, Any]):
+        self.active.append(record)
+
+    def count(self) -> int:
+        with self.locked():
+            return self._archived() + self.active.count()
+
+    def read_range(self, start: int, end: int) -> List[Dict[str, Any]]:
+        # 分段列表和尾段要在同一次加锁里读：中间若有 compact 把尾段滚进分段，序号会错开
+        with self.locked():
+            segs = self.segments()
+            archived = segs[-1]["first"] + segs[-1]["count"] if segs else 0
+            out: List[Dict[str, Any]] = []
+            for seg in segs:
+                lo, hi = seg["first"], seg["first"] + seg["count"]
+                if hi <= start or lo >= end:
+                    continue
+                recs = self._seg_records(seg)
+                out.extend(recs[max(start, lo) - lo:min(end, hi) - lo])
+            if end > archived:
+                out.extend(self.active.read_range(max(0, start - archived), end - archived))
+        return out
+
+    def page(self, before: Optional[int], n: int) -> Tuple[List[Dict[str, Any]], int]:
+        with self.locked():
+            end = self.count() if before is None else before
+            start = max(0, end - n)
+            return self.read_range(start, end), start
+
+    def read_all(self) -> List[Dict[str, Any]]:
+        with self.locked():
+            return self.read_range(0, self.count())
+
+    def export(self, since: Optional[int] = None, until: Optional[int] = None) -> bytes:
+        """导出 JSONL；给了时间范围时，跳过时间范围不相交的分段，不去解压。"""
+        with self.locked():   # 分段和尾段一起读，同 read_range
+            if since is None and until is None and not self.segments():
+                return self.active.path.read_bytes() if self.active.path.exists() else b""
+
+            def keep(rec):
+                t = rec.get("t") or 0
+                return (since is None or t >= since) and (until is None or t <= until)
+
+            lines: List[str] = []
+            for seg in self.segments():
+                if since is not None and seg.get("t_max", 0) < since:
+                    continue
+                if until is not None and seg.get("t_min", 0) > until:
+                    continue
+                lines.extend(json.dumps(r, ensure_ascii=False) for r in self._seg_records(seg) if keep(r))
+            lines.extend(json.dumps(r, ensure_ascii=False) for r in self.active.read_all() if keep(r))
+            return "".join(l + "\n" for l in lines).encode("utf-8")
+
+    def rewrite(self, records: List[Dict[str, Any]]):
+        """整体改写：清掉所有分段，全部写回尾段，下次 compact 再重新分段。"""
+        with self.locked():
+            for p in self.seg_dir.glob("seg-*") if self.seg_dir.exists() else []:
+                p.unlink(missing_ok=True)
+            self.active.rewrite(records)
+
+    # --- 压缩滚动 ---
+    def _recover(self, segs: List[Dict[str, Any]]):
+        """
+        滚动顺序是 写分段 -> 写小索引 -> 改写尾段；若在最后一步前中断，
+        尾段开头会与最后一个分段重复，这里按首尾记录摘要识别并裁掉。
+        没有小索引的分段文件是写到一半的孤儿，直接删除。
+        """
+        known = {seg["file"] for seg in segs}
+        for p in self.seg_dir.glob("seg-*.jsonl.*"):
+            if p.name not in known:
+                p.unlink(missing_ok=True)
+        if not segs:
+            return
+        head = self.active.read_range(0, 1)
+        if not head:
+            return
+        last = segs[-1]
+        end = last["first"] + last["count"]
+        for seg in segs:
+            if seg["head"] != _digest(head[0]):
+                continue
+            n = end - seg["first"]
+            tail = self.active.read_range(n - 1, n)
+            if tail and _digest(tail[0]) == last["tail"]:
+                self.active.rewrite(self.active.read_range(n, self.active.count()))
+            return
+
+    def compact(self) -> Dict[str, int]:
+        """活跃段过长时滚出压缩分段，返回 {segments, records}（本次新增）。"""
+        made = {"segments": 0, "records": 0}
+        with self.locked():
+            self.seg_dir.mkdir(parents=True, exist_ok=True)
+            segs = self.segments()
+            self._recover(segs)
+            n_active = self.active.count()
+            if n_active <= CHAT_ACTIVE_MAX_RECORDS:
+                return made
+            first = segs[-1]["first"] + segs[-1]["count"] if segs else 0
+            records = self.active.read_all()
+            roll, keep = records[:-CHAT_ACTIVE_KEEP_RECORDS], records[-CHAT_ACTIVE_KEEP_RECORDS:]
+            for i in range(0, len(roll), CHAT_SEGMENT_RECORDS):
+                chunk = roll[i:i + CHAT_SEGMENT_RECORDS]
+                raw = "".join(json.dumps(r, ensure_ascii=False) + "\n" for r in chunk).encode("utf-8")
+                data, codec = _compress(raw)
+                name = f"seg-{first:09d}"
+                seg_path = self.seg_dir / f"{name}.jsonl.{codec}"
+                tmp = seg_path.with_name(seg_path.name + ".tmp")
+                tmp.write_bytes(data)
+                os.replace(tmp, seg_path)
+                times = [r.get("t") or 0 for r in chunk]
+                side = {
+                    "file": seg_path.name, "codec": codec, "first": first, "count": len(chunk),
+                    "t_min": min(times), "t_max": max(times), "raw_bytes": len(raw), "bytes": len(data),
+                    "head": _digest(chunk[0]), "tail": _digest(chunk[-1]),
+                }
+                side_tmp = self.seg_dir / f"{name}.json.tmp"
+                side_tmp.write_text(json.dumps(side), encoding="utf-8")
+                os.replace(side_tmp, self.seg_dir / f"{name}.json")
+                first += len(chunk)
+                made["segments"] += 1
+                made["records"] += len(chunk)
+            # 改写尾段要在锁内做，期间的追加会等这一步完成
+            self.active.rewrite(keep)
+        return made
+
+
+class JsonlStore:
+    """
+    项目存储的 JSONL 后端（默认）：聊天走 JsonlLog，错题本是普通 JSONL。
+    错题的单条更新 / 删除只能整体改写文件，但只在确实有变化时才写。
+    """
+    kind = "jsonl"
+
+    def __init__(self, root: Path):
+        self.chat_log = SegmentedChatLog(root)
+        self.wrong_path = root / "wrong.jsonl"
+        self._wrong_lock = _lock_for(self.wrong_path)
+
+    # --- 聊天 ---
+    def append_chat(self, record: Dict[str, Any]):
+        self.chat_log.append(record)
+
+    def page_chats(self, before: Optional[int], limit: int) -> Tuple[List[Dict[str, Any]], int]:
+        return self.chat_log.page(before, limit)
+
+    def count_chats(self) -> int:
+        return self.chat_log.count()
+
+    def rewrite_chats(self, records: List[Dict[str, Any]]):
+        self.chat_log.rewrite(records)
+
+    def rewrite_chats_with(self, fn: Callable[[List[Dict[str, Any]]], Optional[List[Dict[str, Any]]]]):
+        """读出全部 -> fn 改写 -> 写回，整段持有日志锁，期间的追加不会丢；fn 返回 None 表示不用改写。"""
+        with self.chat_log.locked():
+            records = fn(self.chat_log.read_all())
+            if records is not None:
+                self.chat_log.rewrite(records)
+
+    # --- 错题本 ---
+    def log_wrong(self, record: Dict[str, Any]):
+        with self._wrong_lock:
+            with open(self.wrong_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    def load_wrong(self) -> List[Dict[str, Any]]:
+        if not self.wrong_path.exists():
+            return []
+        out: List[Dict[str, Any]] = []
+        with open(self.wrong_path, "r", encoding="utf-8") as f:
+            for lineno, line in enumerate(f):
+                try:
+                    it = json.loads(line)
+                except: # noqa
+                    continue
+                # 老记录没有 id：用行号兜底，下次改写文件时会固化下来
+                it.setdefault("id", f"L{lineno}")
+                out.append(it)
+        return out
+
+    def _rewrite_wrong(self, items: List[Dict[str, Any]]):
+        tmp = self.wrong_path.with_name(self.wrong_path.name + ".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            for it in items:
+                f.write(json.dumps(it, ensure_ascii=False) + "\n")
+        os.replace(tmp, self.wrong_path)
+
+    def update_wrong(self, item: Dict[str, Any]):
+        with self._wrong_lock:
+            items = self.load_wrong()
+            changed = False
+            for i, it in enumerate(items):
+                if it.get("id") == item.get("id") and it != item:
+                    items[i] = dict(item)
+                    changed = True
+            if changed:
+                self._rewrite_wrong(items)
+
+    def delete_wrong(self, item_id: str):
+        with self._wrong_lock:
+            items = self.load_wrong()
+            keep = [it for it in items if it.get("id") != item_id]
+            if len(keep) != len(items):
+                self._rewrite_wrong(keep)
+
+    def load_wrong_due(self, now: int) -> List[Dict[str, Any]]:
+        return sorted((it for it in self.load_wrong() if wrong_due_at(it) <= now), key=wrong_due_at)
+
+    def wrong_stamp(self) -> Any:
+        """错题本文件是否被改过的标记（修改时间 + 大小）。"""
+        if not self.wrong_path.exists():
+            return None
+        st = self.wrong_path.stat()
+        return st.st_mtime_ns, st.st_size
+
+    def export_wrong(self) -> bytes:
+        return self.wrong_path.read_bytes() if self.wrong_path.exists() else b""
+
+    def export_chats(self, since: Optional[int] = None, until: Optional[int] = None) -> bytes:
+        return self.chat_log.export(since, until)
+
+    def compact_chats(self) -> Dict[str, int]:
+        return self.chat_log.compact()
+
+    # 元数据仍只存 project.json
+    def save_meta(self, meta: Dict[str, Any]):
+        pass
+
+    def load_meta(self) -> Optional[Dict[str, Any]]:
+        return None
@@ -0,0 +1,74 @@
+"""
+把聊天记录里内联的依据原文（老格式 "hits": [{"content", "meta"}]）改写成块 id + 索引版本。
+只读索引的 docstore（index.pkl），不加载向量模型。
+块 id 由出处 + 原文哈希得出（rag_core.chunk_id），重建索引后不变；只有当前索引确实用的是这种稳定 id、
+且每条依据都在索引里时才去掉内联原文。老索引（docstore 里是每次构建随机生成的 uuid）先重建再压缩，
+否则一重建依据就永久丢了。
+
+用法：python compact_chats.py <项目目录> [<项目目录> ...]
+"""
+import pickle
+import sys
+from pathlib import Path
+from typing import Dict, Any, List, Optional, Set
+from project import Project
+from rag_core import chunk_id, index_version
+
+
+def _load_docstore(index_dir: Path) -> Dict[str, Any]:
+    with open(index_dir / "index.pkl", "rb") as f:
+        docstore, _ = pickle.load(f)
+    return getattr(docstore, "_dict", {})
+
+
+def _stable_keys(store: Dict[str, Any]) -> Set[str]:
+    """docstore 里按稳定 id 存的块（重复块的 -n 后缀去掉后比较）。"""
+    return {k for k, d in store.items() if k.split("-")[0] == chunk_id(d.page_content, d.metadata)}
+
+
+def _compact_record(rec: Dict[str, Any], stable: Set[str], version: str) -> bool:
+    if rec.get("kind") == "multi":
+        changed = False
+        for sub in rec.get("items") or []:
+            changed = _compact_record(sub, stable, version) or changed
+        return changed
+    hits = rec.get("hits")
+    if rec.get("kind") != "answer" or not hits:
+        return False
+    ids = [chunk_id(h.get("content", ""), h.get("meta")) for h in hits]
+    if not all(i in stable for i in ids):
+        return False
+    del rec["hits"]
+    rec["hit_ids"] = ids
+    rec["index_version"] = version
+    return True
+
+
+def compact_project_chats(proj: Project) -> Dict[str, int]:
+    """返回 {records, compacted, bytes_before, bytes_after}；没有可压缩的记录时不改写。"""
+    stable = _stable_keys(_load_docstore(proj.index_dir))
+    version = index_version(proj.index_dir)
+
+    before = proj.export_chats()
+    stats = {"records": 0, "compacted": 0}
+
+    def _compact(records: List[Dict[str, Any]]) -> Optional[List[Dict[str, Any]]]:
+        stats["records"] = len(records)
+        stats["compacted"] = sum(_compact_record(rec, stable, version) for rec in records)
+        return records if stats["compacted"] else None
+
+    # 读出、改写、写回在同一次加锁 / 事务里，期间别的进程追加的记录不会被覆盖掉
+    proj.rewrite_chats_with(_compact)
+    return {
+        **stats,
+        "bytes_before": len(before),
+        "bytes_after": len(proj.export_chats()),
+    }
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("用法：python compact_chats.py <项目目录> [<项目目录> ...]")
+        sys.exit(1)
+    for d in sys.argv[1:]:
+        print(d, compact_project_chats(Project(Path(d))))
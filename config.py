@@ -5,14 +5,92 @@ import os
 EMB_MODEL = "BAAI/bge-small-zh-v1.5"
 DEFAULT_INDEX_ROOT = Path("./projects")
 K_RETRIEVE_DEFAULT = 6
+INDEX_CACHE_SIZE = 8            # 进程内最多同时缓存几个项目的 FAISS 索引
+# 共享向量模型服务（embed_server.py）：设置了 RAG_EMBED_SOCKET 时，页面 / 批处理 / 建索引进程都不再各自加载模型，
+# 而是通过这个 Unix socket 请求向量；服务把同时到达的请求攒成一批（最多 MAX_BATCH 条，最多等 MAX_WAIT_MS）再编码
+EMBED_SOCKET = os.getenv("RAG_EMBED_SOCKET", "")
+EMBED_SOCKET_DEFAULT = "/tmp/rag_embed.sock"
+EMBED_MAX_BATCH = 64
+EMBED_MAX_WAIT_MS = 5
+# 建索引前合并近似重复的块（dedup.py）：字符 SHINGLE-gram 的 MinHash（NUM_PERM 个哈希，BANDS 段 LSH），
+# 估计 Jaccard ≥ THRESHOLD 的块只留一个向量，其余出处记进保留块的 metadata["dup_sources"]
+DEDUP_ENABLED = True
+DEDUP_THRESHOLD = 0.8
+DEDUP_SHINGLE = 5
+DEDUP_NUM_PERM = 64
+DEDUP_BANDS = 16
+
+# RAG 服务（service.py）：设置了 RAG_SERVICE_URL 时，页面把建项目 / 删项目 / 对话交给服务执行，
+# 自己只负责渲染；项目目录（INDEX_ROOT）仍需与服务共享，错题本和导出直接读写本地文件
+SERVICE_URL = os.getenv("RAG_SERVICE_URL", "").rstrip("/")
+SERVICE_HOST = "127.0.0.1"
+SERVICE_PORT = 8765
+SERVICE_WORKERS = 4             # 同时执行的请求数（检索 / 建索引 / 对话）
+SERVICE_QUEUE = 16              # 排队上限，超过直接返回 503
+SERVICE_READ_WORKERS = 2        # 读聊天记录 / 取块原文的独立线程，不占上面的名额，也不会 503
+
+# 冷启动：进程内第一个会话打开时后台预热（向量模型 / LLM 连接池 / 最近用过的 N 个项目索引）
+WARMUP_ON_START = True
+WARMUP_PROJECTS = 3
+
+# 耗时埋点（metrics.py）：直方图桶上界（秒）；RAG_METRICS_JSONL 设置时逐条追加观测值，
+# RAG_METRICS_PROM 设置时每 INTERVAL 秒写一次 Prometheus 文本文件
+METRICS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+METRICS_JSONL = os.getenv("RAG_METRICS_JSONL", "")
+METRICS_PROM_FILE = os.getenv("RAG_METRICS_PROM", "")
+METRICS_PROM_INTERVAL = 15
+
+# 开发者模式的采样剖析（profiler.py）：采样间隔（秒）与列出的热点函数个数
+PROFILE_INTERVAL = 0.005
+PROFILE_TOP_N = 15
+
+# 项目存储后端：新建项目用 "jsonl" 或 "sqlite"（WAL）；已有 project.db 的项目始终走 SQLite
+# 老项目迁移：python storage_sqlite.py migrate <项目目录>
+STORAGE_BACKEND = "jsonl"
+
+# 聊天日志分段（JSONL 后端）：尾段超过 MAX 条时，把较早的记录滚成每段 SEGMENT 条的压缩分段，
+# 尾段只留最近 KEEP 条；后台每 INTERVAL 秒检查一次所有项目
+CHAT_ACTIVE_MAX_RECORDS = 2000
+CHAT_ACTIVE_KEEP_RECORDS = 500
+CHAT_SEGMENT_RECORDS = 2000
+CHAT_COMPACT_INTERVAL = 600
 
 
 # 对话模型配置（DeepSeek 兼容 OpenAI SDK）
 MODEL_NAME = "deepseek-chat"
-MODEL_BASE_URL = "https://api.deepseek.com/v1"
+MODEL_BASE_URL = os.getenv("RAG_MODEL_BASE_URL", "https://api.deepseek.com/v1")   # 压测时指向模拟服务
 API_ENV_KEY = "DEEPSEEK_API_KEY"
 os.environ["DEEPSEEK_API_KEY"] = "sk-3ef1cbfbf45848599efaf2942d726205"
 
+# LLM 传输层（ds_client.LLMTransport，所有 LLM 调用共用）
+LLM_TIMEOUT = 60                # 单次请求读超时（秒）
+LLM_CONNECT_TIMEOUT = 10
+LLM_POOL_SIZE = 20              # keep-alive 连接池大小
+LLM_MAX_CONCURRENCY = 8         # 全进程同时在飞的请求上限
+LLM_MAX_RETRIES = 2
+LLM_BACKOFF_BASE = 0.5          # 退避基数（秒），实际等待为 [0, base * 2^n] 内随机
+LLM_BACKOFF_MAX = 8.0
+LLM_HEDGE_AFTER = 8.0           # 非流式请求超过该秒数未返回就补发一份；0 关闭
+
+# Prompt token 预算（budget.TokenBudget）：每次调用的变量部分最多占多少 token，以及各部分的份额
+TOKENIZER_NAME = "deepseek-ai/DeepSeek-V3"   # HF tokenizer；拿不到时退回 tiktoken / 字符估算
+# 只从本地加载，提问时不联网下载：RAG_TOKENIZER_PATH 指向 tokenizer.json（或其所在目录），
+# 没设时只用 HF 缓存里已有的 TOKENIZER_NAME（python budget.py 可预先下载进缓存）
+TOKENIZER_PATH = os.getenv("RAG_TOKENIZER_PATH", "")
+PROMPT_TOKEN_BUDGET = 6000
+BUDGET_SHARES = {"context": 0.6, "artifacts": 0.3, "instruction": 0.1}
+
 # 渲染配置
+CHAT_WINDOW_RECORDS = 20        # 对话页完整渲染的最近记录数
+CHAT_PAGE_RECORDS = 50          # 每点一次“加载更早”多读出的记录数（只显示摘要）
+
+PDF_RENDER_DPI = 150
 
-PDF_RENDER_DPI = 150
\ No newline at end of file
+# 流式渲染节流：距上次刷新超过 INTERVAL 秒，或新增字符超过 MAX_CHARS 时才重绘
+STREAM_RENDER_INTERVAL = 0.15
+STREAM_RENDER_MAX_CHARS = 400
+# 本地模式的对话轮次在后台线程池里执行（turns.py）：同时执行的轮次数、页面轮询进度的间隔（秒）、
+# 已结束但页面没来取的轮次保留多久（秒，会话关掉后由此回收）
+TURN_WORKERS = 4
+TURN_POLL_INTERVAL = 0.5
+TURN_RETAIN_S = 600
@@ -0,0 +1,105 @@
+"""
+建索引前合并近似重复的块：幻灯片每页重复的页眉页脚、议程页、版权声明，以及不同文件里的同一段内容，
+原本会各占一个向量，检索时一次返回好几条几乎一样的片段。
+- MinHash：规范化文本（去空白、小写）的字符 DEDUP_SHINGLE-gram，DEDUP_NUM_PERM 个哈希取最小值作签名
+- LSH 分段：签名切成 DEDUP_BANDS 段，任一段完全相同才算候选对，再用签名估计的 Jaccard ≥ DEDUP_THRESHOLD 确认
+- 一组近似重复只保留最先出现的块（文档顺序不变），其余块的出处（source / page / slide）
+  记进保留块的 metadata["dup_sources"]，依据卡片里照样能看到所有出处
+"""
+import zlib
+from typing import Any, Dict, List, Tuple, TYPE_CHECKING
+import numpy as np
+import metrics
+from config import DEDUP_THRESHOLD, DEDUP_SHINGLE, DEDUP_NUM_PERM, DEDUP_BANDS
+
+if TYPE_CHECKING:
+    from langchain.schema import Document
+
+_rng = np.random.RandomState(20240611)
+# 通用哈希 (a*x + b) mod 2^32；a、b < 2^32，乘积不会溢出 uint64
+_A = _rng.randint(1, 2 ** 32, size=DEDUP_NUM_PERM, dtype=np.uint64) | np.uint64(1)
+_B = _rng.randint(0, 2 ** 32, size=DEDUP_NUM_PERM, dtype=np.uint64)
+_MASK = np.uint64(0xFFFFFFFF)
+_LOC_KEYS = ("source", "page", "slide")
+
+
+def signature(text: str, k: int = DEDUP_SHINGLE) -> np.ndarray:
+    t = "".join(text.split()).lower()
+    grams = {t[i:i + k] for i in range(len(t) - k + 1)} if len(t) > k else {t}
+    x = np.fromiter((zlib.crc32(g.encode("utf-8")) for g in grams), dtype=np.uint64, count=len(grams))
+    return ((_A[:, None] * x[None, :] + _B[:, None]) & _MASK).min(axis=1)
+
+
+def similarity(sig_a: np.ndarray, sig_b: np.ndarray) -> float:
+    """签名估计的 Jaccard 相似度。"""
+    return float(np.mean(sig_a == sig_b))
+
+
+def near_duplicate_groups(texts: List[str], threshold: float = DEDUP_THRESHOLD) -> List[List[int]]:
+    """返回近似重复的分组（每组按下标升序，含单独成组的）。"""
+    sigs = [signature(t) for t in texts]
+    rows = DEDUP_NUM_PERM // DEDUP_BANDS
+    parent = list(range(len(texts)))
+
+    def find(i: int) -> int:
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for band in range(DEDUP_BANDS):
+        buckets: Dict[bytes, int] = {}
+        for i, sig in enumerate(sigs):
+            key = sig[band * rows:(band + 1) * rows].tobytes()
+            j = buckets.setdefault(key, i)
+            if j != i and find(i) != find(j) and similarity(sigs[i], sigs[j]) >= threshold:
+                ri, rj = find(i), find(j)
+                parent[max(ri, rj)] = min(ri, rj)
+    groups: Dict[int, List[int]] = {}
+    for i in range(len(texts)):
+        groups.setdefault(find(i), []).append(i)
+    return sorted(groups.values())
+
+
+def _loc(meta: Dict[str, Any]) -> Dict[str, Any]:
+    return {k: meta[k] for k in _LOC_KEYS if k in meta}
+
+
+def dedup_chunks(chunks: List["Document"], threshold: float = DEDUP_THRESHOLD) -> Tuple[List["Document"], Dict[str, Any]]:
+    """合并近似重复的块，返回 (保留的块, 统计)；输入的 Document 不会被修改。"""
+    from langchain.schema import Document
+    from rag_core import chunk_id
+    with metrics.span("dedup"):
+        groups = near_duplicate_groups([c.page_content for c in chunks], threshold)
+        kept = []
+        for g in groups:
+            head = chunks[g[0]]
+            if len(g) == 1:
+                kept.append(head)
+                continue
+            meta = dict(head.metadata)
+            meta["dup_sources"] = [_loc(chunks[i].metadata) for i in g[1:]]
+            # 被合并块的稳定 id：旧索引里引用它们的聊天记录重建后仍能找到保留块
+            meta["dup_ids"] = [chunk_id(chunks[i].page_content, chunks[i].metadata) for i in g[1:]]
+            kept.append(Document(page_content=head.page_content, metadata=meta))
+    n_in, n_out = len(chunks), len(kept)
+    stats = {
+        "chunks_in": n_in,
+        "chunks_out": n_out,
+        "merged_groups": sum(1 for g in groups if len(g) > 1),
+        "reduction": round(1 - n_out / n_in, 4) if n_in else 0.0,
+    }
+    return kept, stats
+
+
+def dup_label(meta: Dict[str, Any], limit: int = 3) -> str:
+    """依据卡片上“另见”的出处列表。"""
+    dups = meta.get("dup_sources") or []
+    if not dups:
+        return ""
+    parts = []
+    for d in dups[:limit]:
+        name = str(d.get("source", "?")).replace("\\", "/").split("/")[-1]
+        parts.append(name + (f" P{d['page']}" if d.get("page") else f" S{d['slide']}" if d.get("slide") else ""))
+    more = f" 等 {len(dups)} 处" if len(dups) > limit else ""
+    return "另见 " + "、".join(parts) + more
@@ -1,9 +1,323 @@
-from openai import OpenAI
+"""
+所有 LLM 流量共用的传输层（DeepSeek 兼容 OpenAI SDK）：
+- 一个 httpx.Client：keep-alive 连接池，装了 h2 时启用 HTTP/2
+- 统一重试：只重试连接错误 / 超时 / 429 / 5xx，指数退避 + 全抖动
+- 对冲请求：非流式调用超过 LLM_HEDGE_AFTER 秒未返回时补发一份，先到先用；
+  落败的那份立即让出名额，并在下一个 chunk 到达时关掉它的流（开了对冲时内部按流式取回，才能中途放弃）
+- 并发上限：全进程共享一个信号量，流式请求在整个流被读完前一直占用名额
+- 取消：上下文里设了 cancel_event（后台对话轮次）且已置位时，调用前、每个 chunk 之间抛 LLMCancelled
+"""
+import contextvars
+import importlib.util
 import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterator, List, Optional
+import httpx
+import openai
+from openai import OpenAI
+from config import (
+    MODEL_NAME,
+    MODEL_BASE_URL,
+    API_ENV_KEY,
+    LLM_TIMEOUT,
+    LLM_CONNECT_TIMEOUT,
+    LLM_POOL_SIZE,
+    LLM_MAX_CONCURRENCY,
+    LLM_MAX_RETRIES,
+    LLM_BACKOFF_BASE,
+    LLM_BACKOFF_MAX,
+    LLM_HEDGE_AFTER,
+)
+import metrics
+
+class LLMCancelled(BaseException):
+    """
+    所在的对话轮次已被取消。继承 BaseException：工具里兜底的 except Exception
+    不会把取消当成“生成失败”记进日志、再造一条兜底记录。
+    """
+
 
-DEEPSEEK_API_KEY = os.getenv("DEEPSEEK_API_KEY")
+# 当前上下文所属轮次的取消标记：turns.TurnExecutor 在工作线程里设置，
+# plan 线程、对冲线程都经 copy_context 继承
+cancel_event: "contextvars.ContextVar[Optional[threading.Event]]" = contextvars.ContextVar("llm_cancel", default=None)
 
-deepseek_client = OpenAI(
-    api_key=DEEPSEEK_API_KEY,
-    base_url="https://api.deepseek.com",  # deepseek 官方网关
+
+def _check_cancel():
+    ev = cancel_event.get()
+    if ev is not None and ev.is_set():
+        raise LLMCancelled()
+
+
+_RETRYABLE = (
+    openai.APIConnectionError,   # 含 APITimeoutError
+    openai.RateLimitError,
+    openai.InternalServerError,
 )
+
+
+def _http2_available() -> bool:
+    return importlib.util.find_spec("h2") is not None
+
+
+@dataclass
+class LLMReply:
+    """非流式调用的结果；保留 .content，兼容原来 llm.invoke(prompt).content 的写法。"""
+    content: str
+    usage: Dict[str, Any] = field(default_factory=dict)
+    queue_ms: int = 0
+    hedged: bool = False
+
+
+def _observe_usage(usage: Dict[str, Any], call: str):
+    for kind in ("prompt", "completion"):
+        n = usage.get(f"{kind}_tokens") if usage else None
+        if n:
+            metrics.inc("rag_llm_tokens_total", n, call=call, type=kind)
+
+
+class _Attempt:
+    """对冲中的一份请求：可以从别的线程取消；并发名额只释放一次（取消时立刻让出）。"""
+
+    def __init__(self, slots: threading.BoundedSemaphore):
+        self._slots = slots
+        self._lock = threading.Lock()
+        self._held = False
+        self.cancelled = threading.Event()
+
+    def acquire(self, blocking: bool) -> bool:
+        if not self._slots.acquire(blocking=blocking):
+            return False
+        with self._lock:
+            if self.cancelled.is_set():
+                self._slots.release()
+                return False
+            self._held = True
+        return True
+
+    def release(self):
+        with self._lock:
+            if self._held:
+                self._held = False
+                self._slots.release()
+
+    def cancel(self):
+        self.cancelled.set()
+        self.release()
+
+
+class LLMTransport:
+    def __init__(
+        self,
+        api_key: str,
+        base_url: str = MODEL_BASE_URL,
+        model: str = MODEL_NAME,
+        timeout: float = LLM_TIMEOUT,
+        max_retries: int = LLM_MAX_RETRIES,
+        max_concurrency: int = LLM_MAX_CONCURRENCY,
+        hedge_after: float = LLM_HEDGE_AFTER,
+    ):
+        self.model = model
+        self.max_retries = max_retries
+        self.hedge_after = hedge_after
+        self.http = httpx.Client(
+            http2=_http2_available(),
+            limits=httpx.Limits(
+                max_connections=LLM_POOL_SIZE,
+                max_keepalive_connections=LLM_POOL_SIZE,
+                keepalive_expiry=60,
+            ),
+            timeout=httpx.Timeout(timeout, connect=LLM_CONNECT_TIMEOUT),
+        )
+        # SDK 自带的重试关掉，统一走下面的 _with_retry
+        self.client = OpenAI(api_key=api_key, base_url=base_url, http_client=self.http, max_retries=0)
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self._hedge_pool = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="llm-hedge")
+
+    # --- 内部工具 ---
+    def _messages(self, prompt: str | List[Dict[str, str]]) -> List[Dict[str, str]]:
+        if isinstance(prompt, str):
+            return [{"role": "user", "content": prompt}]
+        return prompt
+
+    def _backoff(self, attempt: int, err: Exception) -> float:
+        # 429 带 Retry-After 时尊重服务端
+        resp = getattr(err, "response", None)
+        if resp is not None:
+            ra = resp.headers.get("retry-after")
+            if ra:
+                try:
+                    return min(float(ra), LLM_BACKOFF_MAX)
+                except ValueError:
+                    pass
+        return random.uniform(0, min(LLM_BACKOFF_MAX, LLM_BACKOFF_BASE * (2 ** attempt)))
+
+    def _with_retry(self, fn):
+        attempt = 0
+        while True:
+            try:
+                return fn()
+            except _RETRYABLE as e:
+                if attempt >= self.max_retries:
+                    raise
+                time.sleep(self._backoff(attempt, e))
+                attempt += 1
+
+    def _acquire(self, blocking: bool = True, attempt: Optional[_Attempt] = None) -> Optional[int]:
+        """拿并发名额，返回排队耗时（毫秒）；非阻塞且拿不到（或已被取消）时返回 None。"""
+        t0 = time.perf_counter()
+        ok = attempt.acquire(blocking) if attempt is not None else self._slots.acquire(blocking=blocking)
+        if not ok:
+            return None
+        return int((time.perf_counter() - t0) * 1000)
+
+    def _create_once(self, messages, params) -> LLMReply:
+        resp = self._with_retry(
+            lambda: self.client.chat.completions.create(model=self.model, messages=messages, **params)
+        )
+        usage = resp.usage.model_dump() if getattr(resp, "usage", None) else {}
+        return LLMReply(content=resp.choices[0].message.content or "", usage=usage)
+
+    def _create_cancellable(self, messages, params, cancelled: threading.Event) -> Optional[LLMReply]:
+        """对冲用：按流式取回再拼成完整回复，每个 chunk 之间检查是否已落败，落败就关掉流，返回 None。"""
+        stream = self._with_retry(
+            lambda: self.client.chat.completions.create(
+                model=self.model, messages=messages, stream=True, stream_options={"include_usage": True}, **params
+            )
+        )
+        parts: List[str] = []
+        usage: Dict[str, Any] = {}
+        try:
+            for chunk in stream:
+                if cancelled.is_set():
+                    return None
+                _check_cancel()
+                if chunk.choices and chunk.choices[0].delta.content:
+                    parts.append(chunk.choices[0].delta.content)
+                if getattr(chunk, "usage", None) is not None:
+                    usage = chunk.usage.model_dump()
+        finally:
+            stream.close()   # 提前结束时断开连接，不再读剩下的响应
+        return LLMReply(content="".join(parts), usage=usage)
+
+    def _guarded(self, messages, params, blocking: bool = True,
+                 attempt: Optional[_Attempt] = None) -> Optional[LLMReply]:
+        queue_ms = self._acquire(blocking, attempt)
+        if queue_ms is None:
+            return None
+        metrics.observe("rag_llm_queue_seconds", queue_ms / 1000, call="invoke")
+        t0 = time.perf_counter()
+        try:
+            if attempt is None:
+                reply = self._create_once(messages, params)
+            else:
+                reply = self._create_cancellable(messages, params, attempt.cancelled)
+                if reply is None:
+                    return None
+            reply.queue_ms = queue_ms
+            _observe_usage(reply.usage, "invoke")
+            return reply
+        finally:
+            metrics.observe("rag_llm_seconds", time.perf_counter() - t0, call="invoke")
+            if attempt is None:
+                self._slots.release()
+            else:
+                attempt.release()
+
+    # --- 对外接口 ---
+    def invoke(self, prompt: str | List[Dict[str, str]], **params) -> LLMReply:
+        """非流式调用；默认 temperature=0。hedge_after>0 时启用对冲请求。"""
+        params.setdefault("temperature", 0)
+        messages = self._messages(prompt)
+        _check_cancel()
+        if self.hedge_after <= 0:
+            reply = self._guarded(messages, params)
+            _check_cancel()   # 不可中断的整段请求：返回后再看一眼，取消了就不交给调用方
+            return reply
+
+        # copy_context：让工作线程里的埋点也记进发起请求的会话
+        attempts = {}
+        a = _Attempt(self._slots)
+        primary = self._hedge_pool.submit(contextvars.copy_context().run, self._guarded, messages, params, True, a)
+        attempts[primary] = a
+        done, _ = wait([primary], timeout=self.hedge_after)
+        if done:
+            return primary.result()
+        # 主请求迟迟未返回：名额够就补发一份（拿不到名额不补，避免放大拥塞）
+        b = _Attempt(self._slots)
+        backup = self._hedge_pool.submit(contextvars.copy_context().run, self._guarded, messages, params, False, b)
+        attempts[backup] = b
+        metrics.inc("rag_llm_hedged_total")
+        pending = {primary, backup}
+        first_error: Optional[BaseException] = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for fut in done:
+                err = fut.exception()
+                if err is not None:
+                    first_error = first_error or err
+                    continue
+                reply = fut.result()
+                if reply is None:  # 补发没拿到名额
+                    continue
+                reply.hedged = fut is backup
+                # 落败的一份：立刻让出名额，它的流在下一个 chunk 到达时关闭
+                for other in pending:
+                    attempts[other].cancel()
+                return reply
+        raise first_error
+
+    def stream(self, prompt: str | List[Dict[str, str]], **params) -> Iterator[Any]:
+        """
+        流式调用，逐个产出 SDK 的 chunk。
+        只在拿到第一个 chunk 之前重试；流一旦开始，中途出错直接抛给调用方。
+        调用方提前停止（取消、回调抛异常、生成器没读完就丢弃）时关掉流，连接还给连接池，服务端也不再继续生成。
+        """
+        messages = self._messages(prompt)
+        _check_cancel()
+        queue_ms = self._acquire()
+        metrics.observe("rag_llm_queue_seconds", queue_ms / 1000, call="stream")
+        t0 = time.perf_counter()
+        first = True
+        stream = None
+        try:
+            stream = self._with_retry(
+                lambda: self.client.chat.completions.create(
+                    model=self.model, messages=messages, stream=True, **params
+                )
+            )
+            for chunk in stream:
+                if first and chunk.choices and chunk.choices[0].delta.content:
+                    metrics.observe("rag_llm_ttft_seconds", time.perf_counter() - t0)
+                    first = False
+                usage = getattr(chunk, "usage", None)
+                if usage is not None:
+                    _observe_usage(usage.model_dump() if hasattr(usage, "model_dump") else dict(usage), "stream")
+                _check_cancel()
+                yield chunk
+        finally:
+            if stream is not None:
+                stream.close()
+            metrics.observe("rag_llm_seconds", time.perf_counter() - t0, call="stream")
+            self._slots.release()
+
+    def close(self):
+        self._hedge_pool.shutdown(wait=False)
+        self.http.close()
+
+
+_transport: Optional[LLMTransport] = None
+_transport_lock = threading.Lock()
+
+
+def get_transport() -> LLMTransport:
+    """进程级单例；Streamlit 内请用 llm.get_llm()（多一步 API Key 检查）。"""
+    global _transport
+    if _transport is None:
+        with _transport_lock:
+            if _transport is None:
+                _transport = LLMTransport(api_key=os.getenv(API_ENV_KEY, "").strip())
+    return _transport
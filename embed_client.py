@@ -0,0 +1,95 @@
+"""
+共享向量模型服务（embed_server.py）的客户端：设置了 RAG_EMBED_SOCKET 时 rag_core.get_embeddings 返回 RemoteEmbeddings，
+本进程不再加载模型。实现 LangChain 的 Embeddings 接口，FAISS 建索引 / 加载 / 检索都能直接用。
+- 每个线程一条长连接（服务端按连接顺序应答），断开后自动重连一次；读超时不重试（请求可能还在服务端排队编码）
+- 应答收进预分配的缓冲区，np.frombuffer 直接当向量矩阵用；embed_array 返回 numpy，给不需要 list 的调用方
+"""
+import json
+import socket
+import struct
+import threading
+from typing import Any, Dict, List
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+_LEN = struct.Struct("<I")
+_RESP = struct.Struct("<II")
+
+
+class EmbedServerError(RuntimeError):
+    pass
+
+
+def _recv_into(sock: socket.socket, buf: memoryview):
+    while len(buf):
+        n = sock.recv_into(buf)
+        if n == 0:
+            raise ConnectionError("向量服务断开了连接")
+        buf = buf[n:]
+
+
+class RemoteEmbeddings(Embeddings):
+    def __init__(self, path: str, timeout: float = 300.0):
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _sock(self) -> socket.socket:
+        sock = getattr(self._local, "sock", None)
+        if sock is None:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout)
+            try:
+                sock.connect(self.path)
+            except OSError as e:
+                sock.close()
+                raise EmbedServerError(f"连不上向量服务 {self.path}（先运行 python embed_server.py）：{e}") from e
+            self._local.sock = sock
+        return sock
+
+    def _drop(self):
+        sock = getattr(self._local, "sock", None)
+        if sock is not None:
+            sock.close()
+            self._local.sock = None
+
+    def _call(self, req: Dict[str, Any]):
+        body = json.dumps(req, ensure_ascii=False).encode("utf-8")
+        for attempt in range(2):
+            sock = self._sock()
+            try:
+                sock.sendall(_LEN.pack(len(body)) + body)
+                head = bytearray(_RESP.size)
+                _recv_into(sock, memoryview(head))
+                hlen, plen = _RESP.unpack(head)
+                hb = bytearray(hlen)
+                _recv_into(sock, memoryview(hb))
+                payload = bytearray(plen)
+                _recv_into(sock, memoryview(payload))
+                return json.loads(hb), payload
+            except socket.timeout:
+                # 服务很忙或请求很大：重发只会再排一次队；连接上可能还有迟到的应答，丢掉不再用
+                self._drop()
+                raise
+            except (ConnectionError, BrokenPipeError):
+                # 服务重启过 / 连接被回收：换一条连接重试一次
+                self._drop()
+                if attempt:
+                    raise
+
+    def embed_array(self, texts: List[str]) -> np.ndarray:
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+        head, payload = self._call({"op": "embed", "texts": list(texts)})
+        if "error" in head:
+            raise EmbedServerError(f"向量服务出错：{head['error']}")
+        return np.frombuffer(payload, dtype="<f4").reshape(head["n"], head["dim"])
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.embed_array(texts).tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_array([text])[0].tolist()
+
+    def stats(self) -> Dict[str, Any]:
+        return self._call({"op": "stats"})[0]
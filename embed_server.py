@@ -0,0 +1,229 @@
+"""
+共享向量模型服务：一台机器上只加载一份向量模型，Streamlit 的多个服务进程、batch_qa / bulk_build 的工作进程
+都通过 Unix socket 向它要向量（客户端见 embed_client.py，设置 RAG_EMBED_SOCKET 后 rag_core.get_embeddings 自动切换）。
+- 动态攒批：各连接的请求进同一个队列，攒到 EMBED_MAX_BATCH 条或等满 EMBED_MAX_WAIT_MS 就编码一次；
+  模型正在编码时新到的请求自然排进下一批
+- 大请求（建索引一次上千条）切成 EMBED_MAX_BATCH 条一片，每批先放排队中的小请求，剩余名额才给大请求的下一片，
+  检索查询不会被整份大请求堵住；各片编完再拼回去一次应答
+- 模型只在一个线程里跑（编码本身已用满多核），事件循环只负责收发
+- 向量以 float32 原样发送：服务端直接写 numpy 数组的内存，客户端收进预分配的缓冲区后 np.frombuffer，不做序列化
+
+协议（每个连接可连续发多个请求，按顺序应答）：
+  请求：<u32 长度> + JSON {"op": "embed", "texts": [...]} 或 {"op": "stats"}
+  应答：<u32 头长度><u32 数据长度> + JSON 头 {"n", "dim"} 或 {"error"} / 统计 + n*dim 个 float32（小端）
+
+启动：python embed_server.py [--socket /tmp/rag_embed.sock] [--max-batch 64] [--max-wait-ms 5]
+"""
+import argparse
+import asyncio
+import json
+import os
+import struct
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Deque, Dict, List, Tuple
+import numpy as np
+from config import EMB_MODEL, EMBED_SOCKET, EMBED_SOCKET_DEFAULT, EMBED_MAX_BATCH, EMBED_MAX_WAIT_MS
+
+_LEN = struct.Struct("<I")
+_RESP = struct.Struct("<II")
+
+
+def load_encoder(model_name: str = EMB_MODEL) -> Callable[[List[str]], np.ndarray]:
+    """与 rag_core.get_embeddings 的 HuggingFaceEmbeddings 同样的预处理和归一化，向量逐位一致。"""
+    from sentence_transformers import SentenceTransformer
+    model = SentenceTransformer(model_name)
+
+    def encode(texts: List[str]) -> np.ndarray:
+        texts = [t.replace("\n", " ") for t in texts]
+        return model.encode(texts, normalize_embeddings=True, convert_to_numpy=True, show_progress_bar=False)
+
+    return encode
+
+
+class _Job:
+    """一个 embed 请求；超过 max_batch 条时切成多片分批编码，各片都编完再拼回去应答。"""
+
+    def __init__(self, fut: asyncio.Future, n_parts: int):
+        self.fut = fut
+        self.parts: List[Any] = [None] * n_parts
+        self.left = n_parts
+
+    def put(self, idx: int, vecs: np.ndarray):
+        if self.fut.done():
+            return
+        self.parts[idx] = vecs
+        self.left -= 1
+        if not self.left:
+            # 只有一片时直接用批结果的行切片（视图，不复制）
+            self.fut.set_result(self.parts[0] if len(self.parts) == 1 else np.concatenate(self.parts))
+
+    def fail(self, e: Exception):
+        if not self.fut.done():
+            self.fut.set_exception(e)
+
+
+Part = Tuple[List[str], _Job, int]   # (这一片的文本, 所属请求, 片序号)
+
+
+class EmbedServer:
+    def __init__(self, encode: Callable[[List[str]], np.ndarray],
+                 max_batch: int = EMBED_MAX_BATCH, max_wait_ms: float = EMBED_MAX_WAIT_MS):
+        self.encode = encode
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self._pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="embed-model")
+        self._q: "asyncio.Queue[Any]" = asyncio.Queue()
+        self._small: Deque[Part] = deque()   # 一片就能编完的请求（检索查询等），优先
+        self._large: Deque[Part] = deque()   # 大请求切出来的片，用每批剩下的名额
+        self.stats = {"requests": 0, "texts": 0, "batches": 0, "encode_s": 0.0, "connections": 0}
+
+    def _route(self, item: Tuple[List[str], asyncio.Future]):
+        texts, fut = item
+        parts = [texts[i:i + self.max_batch] for i in range(0, len(texts), self.max_batch)]
+        job = _Job(fut, len(parts))
+        (self._small if len(parts) == 1 else self._large).extend((p, job, i) for i, p in enumerate(parts))
+
+    def _pending(self) -> int:
+        return sum(len(p) for p, _, _ in self._small) + (self.max_batch if self._large else 0)
+
+    def _take(self) -> List[Part]:
+        """凑一批：先小请求，再用剩余名额放大请求的片（放不下的留到下一批）。"""
+        batch: List[Part] = []
+        n = 0
+        for pending in (self._small, self._large):
+            while pending and n + len(pending[0][0]) <= self.max_batch:
+                part = pending.popleft()
+                if not part[1].fut.done():   # 前面的片已失败 / 连接已断的请求不再编码
+                    batch.append(part)
+                    n += len(part[0])
+        return batch
+
+    async def _collect(self):
+        loop = asyncio.get_running_loop()
+        if self._small or self._large:
+            # 还有没编完的：只收已经排队的新请求，不再等
+            while not self._q.empty():
+                self._route(self._q.get_nowait())
+            return
+        self._route(await self._q.get())
+        deadline = loop.time() + self.max_wait
+        while self._pending() < self.max_batch:
+            if self._q.empty():
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._q.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+            else:
+                item = self._q.get_nowait()
+            self._route(item)
+
+    async def _batcher(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await self._collect()
+            batch = self._take()
+            if not batch:
+                continue
+            texts = [t for part, _, _ in batch for t in part]
+            t0 = time.perf_counter()
+            try:
+                vecs = await loop.run_in_executor(self._pool, self.encode, texts)
+                vecs = np.ascontiguousarray(vecs, dtype=np.float32)
+            except Exception as e:
+                for _, job, _ in batch:
+                    job.fail(e)
+                continue
+            self.stats["batches"] += 1
+            self.stats["encode_s"] += time.perf_counter() - t0
+            off = 0
+            for part, job, idx in batch:
+                job.put(idx, vecs[off:off + len(part)])   # 行切片是视图，不复制
+                off += len(part)
+
+    async def embed(self, texts: List[str]) -> np.ndarray:
+        fut = asyncio.get_running_loop().create_future()
+        await self._q.put((texts, fut))
+        return await fut
+
+    def snapshot(self) -> Dict[str, Any]:
+        b = self.stats["batches"]
+        return {**self.stats, "encode_s": round(self.stats["encode_s"], 3),
+                "mean_batch": round(self.stats["texts"] / b, 2) if b else 0.0, "queued": self._q.qsize(),
+                "pending_parts": len(self._small) + len(self._large)}
+
+    async def _reply(self, writer: asyncio.StreamWriter, head: Dict[str, Any], payload: Any = b""):
+        hb = json.dumps(head, ensure_ascii=False).encode("utf-8")
+        data = memoryview(payload).cast("B")
+        writer.write(_RESP.pack(len(hb), len(data)) + hb)
+        if len(data):
+            writer.write(data)
+        await writer.drain()
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.stats["connections"] += 1
+        try:
+            while True:
+                try:
+                    (size,) = _LEN.unpack(await reader.readexactly(_LEN.size))
+                    req = json.loads(await reader.readexactly(size))
+                except asyncio.IncompleteReadError:
+                    return
+                if req.get("op") == "stats":
+                    await self._reply(writer, self.snapshot())
+                    continue
+                texts = req.get("texts") or []
+                if not texts:
+                    await self._reply(writer, {"n": 0, "dim": 0})
+                    continue
+                self.stats["requests"] += 1
+                self.stats["texts"] += len(texts)
+                try:
+                    vecs = await self.embed([str(t) for t in texts])
+                except Exception as e:
+                    await self._reply(writer, {"error": f"{type(e).__name__}: {e}"})
+                    continue
+                await self._reply(writer, {"n": int(vecs.shape[0]), "dim": int(vecs.shape[1])}, vecs)
+        except (ConnectionResetError, BrokenPipeError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, path: str):
+        if os.path.exists(path):
+            os.unlink(path)   # 上次异常退出留下的 socket 文件
+        server = await asyncio.start_unix_server(self.handle, path=path)
+        os.chmod(path, 0o660)
+        batcher = asyncio.create_task(self._batcher())
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            batcher.cancel()
+            self._pool.shutdown(wait=False)
+            if os.path.exists(path):
+                os.unlink(path)
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="共享向量模型服务（Unix socket）")
+    ap.add_argument("--socket", default=EMBED_SOCKET or EMBED_SOCKET_DEFAULT)
+    ap.add_argument("--model", default=EMB_MODEL)
+    ap.add_argument("--max-batch", type=int, default=EMBED_MAX_BATCH)
+    ap.add_argument("--max-wait-ms", type=float, default=EMBED_MAX_WAIT_MS)
+    args = ap.parse_args()
+    encoder = load_encoder(args.model)
+    encoder(["预热"])
+    print(f"向量模型已加载（{args.model}），监听 {args.socket}")
+
+    async def main():
+        await EmbedServer(encoder, args.max_batch, args.max_wait_ms).serve(args.socket)
+
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
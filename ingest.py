@@ -0,0 +1,113 @@
+"""
+项目构建（保存文件 → 解析 → 切分 → 嵌入 → 建索引 → 写元数据），不依赖 Streamlit 页面，
+新建项目页面和 RAG 服务共用。
+"""
+import os
+import shutil
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import metrics
+from config import DEDUP_ENABLED
+from project import Project
+from utils import slugify_name, now_ts
+
+SUPPORTED_EXTS = ("pdf", "pptx", "docx", "txt")
+
+
+class ProjectExistsError(ValueError):
+    pass
+
+
+def read_any(data: bytes, name: str) -> list:
+    """按扩展名解析一个文件，返回 Document 列表；不支持的类型返回空列表。"""
+    from io_readers import read_pdf, read_pptx, read_docx, read_txt
+    ext = name.lower().split(".")[-1]
+    reader = {"pdf": read_pdf, "pptx": read_pptx, "docx": read_docx, "txt": read_txt}.get(ext)
+    return reader(data, name) if reader else []
+
+
+def build_project(
+    index_root: Path,
+    display_name: str,
+    files: List[Tuple[str, bytes]],
+    progress: Optional[Callable[[int, str], None]] = None,
+    dir_name: Optional[str] = None,
+    update: bool = False,
+    extra_meta: Optional[Dict[str, Any]] = None,
+) -> Project:
+    """
+    files: [(文件名, 内容)]；progress(百分比, 提示)。
+    目录名默认由项目名生成（ascii slug），已存在时抛 ProjectExistsError；
+    update=True 时允许已存在：原始文件整体替换、索引重建，聊天记录 / 错题本保留。
+    extra_meta 合并进 project.json（如批量构建记录的源文件哈希）。
+    """
+    from rag_core import build_index_from_chunks, split_docs, save_index
+    progress = progress or (lambda pct, text: None)
+
+    dir_name = dir_name or slugify_name(display_name)
+    proj = Project(index_root / dir_name)
+    existed = proj.exists()
+    if existed and not update:
+        raise ProjectExistsError(f"目录名 {dir_name} 已存在。请换一个项目名称。")
+    proj.root.mkdir(parents=True, exist_ok=True)
+    if existed:
+        proj.load_meta()
+        shutil.rmtree(proj.files_dir, ignore_errors=True)
+    proj.files_dir.mkdir(parents=True, exist_ok=True)
+
+    # 1) 保存 + 解析
+    progress(0, "保存文件…")
+    docs_all = []
+    files_meta = []
+    for idx, (name, data) in enumerate(files, start=1):
+        (proj.files_dir / name).write_bytes(data)
+        files_meta.append(str(proj.files_dir / name))
+        progress(min(5 + int(idx / max(1, len(files)) * 10), 15), f"读取 {name}")
+        with metrics.span("parse", ext=name.lower().split(".")[-1]):
+            docs_all += read_any(data, name)
+
+    # 2) 切分 + 合并近似重复的块（幻灯片重复的页眉页脚 / 议程页等）
+    progress(30, "分块中…")
+    chunks = split_docs(docs_all)
+    dedup_stats = None
+    if DEDUP_ENABLED:
+        from dedup import dedup_chunks
+        chunks, dedup_stats = dedup_chunks(chunks)
+
+    # 3) 嵌入与索引
+    progress(45, "计算向量…")
+    vs = build_index_from_chunks(chunks)
+
+    # 4) 保存（更新时先写到临时目录再换上，正在读旧索引的会话不会读到半个索引）
+    progress(80, "保存索引…")
+    if existed:
+        tmp_dir = proj.root / "index.new"
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        save_index(vs, tmp_dir)
+        old_dir = proj.root / "index.old"
+        shutil.rmtree(old_dir, ignore_errors=True)
+        if proj.index_dir.exists():
+            os.replace(proj.index_dir, old_dir)
+        os.replace(tmp_dir, proj.index_dir)
+        shutil.rmtree(old_dir, ignore_errors=True)
+    else:
+        save_index(vs, proj.index_dir)
+    progress(85, "写入元数据…")
+    meta = proj.meta if existed else {}
+    meta.update({
+        "name": display_name,          # 显示中文名
+        "dir_name": dir_name,          # 目录名（可选）
+        "files": files_meta,
+        **(extra_meta or {}),
+    })
+    if dedup_stats is not None:
+        meta["dedup"] = dedup_stats    # 合并前后的块数：索引因去重缩小了多少
+    else:
+        meta.pop("dedup", None)
+    meta.setdefault("created_at", now_ts())
+    if existed:
+        meta["updated_at"] = now_ts()
+    proj.meta = meta
+    proj.save_meta()
+    progress(100, "完成")
+    return proj
@@ -1,13 +1,14 @@
-from io import StringIO
 import re
-import json
 import streamlit as st
-from langchain_openai import ChatOpenAI
-from typing import Tuple, List, Dict, Any
+from typing import Tuple, List, Dict, Any, Callable, Optional
 from langchain.schema import Document
-from config import MODEL_NAME, MODEL_BASE_URL, API_ENV_KEY
+from config import API_ENV_KEY
 from rag_core import retrieve, format_hits
-from ds_client import deepseek_client
+from ds_client import LLMTransport, get_transport
+from streaming import stream_chat, StreamStats, JSONObjectScanner
+from prompts import PromptTemplate, prompt_text, record_cache_usage
+from budget import TokenBudget
+from utils import loads_lenient
 
 @st.cache_resource(show_spinner=False)
 def get_llm():
@@ -15,18 +16,139 @@ def get_llm():
     if not key:
         st.error("未检测到 API Key。请设置环境变量 DEEPSEEK_API_KEY。")
         st.stop()
-    return ChatOpenAI(
-        model=MODEL_NAME,
-        openai_api_key=key,
-        openai_api_base=MODEL_BASE_URL,
-        temperature=0,
-        timeout=60,
-        max_retries=2,
-    )
+    # 全进程共用一个传输层（连接池 / 重试 / 并发上限都在里面）
+    return get_transport()
+
+
+_STRICT_HINTS = {
+    "soft": "你可以以教案为参考，自行发挥来执行好你的指示。",
+    "strict": (
+        "你需要以教案作为主要参考去输出教学内容。"
+        "如果依据不足，你可以适当补充一些内容，但总体上不能和教案冲突。"
+    ),
+}
+
+
+def _strict_hint(strictness: str) -> Tuple[str, str]:
+    """返回 (规范化后的 strictness, 对应提示)；未知值一律按 strict 处理。"""
+    if str(strictness).lower() == "soft":
+        return "soft", _STRICT_HINTS["soft"]
+    return "strict", _STRICT_HINTS["strict"]
+
+
+# ============ Prompt 模板：system 段纯静态（命中前缀缓存），变量全部在 user 段 ============
+ANSWER_PROMPT = PromptTemplate(
+    "answer",
+    system=(
+        "你是一位辅助学习的老师，你和其他多位老师合作一起帮助一位同学学习。你会在教学的开头以一句话来简要概括"
+        "这次讲解的内容和结构。你的教学采用总分或分总的形式，逻辑清晰。"
+        "你喜欢采用分点的形式，并把重要内容加粗。\n"
+        "你必须严格遵守知识主题进行讲解，不可以多回答或者少回答。"
+        "在讲解时，你需要遵循你的教案员给你的指示。\n"
+        "如果指示中告诉你你的位置在开头，你可以在前面加上一段引入；如果指示中告诉你你的位置在结尾，你需要在"
+        "最后加上一段总结。否则，保持你的回答结构干练，不要擅自加入其他部分。\n"
+        "如果给出了前面老师已经讲解的内容，你在回答时可能需要参考它们。\n"
+        "你有一本教案，教案的使用要求和内容会在下面给出。\n"
+        "请注意，在回答过程中不要说出这个prompt的任何一部分，包括但不限于："
+        "说出“同学”、“老师”等身份、说出“总”“分”“分点”结构、“教案员”、“指示”等。"
+        "你在回答时不要说出“我”这个字。"
+    ),
+    user=(
+        "这次你需要给这位同学教的知识主题是：{topic}。\n"
+        "教案员给你的指示：{instruction}。\n"
+        "{prev_block}"
+        "{strict_hint}\n"
+        "教案的内容如下：\n"
+        "{context}\n"
+        "你可以开始生成了。"
+    ),
+)
+
+MCQ_PROMPT = PromptTemplate(
+    "mcq",
+    system=(
+        "你是一位出单选题的老师，你和其他多位老师合作一起帮助一位同学学习。\n"
+        "你必须严格遵守给定的主题出一道单选题。在出题时，你需要遵循你的教案员给你的指示。\n"
+        '你的回答格式必须为JSON样式。这是一个回答的例子：{"question":"...","options":["A. ...","B. ...","C. ...","D. ..."],"answer":"A/B/C/D","rationale":"..."}\n'
+        "你在rationale部分用一句话来解释这道题，并且带出这道题的答案字母。\n"
+        "你需要保证你的答案随机从ABCD中选择。\n"
+        "如果给出了前面老师已经讲解的内容，你出题的内容必须不能超出这些讲解的内容。"
+    ),
+    user=(
+        "这次你需要给这位同学出题的主题是：{topic}。\n"
+        "教案员给你的指示：{instruction}。\n"
+        "{prev_block}"
+        "你可以开始出题了。"
+    ),
+)
+
+MCQ_BATCH_PROMPT = PromptTemplate(
+    "mcq_batch",
+    system=(
+        "你是一位出单选题的老师，你和其他多位老师合作一起帮助一位同学学习。\n"
+        "你需要围绕给定的主题一次出一组单选题，题目之间考查的知识点或角度不能重复。"
+        "在出题时，你需要遵循你的教案员给你的指示。\n"
+        "你的回答格式必须为JSON数组，数组里每一项是一道题。这是一个回答的例子：\n"
+        '[{"question":"...","options":["A. ...","B. ...","C. ...","D. ..."],"answer":"A/B/C/D","rationale":"..."},'
+        '{"question":"...","options":["A. ...","B. ...","C. ...","D. ..."],"answer":"A/B/C/D","rationale":"..."}]\n'
+        "每道题都在rationale部分用一句话来解释这道题，并且带出这道题的答案字母。\n"
+        "你需要保证每道题的答案随机从ABCD中选择，不要让各题答案集中在同一个字母上。\n"
+        "如果给出了前面老师已经讲解的内容，你出题的内容必须不能超出这些讲解的内容。\n"
+        "除了这个JSON数组，不要输出任何其他文字。"
+    ),
+    user=(
+        "这次你需要给这位同学出题的主题是：{topic}。\n"
+        "题目数量：{n} 道。\n"
+        "教案员给你的指示：{instruction}。\n"
+        "{prev_block}"
+        "你可以开始出题了。"
+    ),
+)
+
+_NO_CODEBLOCK_HINT = (
+    "重要要求：\n"
+    "- 不要在生成的中间使用代码块语法 ``` ，也不要输出任何 ```。\n"
+    "- 如果要展示文法产生式、公式等，请用普通行或列表的形式书写，例如：\n"
+    "  - S→bAb\n"
+    "  - A→(B | a\n"
+    "而不是放在 ``` 包裹的代码块中。\n"
+)
+
+_CARDMAP_USER = (
+    "这次你需要给这位同学做的{label}主题是：{topic}。\n"
+    "教案员给你的指示：{instruction}。\n"
+    "{prev_block}"
+)
+
+CARD_PROMPT = PromptTemplate(
+    "card",
+    system=(
+        "你是一位给学生做知识卡片的老师，你和其他多位老师合作一起帮助一位同学学习。\n"
+        "你必须保证你的知识卡片足够简短、凝练。\n"
+        "你的输出需要使用Markdown格式。\n"
+        "你必须严格遵守知识主题进行制作，不可以多写或者少写。在制作时，你需要遵循你的教案员给你的指示。\n"
+        "如果给出了前面老师已经讲解的内容，你制作的内容必须不能超出这些讲解的内容。\n"
+        + _NO_CODEBLOCK_HINT
+    ),
+    user=_CARDMAP_USER,
+)
+
+MINDMAP_PROMPT = PromptTemplate(
+    "mindmap",
+    system=(
+        "你是一位给学生做思维导图的老师，你和其他多位老师合作一起帮助一位同学学习。\n"
+        "你的输出需要使用Markdown格式。\n"
+        "你的思维导图起到总结作用，你必须保证你的思维导图完整包含下面老师讲解的内容。\n"
+        "你必须严格遵守知识主题进行制作，不可以多写或者少写。在制作时，你需要遵循你的教案员给你的指示。\n"
+        "如果给出了前面老师已经讲解的内容，你制作的内容必须不能超出这些讲解的内容。\n"
+        + _NO_CODEBLOCK_HINT
+    ),
+    user=_CARDMAP_USER,
+)
 
 
 def rag_answer(
-        llm: ChatOpenAI,
+        llm: LLMTransport,
         vs,
         q: str,
         k: int,
@@ -34,158 +156,111 @@ def rag_answer(
         role: str | None = None,
         strictness: str = "strict",
         extra_context: str = "",
-        instruction: str = ""
+        instruction: str = "",
+        on_text: Optional[Callable[[str], None]] = None,
+        hits: Optional[List[Document]] = None,
 ) -> Tuple[str, List[Document]]:
     # q是话题，已不是问题
-    # 1) 按需改写检索 query（可能等于原 q）
+    # 1) 检索（plan 执行时可能已经预取好）
+    if hits is None:
+        hits = retrieve(vs, q, k)
 
+    # 2) 严格度策略
+    strictness, strict_hint = _strict_hint(strictness)
 
-    # 2) 检索
-    hits = retrieve(vs, q, k)
-    ctx = format_hits(hits)
-
-    # 4) 严格度策略
-    if str(strictness).lower() == "soft":
-        strict_hint = (
-            "你可以以教案为参考，自行发挥来执行好你的指示。"
-        )
-    else:
-        strictness = "strict"
-        strict_hint = (
-            '''你需要以教案作为主要参考去输出教学内容。
-            如果依据不足，你可以适当补充一些内容，但总体上不能和教案冲突。\n'''
-        )
-
-    # 5) 组装可选的“前序产物”
-    prev_part = ""
+    # 3) 按 token 预算分配 教案片段 / 前序产物 / 指示
     extra_context = (extra_context or "").strip()
-    if extra_context:
-        prev_part = f"{extra_context[:1200]}"
-
-    inst_part = ""
     instruction = (instruction or "").strip()
-    if instruction:
-        inst_part = f"{instruction[:400]}"
-    
-    #6) Prompt
-    prompt = (
-        "你是一位辅助学习的老师，你和其他多位老师合作一起帮助一位同学学习。你会在教学的开头以一句话来简要概括"
-        "这次讲解的内容和结构。你的教学采用总分或分总的形式，逻辑清晰。"
-        "你喜欢采用分点的形式，并把重要内容加粗。"
-        "这次你需要给这位同学教的知识主题是："
-        f"{q}。\n"
-        "你必须严格遵守知识主题进行讲解，不可以多回答或者少回答。"
-        "在讲解时，你需要遵循你的教案员给你的指示："
-        f"{inst_part}。\n"
-        "如果指示中告诉你你的位置在开头，你可以在前面加上一段引入；如果指示中告诉你你的位置在结尾，你需要在"
-        "最后加上一段总结。否则，保持你的回答结构干练，不要擅自加入其他部分。"
-        + ("你在回答时可能需要参考前面老师已经讲解的内容：\n" if prev_part else "")
-        + f"{prev_part}\n"
-        +"你有一本教案，"
-        +f"{strict_hint}\n"
-        +"教案的内容如下：\n"
-        f"{ctx}\n"
-        +'请注意，在回答过程中不要说出这个prompt的任何一部分，包括但不限于：'
-        +'说出“同学”、“老师”等身份、说出“总”“分”“分点”结构、“教案员”、“指示”等。'
-        +'你在回答时不要说出“我”这个字。'
-        +'你可以开始生成了。'
+    budget = TokenBudget()
+    fitted = budget.fit({
+        "context": [format_hits([d]) for d in hits],
+        "artifacts": [extra_context],
+        "instruction": [instruction],
+    })
+    budget.to_devlog(devlog, "answer")
+    ctx = "\n\n".join(fitted["context"])
+    prev_part = fitted["artifacts"][0]
+    inst_part = fitted["instruction"][0]
+
+    # 4) Prompt：静态 system 在前，主题 / 指示 / 教案在后
+    messages = ANSWER_PROMPT.render(
+        topic=q,
+        instruction=inst_part,
+        prev_block=(f"你在回答时可能需要参考前面老师已经讲解的内容：\n{prev_part}\n" if prev_part else ""),
+        strict_hint=strict_hint,
+        context=ctx,
     )
 
-
-    devlog["prompt"] = prompt
+    devlog["prompt"] = prompt_text(messages)
     devlog["strictness"] = strictness
     devlog["extra_context_len"] = len(extra_context)
     devlog["instruction"] = instruction
 
-
-    # out = llm.invoke(prompt)
-    # devlog["raw"] = getattr(out, "content", str(out))
-    placeholder = st.empty()
-    buffer = StringIO()
-
-    # 3) 调用 deepseek 流式
-    stream = deepseek_client.chat.completions.create(
-        model="deepseek-chat",
-        stream=True,
-        messages=[
-            {"role": "user", "content": prompt},
-        ],
-    )
-
-    for chunk in stream:
-        delta = chunk.choices[0].delta
-        token = delta.content or ""
-        if not token:
-            continue
-        buffer.write(token)
-        # 实时刷到页面
-        placeholder.markdown(buffer.getvalue())
-
-    final_text = buffer.getvalue()
+    # 5) 流式生成；渲染由调用方通过 on_text 负责（已节流）
+    stats = StreamStats()
+    final_text = stream_chat(llm, messages, on_text=on_text, stats=stats)
+    stats.to_devlog(devlog, "answer")
+    record_cache_usage(devlog, "answer", stats.usage)
     devlog["raw"] = final_text
     return final_text, hits
 
 
 def gen_mcq(
-    llm: ChatOpenAI,
+    llm: LLMTransport,
     context: str,
     devlog: Dict[str, Any],
     strictness: str = "strict",
     extra_context: str = "",
     instruction: str = "",
-    topic: str = ""
+    topic: str = "",
+    on_text: Optional[Callable[[str], None]] = None,
 ) -> Dict[str, Any]:
-    # 角色与严格度提示
+    # 严格度目前只记录到 devlog（出题不再直接喂教案）
+    strictness, _ = _strict_hint(strictness)
 
-    if str(strictness).lower() == "soft":
-        strict_hint = (
-            "你可以以教案为参考，自行发挥来执行好你的指示。"
-        )
-    else:
-        strictness = "strict"
-        strict_hint = (
-            '''你需要以教案作为主要参考去输出教学内容。
-            如果依据不足，你可以适当补充一些内容，但总体上不能和教案冲突。\n'''
-        )
-
-    prev_part = ""
+    # 出题 / 卡片不直接喂教案，预算只在 前序产物 与 指示 之间分
     extra_context = (extra_context or "").strip()
-    if extra_context:
-        prev_part = f"{extra_context[:800]}"
-
-    inst_part = ""
     instruction = (instruction or "").strip()
-    if instruction:
-        inst_part = f"{instruction[:300]}"
-    
-    prompt = (
-        "你是一位出单选题的老师，你和其他多位老师合作一起帮助一位同学学习。这次你需要给这位同学出题的主题是："
-        f"{topic}。\n"
-        "你必须严格遵守主题出一道单选题。"
-        "在出题时，你需要遵循你的教案员给你的指示："
-        f"{inst_part}。\n"
-        +'你的回答格式必须为JSON样式。这是一个回答的例子：{"question":"...","options":["A. ...","B. ...","C. ...","D. ..."],"answer":"A/B/C/D","rationale":"..."}\n'
-        +"你在rationale部分用一句话来解释这道题，并且带出这道题的答案字母。\n"
-        +"你需要保证你的答案随机从ABCD中选择。\n"
-        + ("你在出题时需要参考前面老师已经讲解的内容，你出题的内容必须不能超出这些讲解的内容。：\n" if prev_part else "")
-        + f"{prev_part}\n"
-        # +"你有一本教案，"
-        # +f"{strict_hint}\n"
-        # +"教案的内容如下：\n"
-        # f"{context}\n"
-        +"你可以开始出题了。"
+    budget = TokenBudget()
+    fitted = budget.fit({"artifacts": [extra_context], "instruction": [instruction]})
+    budget.to_devlog(devlog, "mcq")
+    prev_part = fitted["artifacts"][0]
+    inst_part = fitted["instruction"][0]
+
+    messages = MCQ_PROMPT.render(
+        topic=topic,
+        instruction=inst_part,
+        prev_block=(f"你在出题时需要参考前面老师已经讲解的内容：\n{prev_part}\n" if prev_part else ""),
     )
-    devlog["prompt_mcq"] = prompt
+    devlog["prompt_mcq"] = prompt_text(messages)
     devlog["mcq_strictness"] = strictness
     devlog["instruction"] = instruction
 
-    text = llm.invoke(prompt).content
+    # 边生成边扫描：最外层对象一闭合就拿到完整题目
+    scanner = JSONObjectScanner(depth=1)
+    objs: List[str] = []
+    fed = 0
+
+    def _on_text(full: str):
+        nonlocal fed
+        objs.extend(scanner.feed(full[fed:]))
+        fed = len(full)
+        if on_text is not None:
+            on_text(full)
+
+    stats = StreamStats()
+    text = stream_chat(llm, messages, on_text=_on_text, stats=stats, temperature=0)
+    stats.to_devlog(devlog, "mcq")
+    record_cache_usage(devlog, "mcq", stats.usage)
     devlog["raw_mcq"] = text
-    try:
-        data = json.loads(text)
-    except Exception:
-        m = re.search(r"\{.*\}", text, re.S)
-        data = json.loads(m.group(0)) if m else {
+    for obj in objs:
+        data = _normalize_mcq(loads_lenient(obj))
+        if data is not None:
+            return data
+    m = re.search(r"\{.*\}", text, re.S)
+    data = loads_lenient(m.group(0)) if m else None
+    if not isinstance(data, dict):
+        data = {
             "question": "Parse failed",
             "options": [],
             "answer": "",
@@ -194,84 +269,160 @@ def gen_mcq(
     return data
 
 
+def _normalize_mcq(data: Any) -> Optional[Dict[str, Any]]:
+    """
+    校验并规范化一道题：题干非空、至少两个选项、答案落在选项范围内。
+    选项缺少 "A. " 前缀时补上；答案写成整句选项时还原成字母。不合格返回 None。
+    """
+    if not isinstance(data, dict):
+        return None
+    question = str(data.get("question") or "").strip()
+    opts = data.get("options")
+    if not question or not isinstance(opts, list) or len(opts) < 2:
+        return None
+    letters = "ABCDEFGH"[:len(opts)]
+    options = []
+    for letter, o in zip(letters, opts):
+        o = str(o).strip()
+        if not re.match(rf"^{letter}\s*[.．、:：)]", o):
+            o = f"{letter}. {o}"
+        options.append(o)
+    ans = str(data.get("answer") or "").strip()
+    letter = ans[:1].upper()
+    if letter not in letters:
+        # 答案可能写成了选项原文
+        letter = next((letters[i] for i, o in enumerate(options) if ans and ans in o), "")
+    if not letter:
+        return None
+    out = dict(data)
+    out.update({
+        "question": question,
+        "options": options,
+        "answer": letter,
+        "rationale": str(data.get("rationale") or ""),
+    })
+    return out
+
+
+def gen_mcq_batch(
+    llm: LLMTransport,
+    context: str,
+    devlog: Dict[str, Any],
+    n: int,
+    strictness: str = "strict",
+    extra_context: str = "",
+    instruction: str = "",
+    topic: str = "",
+    on_text: Optional[Callable[[str], None]] = None,
+    on_question: Optional[Callable[[int, Dict[str, Any]], None]] = None,
+) -> List[Dict[str, Any]]:
+    """
+    一次调用生成 n 道单选题（JSON 数组）。
+    - 每道题在数组里闭合时立即修复、校验，并通过 on_question(序号, 题目) 交给调用方渲染
+    - on_text 收到的是“当前正在生成的这道题”的原文，用于预览
+    - 修复 / 校验失败的题会被跳过，返回实际得到的题目列表
+    """
+    n = max(1, min(int(n or 1), 10))
+    strictness, _ = _strict_hint(strictness)
+
+    # 出题 / 卡片不直接喂教案，预算只在 前序产物 与 指示 之间分
+    extra_context = (extra_context or "").strip()
+    instruction = (instruction or "").strip()
+    budget = TokenBudget()
+    fitted = budget.fit({"artifacts": [extra_context], "instruction": [instruction]})
+    budget.to_devlog(devlog, "mcq_batch")
+
+    messages = MCQ_BATCH_PROMPT.render(
+        topic=topic,
+        n=n,
+        instruction=fitted["instruction"][0],
+        prev_block=(
+            f"你在出题时需要参考前面老师已经讲解的内容：\n{fitted['artifacts'][0]}\n"
+            if fitted["artifacts"][0] else ""
+        ),
+    )
+    devlog["prompt_mcq_batch"] = prompt_text(messages)
+    devlog["mcq_strictness"] = strictness
+    devlog["instruction"] = instruction
+
+    scanner = JSONObjectScanner(depth=2)
+    questions: List[Dict[str, Any]] = []
+    rejected: List[str] = []
+    fed = 0
+    tail_start = 0
+
+    def _on_text(full: str):
+        nonlocal fed, tail_start
+        closed = scanner.feed(full[fed:])
+        if closed:
+            tail_start = len(full)
+        for raw in closed:
+            q = _normalize_mcq(loads_lenient(raw))
+            if q is None:
+                rejected.append(raw)
+            elif len(questions) < n:
+                questions.append(q)
+                if on_question is not None:
+                    on_question(len(questions) - 1, q)
+        fed = len(full)
+        if on_text is not None:
+            on_text(full[tail_start:])
+
+    stats = StreamStats()
+    text = stream_chat(llm, messages, on_text=_on_text, stats=stats, temperature=0)
+    stats.to_devlog(devlog, "mcq_batch")
+    record_cache_usage(devlog, "mcq_batch", stats.usage)
+    devlog["raw_mcq_batch"] = text
+    devlog["mcq_batch_got"] = f"{len(questions)}/{n}"
+    if rejected:
+        devlog["mcq_batch_rejected"] = "\n".join(rejected)
+    return questions
+
+
 def gen_card_or_map(
-    llm: ChatOpenAI,
+    llm: LLMTransport,
     context: str,
     mode: str,
     devlog: Dict[str, Any],
     strictness: str = "strict",
     extra_context: str = "",
     instruction :str= "",
-    topic:str = ""
+    topic:str = "",
+    on_text: Optional[Callable[[str], None]] = None,
 ) -> str:
     # 产物形态
     if mode == "card":
-        instr = (
-            '''你是一位给学生做知识卡片的老师，你和其他多位老师合作一起帮助一位同学学习。
-            你必须保证你的知识卡片足够简短、凝练。
-            你的输出需要使用Markdown格式。
-            这次你需要给这位同学做的知识卡片主题是：'''
-        )
+        template, label = CARD_PROMPT, "知识卡片"
     else:
-        instr = (
-            '''你是一位给学生做思维导图的老师，你和其他多位老师合作一起帮助一位同学学习。
-            你的输出需要使用Markdown格式。
-            你的思维导图起到总结作用，你必须保证你的思维导图完整包含下面老师讲解的内容。
-            这次你需要给这位同学做的思维导图主题是：'''
-        )
+        template, label = MINDMAP_PROMPT, "思维导图"
 
+    strictness, _ = _strict_hint(strictness)
 
-    if str(strictness).lower() == "soft":
-        strict_hint = (
-            "你可以以教案为参考，自行发挥来执行好你的指示。"
-        )
-    else:
-        strictness = "strict"
-        strict_hint = (
-            '''你需要以教案作为主要参考去输出教学内容。
-            如果依据不足，你可以适当补充一些内容，但总体上不能和教案冲突。\n'''
-        )
-
-    prev_part = ""
+    # 出题 / 卡片不直接喂教案，预算只在 前序产物 与 指示 之间分
     extra_context = (extra_context or "").strip()
-    if extra_context:
-        prev_part = f"{extra_context[:1200]}"
-
-    inst_part = ""
     instruction = (instruction or "").strip()
-    if instruction:
-        inst_part = f"{instruction[:400]}"
-
-    no_codeblock_hint = (
-        "重要要求：\n"
-        "- 不要在生成的中间使用代码块语法 ``` ，也不要输出任何 ```。\n"
-        "- 如果要展示文法产生式、公式等，请用普通行或列表的形式书写，例如：\n"
-        "  - S→bAb\n"
-        "  - A→(B | a\n"
-        "而不是放在 ``` 包裹的代码块中。\n"
-    )
-    prompt = (
-        instr
-        +f"{topic}。\n"            
-        "你必须严格遵守知识主题进行制作，不可以多写或者少写。"
-        "在制作时，你需要遵循你的教案员给你的指示："
-        f"{inst_part}。\n"
-        + ("你在回答时需要参考前面老师已经讲解的内容，你制作的内容必须不能超出这些讲解的内容。：\n" if prev_part else "")
-        + f"{prev_part}\n"
-        # +"你有一本教案，"
-        # +f"{strict_hint}\n"
-        # +"教案的内容如下：\n"
-        # f"{context}\n"
-        # +"你可以开始生成了。"
-        +f"{no_codeblock_hint}\n"
+    budget = TokenBudget()
+    fitted = budget.fit({"artifacts": [extra_context], "instruction": [instruction]})
+    budget.to_devlog(devlog, "cardmap")
+    prev_part = fitted["artifacts"][0]
+    inst_part = fitted["instruction"][0]
+
+    messages = template.render(
+        label=label,
+        topic=topic,
+        instruction=inst_part,
+        prev_block=(f"你在制作时需要参考前面老师已经讲解的内容：\n{prev_part}\n" if prev_part else ""),
     )
 
-    devlog["prompt_cardmap"] = prompt
+    devlog["prompt_cardmap"] = prompt_text(messages)
 
     devlog["cardmap_strictness"] = strictness
     devlog["instruction"] = instruction
-    
-    out = llm.invoke(prompt).content
+
+    stats = StreamStats()
+    out = stream_chat(llm, messages, on_text=on_text, stats=stats, temperature=0)
+    stats.to_devlog(devlog, "cardmap")
+    record_cache_usage(devlog, "cardmap", stats.usage)
     devlog["raw_cardmap"] = out
     return out
 
@@ -309,6 +460,20 @@ def _build_last_turn(history: List[Dict[str, Any]] | None) -> str:
     return "\n".join(lines)
 
 
+REWRITE_PROMPT = PromptTemplate(
+    "rewrite",
+    system=(
+        "你是一个“查询改写”助手。\n"
+        "用户当前的问题里如果出现“这个东西”“它”“这类方法”等指代，"
+        "请结合最近一轮对话，把问题改写成一个自包含、完整、具体的中文问题。\n"
+        "如果当前问题本身已经足够清晰，不需要依赖上下文就能理解，"
+        "那就原样输出当前问题，不要改写。\n"
+        "只输出最终的问题文本，不要添加任何解释或前后缀。"
+    ),
+    user="[最近一轮对话]\n{last_turn}\n\n[当前问题]\n{q}",
+)
+
+
 def _rewrite_query_if_needed(
     llm,
     q: str,
@@ -322,18 +487,10 @@ def _rewrite_query_if_needed(
     if not last_turn:
         return q
 
-    prompt = (
-        "你是一个“查询改写”助手。\n"
-        "用户当前的问题里如果出现“这个东西”“它”“这类方法”等指代，"
-        "请结合最近一轮对话，把问题改写成一个自包含、完整、具体的中文问题。\n"
-        "如果当前问题本身已经足够清晰，不需要依赖上下文就能理解，"
-        "那就原样输出当前问题，不要改写。\n"
-        "只输出最终的问题文本，不要添加任何解释或前后缀。\n\n"
-        f"[最近一轮对话]\n{last_turn}\n\n"
-        f"[当前问题]\n{q}"
-    )
-
-    out = llm.invoke(prompt).content.strip()
+    messages = REWRITE_PROMPT.render(last_turn=last_turn, q=q)
+    reply = llm.invoke(messages)
+    record_cache_usage(devlog, "rewrite", reply.usage)
+    out = reply.content.strip()
     devlog["q_rewritten"] = out
     # 防止 LLM 弄丢信息：返回空就退回 q
     return out or q
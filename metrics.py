@@ -0,0 +1,207 @@
+"""
+全链路耗时埋点：
+- span(name, **labels): 计时上下文，耗时记进直方图 rag_span_seconds{span=name, ...}
+- observe / inc: 直接记直方图 / 计数器（LLM 排队时间、首 token 时间、token 数等）
+- 每个值同时记进进程级和当前会话的 MetricSet；会话由 bind_session 绑定（ContextVar，
+  后台线程要用 contextvars.copy_context().run 把会话带过去）
+- 导出：prometheus_text()（Prometheus 文本格式）、snapshot()（JSON）；
+  设置 RAG_METRICS_JSONL 时每个观测值追加一行到该文件；
+  设置 RAG_METRICS_PROM 时后台线程定期把进程级指标写成 node_exporter textfile
+"""
+import bisect
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from config import METRICS_BUCKETS, METRICS_JSONL, METRICS_PROM_FILE, METRICS_PROM_INTERVAL
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def _labels(labels: Dict[str, Any]) -> Labels:
+    return tuple(sorted((k, str(v)) for k, v in labels.items() if v is not None))
+
+
+def _fmt_labels(labels: Labels, extra: str = "") -> str:
+    parts = [f'{k}="{v}"' for k, v in labels]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Histogram:
+    """固定桶直方图（Prometheus 语义：桶计数累积、上界含等号），分位数按桶内线性插值估算。"""
+
+    def __init__(self, buckets=METRICS_BUCKETS):
+        self.bounds = list(buckets)
+        self.counts = [0] * (len(self.bounds) + 1)   # 最后一格是 +Inf
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, v: float):
+        self.counts[bisect.bisect_left(self.bounds, v)] += 1
+        self.count += 1
+        self.sum += v
+        self.max = max(self.max, v)
+
+    def quantile(self, q: float) -> float:
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        acc = 0
+        for i, c in enumerate(self.counts):
+            if acc + c >= rank and c:
+                lo = self.bounds[i - 1] if i > 0 else 0.0
+                hi = self.bounds[i] if i < len(self.bounds) else self.max
+                return min(lo + (hi - lo) * (rank - acc) / c, self.max)
+            acc += c
+        return self.max
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "count": self.count,
+            "sum": round(self.sum, 6),
+            "mean": round(self.sum / self.count, 6) if self.count else 0.0,
+            "p50": round(self.quantile(0.5), 6),
+            "p95": round(self.quantile(0.95), 6),
+            "max": round(self.max, 6),
+        }
+
+
+class MetricSet:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.hists: Dict[Tuple[str, Labels], Histogram] = {}
+        self.counters: Dict[Tuple[str, Labels], float] = {}
+
+    def observe(self, name: str, value: float, labels: Labels = ()):
+        with self._lock:
+            h = self.hists.get((name, labels))
+            if h is None:
+                h = self.hists[(name, labels)] = Histogram()
+            h.observe(value)
+
+    def inc(self, name: str, value: float = 1.0, labels: Labels = ()):
+        with self._lock:
+            self.counters[(name, labels)] = self.counters.get((name, labels), 0.0) + value
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "histograms": [{"name": n, "labels": dict(lb), **h.to_dict()} for (n, lb), h in sorted(self.hists.items())],
+                "counters": [{"name": n, "labels": dict(lb), "value": v} for (n, lb), v in sorted(self.counters.items())],
+            }
+
+    def prometheus_text(self) -> str:
+        out: List[str] = []
+        with self._lock:
+            typed = set()
+            for (name, lb), h in sorted(self.hists.items()):
+                if name not in typed:
+                    out.append(f"# TYPE {name} histogram")
+                    typed.add(name)
+                acc = 0
+                for bound, c in zip([f"{b:g}" for b in h.bounds] + ["+Inf"], h.counts):
+                    acc += c
+                    le = 'le="%s"' % bound
+                    out.append(f"{name}_bucket{_fmt_labels(lb, le)} {acc}")
+                out.append(f"{name}_sum{_fmt_labels(lb)} {h.sum:.6f}")
+                out.append(f"{name}_count{_fmt_labels(lb)} {h.count}")
+            for (name, lb), v in sorted(self.counters.items()):
+                if name not in typed:
+                    out.append(f"# TYPE {name} counter")
+                    typed.add(name)
+                out.append(f"{name}{_fmt_labels(lb)} {v:g}")
+        return "\n".join(out) + "\n"
+
+
+_process = MetricSet()
+_session: ContextVar[Optional[MetricSet]] = ContextVar("rag_metrics_session", default=None)
+_jsonl_lock = threading.Lock()
+
+
+def bind_session(ms: MetricSet):
+    """把当前线程（上下文）的观测值同时记进会话级 MetricSet；Streamlit 每次重跑开头调用。"""
+    _session.set(ms)
+
+
+def process_metrics() -> MetricSet:
+    return _process
+
+
+def session_metrics() -> Optional[MetricSet]:
+    return _session.get()
+
+
+def _sink(kind: str, name: str, value: float, lb: Labels):
+    if not METRICS_JSONL:
+        return
+    line = json.dumps({"ts": round(time.time(), 3), "type": kind, "name": name, "labels": dict(lb), "value": value},
+                      ensure_ascii=False)
+    with _jsonl_lock:
+        with open(METRICS_JSONL, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+
+
+def observe(name: str, value: float, **labels):
+    lb = _labels(labels)
+    _process.observe(name, value, lb)
+    ms = _session.get()
+    if ms is not None:
+        ms.observe(name, value, lb)
+    _sink("observe", name, value, lb)
+
+
+def inc(name: str, value: float = 1.0, **labels):
+    lb = _labels(labels)
+    _process.inc(name, value, lb)
+    ms = _session.get()
+    if ms is not None:
+        ms.inc(name, value, lb)
+    _sink("inc", name, value, lb)
+
+
+@contextmanager
+def span(name: str, **labels) -> Iterator[None]:
+    """耗时记进 rag_span_seconds{span=name}；出异常时额外带 error="1"。"""
+    t0 = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        labels["error"] = "1"
+        raise
+    finally:
+        observe("rag_span_seconds", time.perf_counter() - t0, span=name, **labels)
+
+
+def prometheus_text() -> str:
+    return _process.prometheus_text()
+
+
+def write_prometheus(path: str):
+    """原子写入（node_exporter textfile collector 会读到半个文件）。"""
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(prometheus_text())
+    os.replace(tmp, path)
+
+
+def start_prom_writer(path: str = METRICS_PROM_FILE, interval: float = METRICS_PROM_INTERVAL) -> Optional[threading.Thread]:
+    if not path:
+        return None
+
+    def _loop():
+        while True:
+            try:
+                write_prometheus(path)
+            except OSError:
+                pass
+            time.sleep(interval)
+
+    th = threading.Thread(target=_loop, name="metrics-writer", daemon=True)
+    th.start()
+    return th
@@ -0,0 +1,153 @@
+"""
+开发者模式里的采样剖析（纯标准库，不装 py-spy / pyinstrument）：
+- SamplingProfiler: 后台线程每 interval 秒用 sys._current_frames() 抓一次调用栈，
+  只采发起剖析的线程和剖析期间新起的线程（plan 流式生成、检索预取、LLM 对冲等），
+  不碰 sys.setprofile，被剖析的代码本身不多做任何事
+- 结果存成 speedscope 格式（https://www.speedscope.app 直接打开），并给出自身 / 累计耗时最高的函数
+- 只有开发者模式里点了“剖析下一次重跑”才会导入本模块；关闭时零开销
+"""
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+from config import PROFILE_INTERVAL, PROFILE_TOP_N
+
+Frame = Tuple[str, str, int]   # (函数名, 文件, 定义行号)
+
+
+class SamplingProfiler:
+    def __init__(self, interval: float = PROFILE_INTERVAL):
+        self.interval = interval
+        self.started = 0.0
+        self.finished = 0.0
+        self.frames: List[Frame] = []
+        self._frame_idx: Dict[Frame, int] = {}
+        # 线程 id -> [(采样时刻, 栈：根在前的帧下标)]
+        self.samples: Dict[int, List[Tuple[float, List[int]]]] = {}
+        self.thread_names: Dict[int, str] = {}
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _intern(self, frame: Frame) -> int:
+        idx = self._frame_idx.get(frame)
+        if idx is None:
+            idx = self._frame_idx[frame] = len(self.frames)
+            self.frames.append(frame)
+        return idx
+
+    def _stack(self, frame) -> List[int]:
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append(self._intern((code.co_name, code.co_filename, code.co_firstlineno)))
+            frame = frame.f_back
+        stack.reverse()
+        return stack
+
+    def _run(self, target: int, existing: set):
+        me = threading.get_ident()
+        while not self._stop.is_set():
+            now = time.perf_counter()
+            for tid, frame in sys._current_frames().items():
+                if tid == me or (tid != target and tid in existing):
+                    continue
+                self.samples.setdefault(tid, []).append((now, self._stack(frame)))
+            self._stop.wait(self.interval)
+
+    def start(self) -> "SamplingProfiler":
+        target = threading.get_ident()
+        existing = set(sys._current_frames())
+        self.started = time.perf_counter()
+        self._thread = threading.Thread(target=self._run, args=(target, existing), name="sampling-profiler", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> "SamplingProfiler":
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.finished = time.perf_counter()
+        self.thread_names = {t.ident: t.name for t in threading.enumerate() if t.ident in self.samples}
+        return self
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    # --- 结果 ---
+    def _weighted(self, tid: int) -> List[Tuple[float, List[int]]]:
+        """每个样本的权重取到下一次采样的间隔（最后一个取 interval），这样合计约等于墙钟时间。"""
+        rows = self.samples.get(tid, [])
+        out = []
+        for i, (t, stack) in enumerate(rows):
+            nxt = rows[i + 1][0] if i + 1 < len(rows) else t + self.interval
+            out.append((nxt - t, stack))
+        return out
+
+    def hotspots(self, n: int = PROFILE_TOP_N) -> List[Dict[str, Any]]:
+        """按自身耗时排序的前 n 个函数（所有线程合计），带累计耗时。"""
+        self_t: Counter = Counter()
+        total_t: Counter = Counter()
+        for tid in self.samples:
+            for w, stack in self._weighted(tid):
+                if not stack:
+                    continue
+                self_t[stack[-1]] += w
+                for idx in set(stack):
+                    total_t[idx] += w
+        rows = []
+        for idx, s in self_t.most_common(n):
+            name, file, line = self.frames[idx]
+            rows.append({
+                "函数": name,
+                "位置": f"{Path(file).name}:{line}",
+                "自身(s)": round(s, 3),
+                "累计(s)": round(total_t[idx], 3),
+            })
+        return rows
+
+    def to_speedscope(self, name: str = "rag profile") -> Dict[str, Any]:
+        profiles = []
+        for tid in sorted(self.samples, key=lambda t: -len(self.samples[t])):
+            weighted = self._weighted(tid)
+            profiles.append({
+                "type": "sampled",
+                "name": f"{self.thread_names.get(tid, 'thread')} ({tid})",
+                "unit": "seconds",
+                "startValue": 0,
+                "endValue": round(sum(w for w, _ in weighted), 6),
+                "samples": [stack for _, stack in weighted],
+                "weights": [round(w, 6) for w, _ in weighted],
+            })
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "name": name,
+            "exporter": "ragStudy profiler.py",
+            "activeProfileIndex": 0,
+            "shared": {"frames": [{"name": n, "file": f, "line": l} for n, f, l in self.frames]},
+            "profiles": profiles,
+        }
+
+    def save(self, out_dir: Path, label: str = "rerun") -> Path:
+        out_dir.mkdir(parents=True, exist_ok=True)
+        stamp = time.strftime("%Y%m%d_%H%M%S")
+        path = out_dir / f"profile_{stamp}_{label}.speedscope.json"
+        tmp = path.with_name(path.name + ".tmp")
+        tmp.write_text(json.dumps(self.to_speedscope(f"{label} {stamp}"), ensure_ascii=False), encoding="utf-8")
+        os.replace(tmp, path)
+        return path
+
+    def summary(self, path: Optional[Path] = None) -> Dict[str, Any]:
+        return {
+            "path": str(path) if path else "",
+            "wall_s": round(self.finished - self.started, 3),
+            "samples": sum(len(v) for v in self.samples.values()),
+            "threads": len(self.samples),
+            "hotspots": self.hotspots(),
+        }
@@ -1,74 +1,46 @@
 import json
+import shutil
+import threading
+import time
+import uuid
 from pathlib import Path
-from typing import Dict, Any, List
-from utils import now_ts
+from typing import Callable, Dict, Any, List, Optional, Tuple
+from config import STORAGE_BACKEND, CHAT_COMPACT_INTERVAL
+from chatlog import JsonlStore
+from storage_sqlite import SqliteStore, DB_NAME
+from scheduler import DueIndex
+from registry import ProjectRegistry
 
 
-class Project:
-    def __init__(self, root: Path):
-        self.root = root
-        self.meta_path = root / "project.json"
-        self.files_dir = root / "files"
-        self.index_dir = root / "index"
-        self.preview_dir = root / "previews"
-        self.chat_path = root / "chats.jsonl"
-        self.wrong_path = root / "wrong.jsonl"
-        self.meta: Dict[str, Any] = {}
+# (项目目录, 是否已有 project.db) -> 存储对象。每次重跑都会 new 一个 Project，
+# 存储对象（SQLite 的各线程连接、PRAGMA 与建表）按项目复用，不再每次重开；迁移出 project.db 后键随之变化
+_stores: Dict[Tuple[str, bool], Any] = {}
+_stores_lock = threading.Lock()
 
 
-    def exists(self) -> bool:
-        return self.meta_path.exists()
-    
-    
-    def load_meta(self):
-        self.meta = json.loads(self.meta_path.read_text(encoding="utf-8")) if self.meta_path.exists() else {}
-    
-    
-    def save_meta(self):
-        self.root.mkdir(parents=True, exist_ok=True)
-        self.meta_path.write_text(json.dumps(self.meta, ensure_ascii=False, indent=2), encoding="utf-8")
-    
-    
-    # --- 閼卞﹤銇� ---
-    def append_chat(self, record: Dict[str, Any]):
-        with open(self.chat_path, "a", encoding="utf-8") as f:
-            f.write(json.dumps(record, ensure_ascii=False) + "\n")
-    
-    
-    def load_chats(self, limit: int = 200) -> List[Dict[str, Any]]:
-        out: List[Dict[str, Any]] = []
-        if not self.chat_path.exists():
-            return out
-        with open(self.chat_path, "r", encoding="utf-8") as f:
-            for line in f:
-                try:
-                    out.append(json.loads(line))
-                except: # noqa
-                    pass
-        return out[-limit:]
-    
-    
-    # --- 闁挎瑩顣介張锟� ---
-    def log_wrong(self, record: Dict[str, Any]):
-        with open(self.wrong_path, "a", encoding="utf-8") as f:
-            f.write(json.dumps(record, ensure_ascii=False) + "\n")
-    
-    
-    def load_wrong(self) -> List[Dict[str, Any]]:
-        if not self.wrong_path.exists():
-            return []
-        out: List[Dict[str, Any]] = []
-        with open(self.wrong_path, "r", encoding="utf-8") as f:
-            for line in f:
-                try:
-                    out.append(json.loads(line))
-                except: # noqa
-                    pass
-        return out
-import json
-from pathlib import Path
-from typing import Dict, Any, List
-from utils import now_ts
+def _open_store(root: Path):
+    """
+    选择存储后端：已有 project.db 的项目一律走 SQLite；
+    新项目按 STORAGE_BACKEND 决定；已有 JSONL 数据的老项目保持 JSONL，需显式迁移。
+    """
+    has_db = (root / DB_NAME).exists()
+    key = (str(root.resolve()), has_db)
+    with _stores_lock:
+        store = _stores.get(key)
+        if store is None:
+            if has_db:
+                store = SqliteStore(root)
+            else:
+                has_jsonl = (root / "chats.jsonl").exists() or (root / "wrong.jsonl").exists()
+                store = SqliteStore(root) if STORAGE_BACKEND == "sqlite" and not has_jsonl else JsonlStore(root)
+            _stores[key] = store
+        return store
+
+
+def _forget_store(root: Path):
+    with _stores_lock:
+        for key in [k for k in _stores if k[0] == str(root.resolve())]:
+            del _stores[key]
 
 
 class Project:
@@ -81,54 +53,134 @@ class Project:
         self.chat_path = root / "chats.jsonl"
         self.wrong_path = root / "wrong.jsonl"
         self.meta: Dict[str, Any] = {}
+        self.store = _open_store(root)
+        # 项目目录的上一级就是 INDEX_ROOT，跨项目的到期索引放在那里
+        self.due_index = DueIndex(root.parent)
+
+
+    @classmethod
+    def from_registry(cls, index_root: Path, entry: Dict[str, Any]) -> "Project":
+        """用注册表条目构造项目，不读 project.json。"""
+        proj = cls(index_root / entry["id"])
+        proj.meta = {k: v for k, v in entry.items() if k != "id"}
+        return proj
 
 
     def exists(self) -> bool:
         return self.meta_path.exists()
-    
-    
+
+
+    def delete(self):
+        """删除项目目录，并从跨项目到期索引和项目注册表里移除。"""
+        shutil.rmtree(self.root, ignore_errors=True)
+        _forget_store(self.root)
+        self.due_index.drop_project(self.root.name)
+        ProjectRegistry(self.root.parent).remove(self.root.name)
+
+
     def load_meta(self):
         self.meta = json.loads(self.meta_path.read_text(encoding="utf-8")) if self.meta_path.exists() else {}
-    
-    
+
+
     def save_meta(self):
         self.root.mkdir(parents=True, exist_ok=True)
         self.meta_path.write_text(json.dumps(self.meta, ensure_ascii=False, indent=2), encoding="utf-8")
-    
-    
-    # --- 閼卞﹤銇� ---
+        self.store.save_meta(self.meta)
+        ProjectRegistry(self.root.parent).upsert(self.root.name, self.meta)
+
+
+    # --- 聊天 ---
     def append_chat(self, record: Dict[str, Any]):
-        with open(self.chat_path, "a", encoding="utf-8") as f:
-            f.write(json.dumps(record, ensure_ascii=False) + "\n")
-    
-    
-    def load_chats(self, limit: int = 200) -> List[Dict[str, Any]]:
-        out: List[Dict[str, Any]] = []
-        if not self.chat_path.exists():
-            return out
-        with open(self.chat_path, "r", encoding="utf-8") as f:
-            for line in f:
-                try:
-                    out.append(json.loads(line))
-                except: # noqa
-                    pass
-        return out[-limit:]
-    
-    
-    # --- 闁挎瑩顣介張锟� ---
+        self.store.append_chat(record)
+
+
+    def load_chats(self, limit: int = 200, before: Optional[int] = None) -> List[Dict[str, Any]]:
+        """最近 limit 条（或第 before 条之前的 limit 条），只读取需要的行。"""
+        return self.store.page_chats(before, limit)[0]
+
+
+    def load_chats_page(self, before: Optional[int], limit: int) -> Tuple[List[Dict[str, Any]], int]:
+        """分页读取更早的历史，返回 (记录, 第一条的序号)；序号为 0 表示已到最早。"""
+        return self.store.page_chats(before, limit)
+
+
+    def count_chats(self) -> int:
+        return self.store.count_chats()
+
+
+    def rewrite_chats(self, records: List[Dict[str, Any]]):
+        self.store.rewrite_chats(records)
+
+    def rewrite_chats_with(self, fn: Callable[[List[Dict[str, Any]]], Optional[List[Dict[str, Any]]]]):
+        """在存储的锁 / 事务里读出全部记录交给 fn 改写再写回；fn 返回 None 表示不用改写。"""
+        self.store.rewrite_chats_with(fn)
+
+
+    def export_chats(self, since: Optional[int] = None, until: Optional[int] = None) -> bytes:
+        """导出对话；给了时间范围时只读取涉及的分段。"""
+        return self.store.export_chats(since, until)
+
+
+    def compact_chats(self) -> Dict[str, int]:
+        return self.store.compact_chats()
+
+
+    # --- 错题本 ---
     def log_wrong(self, record: Dict[str, Any]):
-        with open(self.wrong_path, "a", encoding="utf-8") as f:
-            f.write(json.dumps(record, ensure_ascii=False) + "\n")
-    
-    
+        record.setdefault("id", uuid.uuid4().hex[:12])
+        self.store.log_wrong(record)
+        self.due_index.set(self.root.name, record)
+
+
     def load_wrong(self) -> List[Dict[str, Any]]:
-        if not self.wrong_path.exists():
-            return []
-        out: List[Dict[str, Any]] = []
-        with open(self.wrong_path, "r", encoding="utf-8") as f:
-            for line in f:
-                try:
-                    out.append(json.loads(line))
-                except: # noqa
-                    pass
-        return out
\ No newline at end of file
+        return self.store.load_wrong()
+
+
+    def wrong_stamp(self) -> Any:
+        return self.store.wrong_stamp()
+
+
+    def update_wrong(self, item: Dict[str, Any]):
+        """按 id 更新单条错题（盒子 / 上次复习时间），内容没变时不写。"""
+        self.store.update_wrong(item)
+        self.due_index.set(self.root.name, item)
+
+
+    def delete_wrong(self, item_id: str):
+        self.store.delete_wrong(item_id)
+        self.due_index.remove(self.root.name, item_id)
+
+
+    def sync_due_index(self, items: List[Dict[str, Any]]):
+        """老项目第一次打开错题本时，把到期时间补进跨项目索引。"""
+        if not self.due_index.has_project(self.root.name):
+            self.due_index.rebuild_project(self.root.name, items)
+
+
+    def export_wrong(self) -> bytes:
+        return self.store.export_wrong()
+
+
+def compact_all_projects(index_root: Path) -> Dict[str, Dict[str, int]]:
+    """把每个项目过长的聊天尾段滚成压缩分段；返回有变化的项目。"""
+    out = {}
+    for entry in ProjectRegistry(index_root).list():
+        try:
+            made = Project(index_root / entry["id"]).compact_chats()
+        except Exception:
+            continue
+        if made.get("segments"):
+            out[entry["id"]] = made
+    return out
+
+
+def start_chat_compactor(index_root: Path, interval: int = CHAT_COMPACT_INTERVAL) -> threading.Thread:
+    """后台守护线程，定期执行 compact_all_projects；每个进程只需启动一次。"""
+    def loop():
+        while True:
+            time.sleep(interval)
+            compact_all_projects(index_root)
+
+    th = threading.Thread(target=loop, name="chat-compactor", daemon=True)
+    th.start()
+    return th
@@ -0,0 +1,69 @@
+# prompts.py
+"""
+Prompt 组装：静态部分在前、变量部分在后。
+DeepSeek 的上下文硬盘缓存按“前缀”命中，只要 system 段逐字节不变，
+后续调用就只为变量部分付全价。因此：
+- PromptTemplate.system 必须是纯静态文本（构造时即固定，不接受任何变量）
+- 主题 / 指示 / 教案 / 前序产物等一律放进 user 段模板
+另外按调用记录 usage 里的缓存命中 / 未命中 token，并累计进程级总数。
+"""
+import threading
+from typing import Dict, Any, List, Tuple
+
+
+class PromptTemplate:
+    def __init__(self, name: str, system: str, user: str):
+        self.name = name
+        self.system = system.strip()
+        self.user = user
+
+    def render(self, **variables) -> List[Dict[str, str]]:
+        return [
+            {"role": "system", "content": self.system},
+            {"role": "user", "content": self.user.format(**variables).strip()},
+        ]
+
+
+def prompt_text(messages: List[Dict[str, str]]) -> str:
+    """把 messages 拼成一段文本，给 devlog 展示用。"""
+    return "\n\n".join(f"[{m['role']}]\n{m['content']}" for m in messages)
+
+
+# --- 缓存命中统计 ---
+_cache_lock = threading.Lock()
+_cache_totals: Dict[str, int] = {"calls": 0, "prompt_tokens": 0, "cached_tokens": 0}
+
+
+def cache_usage(usage: Dict[str, Any]) -> Tuple[int, int]:
+    """
+    从 API usage 里取 (prompt_tokens, cached_tokens)。
+    兼容 DeepSeek 的 prompt_cache_hit_tokens 与 OpenAI 的 prompt_tokens_details.cached_tokens。
+    """
+    if not usage:
+        return 0, 0
+    prompt_tokens = int(usage.get("prompt_tokens") or 0)
+    cached = usage.get("prompt_cache_hit_tokens")
+    if cached is None:
+        details = usage.get("prompt_tokens_details") or {}
+        cached = details.get("cached_tokens") or 0
+    return prompt_tokens, int(cached)
+
+
+def record_cache_usage(devlog: Dict[str, Any], tag: str, usage: Dict[str, Any]):
+    prompt_tokens, cached = cache_usage(usage)
+    if not prompt_tokens:
+        return
+    devlog[f"{tag}_prompt_tokens"] = prompt_tokens
+    devlog[f"{tag}_cached_tokens"] = cached
+    devlog[f"{tag}_uncached_tokens"] = prompt_tokens - cached
+    with _cache_lock:
+        _cache_totals["calls"] += 1
+        _cache_totals["prompt_tokens"] += prompt_tokens
+        _cache_totals["cached_tokens"] += cached
+
+
+def cache_totals() -> Dict[str, Any]:
+    with _cache_lock:
+        out: Dict[str, Any] = dict(_cache_totals)
+    out["hit_rate"] = round(out["cached_tokens"] / out["prompt_tokens"], 3) if out["prompt_tokens"] else 0.0
+    return out
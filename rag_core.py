@@ -1,63 +1,240 @@
+import hashlib
 import json
+import threading
+from collections import Counter, OrderedDict
 from pathlib import Path
-from typing import List, Optional
-import streamlit as st
-from langchain_community.embeddings import HuggingFaceEmbeddings
-from langchain_community.vectorstores import FAISS
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain.schema import Document
-from config import EMB_MODEL
+from typing import Dict, List, Optional, Tuple, TYPE_CHECKING
+from config import EMB_MODEL, EMBED_SOCKET, INDEX_CACHE_SIZE
+import metrics
+
+# LangChain / FAISS / HuggingFace 都很重，推迟到第一次真正用到时再导入（见 warmup.py）
+if TYPE_CHECKING:
+    from langchain.schema import Document
+    from langchain_community.vectorstores import FAISS
+
+
+# 进程级缓存用普通的模块变量 + 锁，不用 st.cache_resource：预热线程、RAG 服务 / 后台轮次的工作线程里
+# 没有 ScriptRunContext，调用 st.cache_resource 会刷警告
+_embeddings = None
+_embeddings_lock = threading.Lock()
 
 
-@st.cache_resource(show_spinner=False)
 def get_embeddings():
-    return HuggingFaceEmbeddings(model_name=EMB_MODEL, encode_kwargs={"normalize_embeddings": True})
+    global _embeddings
+    if _embeddings is None:
+        with _embeddings_lock:
+            if _embeddings is None:
+                if EMBED_SOCKET:
+                    # 模型在共享的向量服务里（embed_server.py），本进程不加载
+                    from embed_client import RemoteEmbeddings
+                    _embeddings = RemoteEmbeddings(EMBED_SOCKET)
+                else:
+                    from langchain_community.embeddings import HuggingFaceEmbeddings
+                    _embeddings = HuggingFaceEmbeddings(model_name=EMB_MODEL, encode_kwargs={"normalize_embeddings": True})
+    return _embeddings
 
 
 
 
-def split_docs(docs: List[Document]) -> List[Document]:
+def split_docs(docs: List["Document"]) -> List["Document"]:
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
     splitter = RecursiveCharacterTextSplitter(chunk_size=800, chunk_overlap=150)
-    return splitter.split_documents(docs)
+    with metrics.span("split"):
+        return splitter.split_documents(docs)
+
+
 
 
+def build_index(docs: List["Document"]) -> "FAISS":
+    return build_index_from_chunks(split_docs(docs))
 
 
-def build_index(docs: List[Document]) -> FAISS:
-    chunks = split_docs(docs)
+def chunk_id(content: str, meta: Optional[dict]) -> str:
+    """块的稳定 id：出处（文件名 / 页 / 幻灯片）+ 原文的哈希。同样的文件重建索引后 id 不变。"""
+    meta = meta or {}
+    key = [Path(str(meta.get("source", ""))).name, meta.get("page"), meta.get("slide"), content]
+    return hashlib.sha1(json.dumps(key, ensure_ascii=False).encode("utf-8")).hexdigest()[:24]
+
+
+def stable_ids(chunks: List["Document"]) -> List[str]:
+    """整批块的 id；出处和原文完全相同的块按出现顺序加 -1、-2 后缀，保证唯一。"""
+    seen: Counter = Counter()
+    out = []
+    for c in chunks:
+        cid = chunk_id(c.page_content, c.metadata)
+        out.append(f"{cid}-{seen[cid]}" if seen[cid] else cid)
+        seen[cid] += 1
+    return out
+
+
+def build_index_from_chunks(chunks: List["Document"]) -> "FAISS":
+    from langchain_community.vectorstores import FAISS
     emb = get_embeddings()
-    return FAISS.from_documents(chunks, emb)
+    texts = [c.page_content for c in chunks]
+    # 与 FAISS.from_documents 等价，拆成两步是为了分别计时
+    with metrics.span("embed"):
+        vectors = emb.embed_documents(texts)
+    with metrics.span("index_build"):
+        return FAISS.from_embeddings(list(zip(texts, vectors)), emb, metadatas=[c.metadata for c in chunks],
+                                     ids=stable_ids(chunks))
 
 
 
 
-def save_index(vs: FAISS, index_dir: Path):
+def save_index(vs: "FAISS", index_dir: Path):
     index_dir.mkdir(exist_ok=True, parents=True)
-    vs.save_local(str(index_dir))
+    with metrics.span("index_save"):
+        vs.save_local(str(index_dir))
     (index_dir / "stamp.json").write_text(json.dumps({"built_at": int(__import__('time').time())}), encoding="utf-8")
 
 
 
 
-def try_load_index(index_dir: Path) -> Optional[FAISS]:
+def try_load_index(index_dir: Path) -> Optional["FAISS"]:
     if not index_dir.exists():
         return None
+    from langchain_community.vectorstores import FAISS
     emb = get_embeddings()
     try:
-        return FAISS.load_local(str(index_dir), embeddings=emb, allow_dangerous_deserialization=True)
+        with metrics.span("index_load"):
+            return FAISS.load_local(str(index_dir), embeddings=emb, allow_dangerous_deserialization=True)
     except Exception:
         return None
 
 
-
-
-def retrieve(vs: FAISS, q: str, k: int) -> List[Document]:
-    return vs.similarity_search(q, k=k)
+_index_cache: "OrderedDict[str, Tuple[str, FAISS]]" = OrderedDict()   # 目录 -> (版本, 索引)，LRU
+_index_cache_lock = threading.Lock()
+_index_load_locks: Dict[str, threading.Lock] = {}
+
+
+def _load_index_cached(index_dir: str, version: str) -> Optional["FAISS"]:
+    with _index_cache_lock:
+        hit = _index_cache.get(index_dir)
+        if hit is not None and hit[0] == version:
+            _index_cache.move_to_end(index_dir)
+            return hit[1]
+        load_lock = _index_load_locks.setdefault(index_dir, threading.Lock())
+    # 同一个索引只让一个线程去反序列化，其余的等它读完直接用
+    with load_lock:
+        with _index_cache_lock:
+            hit = _index_cache.get(index_dir)
+            if hit is not None and hit[0] == version:
+                return hit[1]
+        vs = try_load_index(Path(index_dir))
+        if vs is None:
+            return None   # 加载失败不缓存，下次重试
+        vs.rag_index_version = version   # record_hits 用来判断记录里的 id 是不是这一版索引的
+        with _index_cache_lock:
+            _index_cache[index_dir] = (version, vs)   # 同一目录的旧版本直接被替换
+            _index_cache.move_to_end(index_dir)
+            while len(_index_cache) > INDEX_CACHE_SIZE:
+                _index_cache.popitem(last=False)
+        return vs
+
+
+def load_index(index_dir: Path) -> Optional["FAISS"]:
+    """
+    进程内共享的索引：按 (目录, 索引版本) 缓存，重跑 / 多个会话 / 工作线程不再各自从磁盘反序列化；
+    重建索引后 stamp 变化，自然换成新版本。加载失败（返回 None）不进缓存。
+    """
+    if not index_dir.exists():
+        return None
+    return _load_index_cached(str(index_dir.resolve()), index_version(index_dir))
 
 
 
 
-def format_hits(hits: List[Document]) -> str:
+def index_version(index_dir: Path) -> str:
+    """索引版本：构建时写入 stamp.json 的时间戳；重建索引后版本改变。"""
+    try:
+        return str(json.loads((index_dir / "stamp.json").read_text(encoding="utf-8")).get("built_at", ""))
+    except Exception:
+        return ""
+
+
+def _docstore_dict(vs) -> dict:
+    # InMemoryDocstore 把 {docstore_id: Document} 放在 _dict 里
+    return getattr(vs.docstore, "_dict", {})
+
+
+def chunk_ids(vs: "FAISS", docs: List["Document"]) -> List[Optional[str]]:
+    """
+    检索结果 -> docstore 里的块 id。新版 langchain 直接带 doc.id；
+    老版本 similarity_search 返回的就是 docstore 里的同一个对象，按对象身份反查。
+    """
+    by_obj = None
+    out: List[Optional[str]] = []
+    for d in docs:
+        did = getattr(d, "id", None)
+        if not did:
+            if by_obj is None:
+                by_obj = {id(v): k for k, v in _docstore_dict(vs).items()}
+            did = by_obj.get(id(d))
+        out.append(did)
+    return out
+
+
+def _aliases(vs) -> dict:
+    """被合并掉的近似重复块（dedup.py 记在保留块的 dup_ids 里）的 id -> 保留块的 id。"""
+    al = getattr(vs, "rag_aliases", None)
+    if al is None:
+        al = {a: k for k, d in _docstore_dict(vs).items() for a in (d.metadata or {}).get("dup_ids") or []}
+        vs.rag_aliases = al
+    return al
+
+
+def resolve_chunks(vs, ids: List[str]) -> List["Document"]:
+    """按块 id 从 docstore 取回原文；被去重合并的块取保留块，索引里已没有的 id 直接跳过。"""
+    if hasattr(vs, "resolve_chunks"):
+        # service_client.RemoteIndex：原文在 RAG 服务那边
+        return vs.resolve_chunks(ids)
+    store = _docstore_dict(vs)
+    out = []
+    for i in ids:
+        key = i if i in store else _aliases(vs).get(i) or i.split("-")[0]
+        if key in store:
+            out.append(store[key])
+    return out
+
+
+def hits_record(vs: "FAISS", docs: List["Document"], index_dir: Path) -> dict:
+    """
+    聊天记录里的依据字段：只存块 id + 索引版本，不再复制块原文。
+    个别块取不到 id 时退回内联原文，保证依据不丢。
+    """
+    ids = chunk_ids(vs, docs)
+    if all(ids):
+        return {"hit_ids": ids, "index_version": index_version(index_dir)}
+    return {"hits": [{"content": d.page_content, "meta": d.metadata} for d in docs]}
+
+
+def record_hits(vs, rec: dict) -> List["Document"]:
+    """
+    渲染时再把记录里的依据还原成 Document（兼容老记录的内联原文）。
+    块 id 是稳定的，索引重建后通常照样能取到；索引版本变了又只取回一部分时，
+    宁可当作依据不可用（有内联原文就用内联的），也不显示残缺的依据。
+    """
+    if rec.get("hit_ids") and vs is not None:
+        docs = resolve_chunks(vs, rec["hit_ids"])
+        same_version = rec.get("index_version") == getattr(vs, "rag_index_version", rec.get("index_version"))
+        if len(docs) == len(rec["hit_ids"]) or (same_version and not rec.get("hits")):
+            return docs
+        if not rec.get("hits"):
+            return []
+    elif rec.get("hit_ids") and not rec.get("hits"):
+        return []
+    from langchain.schema import Document
+    return [Document(page_content=h["content"], metadata=h["meta"]) for h in rec.get("hits") or []]
+
+
+def retrieve(vs: "FAISS", q: str, k: int) -> List["Document"]:
+    with metrics.span("retrieve"):
+        return vs.similarity_search(q, k=k)
+
+
+
+
+def format_hits(hits: List["Document"]) -> str:
     out = []
     for d in hits:
         meta = d.metadata or {}
@@ -0,0 +1,143 @@
+"""
+项目注册表：<INDEX_ROOT>/projects_index.json
+- 记录每个项目的显示名 / 创建时间 / 文件列表，列项目时不再 glob 并解析每个 project.json
+- 新建（Project.save_meta）与删除时就地更新
+- 以 INDEX_ROOT 目录的 mtime 做校验：目录项有增删（含手工拷入 / 删除项目）时 mtime 会变，
+  此时只扫一遍子目录名做增量对账，只有新出现的项目才去读 project.json
+- 注册表只经 tmp + os.replace 原子写一次；写完把文件自身的 mtime 设成此刻的目录 mtime，
+  两者相等即说明注册表之后目录没再变过
+- 进程内按 INDEX_ROOT 缓存，mtime 不变时直接返回内存里的列表
+- 改动（新建 / 删除 / 对账后重写）都持有 projects_index.lock 文件锁，在锁内重读文件再改一条，
+  并行的 bulk_build 进程不会互相覆盖对方的条目
+"""
+import json
+import os
+import threading
+from pathlib import Path
+from typing import Callable, Dict, Any, List, Optional, Tuple
+from utils import file_lock
+
+REGISTRY_NAME = "projects_index.json"
+REGISTRY_LOCK_NAME = "projects_index.lock"
+
+_lock = threading.RLock()
+# str(index_root) -> (目录 mtime, {项目目录名: 条目})
+_cache: Dict[str, Tuple[int, Dict[str, Dict[str, Any]]]] = {}
+
+
+def _entry_from_meta(pid: str, meta: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "id": pid,
+        "name": meta.get("name", pid),
+        "created_at": meta.get("created_at", 0),
+        "files": meta.get("files", []),
+    }
+
+
+class ProjectRegistry:
+    def __init__(self, index_root: Path):
+        self.root = Path(index_root)
+        self.path = self.root / REGISTRY_NAME
+        self.key = str(self.root.resolve())
+
+    def _locked(self):
+        self.root.mkdir(parents=True, exist_ok=True)
+        return file_lock(self.root / REGISTRY_LOCK_NAME, _lock)
+
+    def _dir_mtime(self) -> int:
+        return self.root.stat().st_mtime_ns if self.root.exists() else 0
+
+    def _read_file(self) -> Tuple[int, Dict[str, Dict[str, Any]]]:
+        """返回 (注册表文件自身的 mtime, 条目)。"""
+        try:
+            mtime = self.path.stat().st_mtime_ns
+            data = json.loads(self.path.read_text(encoding="utf-8"))
+            return mtime, dict(data.get("projects", {}))
+        except Exception:
+            return 0, {}
+
+    def _write_file(self, entries: Dict[str, Dict[str, Any]]) -> int:
+        """原子写注册表并返回写完之后的目录 mtime（os.replace 本身也会改动目录 mtime）。"""
+        self.root.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_name(self.path.name + ".tmp")
+        tmp.write_text(json.dumps({"projects": entries}, ensure_ascii=False), encoding="utf-8")
+        os.replace(tmp, self.path)
+        mtime = self._dir_mtime()
+        # 改文件的时间戳不改目录 mtime；中途崩溃只会让下次多对账一次
+        st = self.path.stat()
+        os.utime(self.path, ns=(st.st_atime_ns, mtime))
+        return mtime
+
+    def _reconcile(self, entries: Dict[str, Dict[str, Any]]) -> Tuple[Dict[str, Dict[str, Any]], bool]:
+        """与磁盘上的子目录对账：去掉已删除的，补上新出现的。返回 (条目, 是否有变化)。"""
+        present = set()
+        changed = False
+        with os.scandir(self.root) as it:
+            for d in it:
+                if not d.is_dir():
+                    continue
+                present.add(d.name)
+                if d.name in entries:
+                    continue
+                meta_path = Path(d.path) / "project.json"
+                if not meta_path.exists():
+                    continue
+                try:
+                    meta = json.loads(meta_path.read_text(encoding="utf-8"))
+                except Exception:
+                    meta = {}
+                entries[d.name] = _entry_from_meta(d.name, meta)
+                changed = True
+        for pid in [p for p in entries if p not in present]:
+            del entries[pid]
+            changed = True
+        return entries, changed
+
+    def _entries(self) -> Dict[str, Dict[str, Any]]:
+        mtime = self._dir_mtime()
+        with _lock:
+            cached = _cache.get(self.key)
+            if cached and cached[0] == mtime:
+                return cached[1]
+        if not self.root.exists():
+            return {}
+        with self._locked():
+            mtime = self._dir_mtime()
+            file_mtime, entries = self._read_file()
+            if file_mtime != mtime or not self.path.exists():
+                entries, changed = self._reconcile(entries)
+                # 目录 mtime 变化也可能只是别的索引文件被替换，条目没变就不必重写
+                mtime = self._write_file(entries) if changed or not self.path.exists() else mtime
+            _cache[self.key] = (mtime, entries)
+            return entries
+
+    def _update(self, change: Callable[[Dict[str, Dict[str, Any]]], bool]):
+        """在文件锁内重读注册表（文件落后于目录时先对账），应用一条改动再写回；change 返回 False 表示没改。"""
+        with self._locked():
+            file_mtime, entries = self._read_file()
+            if file_mtime != self._dir_mtime() or not self.path.exists():
+                entries, _ = self._reconcile(entries)
+            if not change(entries) and self.path.exists():
+                return
+            _cache[self.key] = (self._write_file(entries), entries)
+
+    def list(self) -> List[Dict[str, Any]]:
+        """按创建时间倒序（新项目在前）。"""
+        return sorted(self._entries().values(), key=lambda e: (-int(e.get("created_at") or 0), e["id"]))
+
+    def page(self, page: int, size: int) -> Tuple[List[Dict[str, Any]], int]:
+        """返回 (第 page 页的条目, 总条数)。"""
+        items = self.list()
+        return items[page * size:(page + 1) * size], len(items)
+
+    def get(self, pid: str) -> Optional[Dict[str, Any]]:
+        return self._entries().get(pid)
+
+    def upsert(self, pid: str, meta: Dict[str, Any]):
+        def change(entries):
+            entries[pid] = _entry_from_meta(pid, meta)
+            return True
+        self._update(change)
+
+    def remove(self, pid: str):
+        self._update(lambda entries: entries.pop(pid, None) is not None)
@@ -0,0 +1,205 @@
+"""
+错题本复习调度：
+- WrongScheduler：按“下次到期时间”排序的小顶堆。掌握 / 仍错 / 删除都是 O(log n)：
+  旧堆项只做作废标记（惰性删除），新到期时间重新入堆；取到期项只弹出需要的前 k 个
+- DueIndex：<INDEX_ROOT>/due_index.json，记录每个项目每道错题的到期时间，
+  侧边栏的“今日待复习”直接读这一个文件，不必逐个打开项目；
+  单题的变更只追加一行到 due_index.log，攒够 DUE_LOG_COMPACT 行再合并回 due_index.json
+"""
+import heapq
+import itertools
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Any, List, Optional, Tuple
+from utils import file_lock, now_ts, wrong_due_at
+
+DUE_INDEX_NAME = "due_index.json"
+DUE_LOG_NAME = "due_index.log"
+DUE_LOCK_NAME = "due_index.lock"
+DUE_LOG_COMPACT = 500   # 变更日志超过这么多行就合并进快照
+
+
+class WrongScheduler:
+    def __init__(self, items: List[Dict[str, Any]]):
+        self._items: Dict[str, Dict[str, Any]] = {}
+        self._heap: List[Tuple[int, int, str]] = []
+        self._live: Dict[str, Tuple[int, int, str]] = {}
+        self._seq = itertools.count()
+        for it in items:
+            self._items[str(it["id"])] = it
+            entry = (wrong_due_at(it), next(self._seq), str(it["id"]))
+            self._live[entry[2]] = entry
+            self._heap.append(entry)
+        heapq.heapify(self._heap)
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def _push(self, it: Dict[str, Any]):
+        entry = (wrong_due_at(it), next(self._seq), str(it["id"]))
+        self._live[entry[2]] = entry
+        heapq.heappush(self._heap, entry)
+
+    def _prune(self):
+        # 堆顶若是已作废的旧项就丢掉，保证堆顶总是有效的
+        while self._heap and self._live.get(self._heap[0][2]) is not self._heap[0]:
+            heapq.heappop(self._heap)
+
+    def due(self, now: Optional[int] = None, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """按到期先后返回已到期的错题（最多 limit 条），只弹出需要的堆项，取完放回。"""
+        now = now or now_ts()
+        out, popped = [], []
+        self._prune()
+        while self._heap and self._heap[0][0] <= now and (limit is None or len(out) < limit):
+            entry = heapq.heappop(self._heap)
+            if self._live.get(entry[2]) is entry:
+                popped.append(entry)
+                out.append(self._items[entry[2]])
+            self._prune()
+        for entry in popped:
+            heapq.heappush(self._heap, entry)
+        return out
+
+    def count_due(self, now: Optional[int] = None) -> int:
+        return len(self.due(now))
+
+    def next_due(self) -> Optional[int]:
+        self._prune()
+        return self._heap[0][0] if self._heap else None
+
+    def update(self, item: Dict[str, Any]) -> bool:
+        """替换一条错题；内容没变返回 False，调用方据此决定是否落盘。"""
+        key = str(item["id"])
+        if self._items.get(key) == item:
+            return False
+        self._items[key] = item
+        self._push(item)
+        return True
+
+    def remove(self, item_id: str) -> bool:
+        key = str(item_id)
+        if key not in self._items:
+            return False
+        del self._items[key]
+        del self._live[key]
+        return True
+
+
+def _apply(data: Dict[str, Dict[str, int]], delta: Dict[str, Any]):
+    """回放一条变更；每条都是绝对值（设为 / 删除 / 整个项目替换），重复回放结果不变。"""
+    pid = delta["p"]
+    if "all" in delta:
+        data[pid] = dict(delta["all"])
+    elif delta.get("drop"):
+        data.pop(pid, None)
+    elif delta.get("d") is None:
+        data.get(pid, {}).pop(delta["i"], None)
+    else:
+        data.setdefault(pid, {})[delta["i"]] = delta["d"]
+
+
+class DueIndex:
+    """
+    跨项目的到期索引：{project_id: {item_id: due_ts}}。
+    快照 due_index.json + 追加写的变更日志 due_index.log：答一道题只追加一行，不再整文件重写；
+    日志超过 DUE_LOG_COMPACT 行时合并成新快照（原子替换）再清空日志。
+    追加、合并、清空日志都持有跨进程文件锁（due_index.lock），别的进程刚追加的行不会在清空时丢掉。
+    """
+
+    _lock = threading.RLock()
+    # 快照路径 -> ((快照 mtime, 日志大小), 数据, 日志行数)：侧边栏每次重跑都读，文件没变就不重新解析
+    _cache: Dict[str, Tuple[Tuple[int, int], Dict[str, Dict[str, int]], int]] = {}
+
+    def __init__(self, index_root: Path):
+        self.path = Path(index_root) / DUE_INDEX_NAME
+        self.log_path = Path(index_root) / DUE_LOG_NAME
+        self.lock_path = Path(index_root) / DUE_LOCK_NAME
+
+    def locked(self):
+        return file_lock(self.lock_path, self._lock)
+
+    def _stamp(self) -> Tuple[int, int]:
+        snap = self.path.stat().st_mtime_ns if self.path.exists() else 0
+        log = self.log_path.stat().st_size if self.log_path.exists() else 0
+        return snap, log
+
+    def _load(self) -> Tuple[Dict[str, Dict[str, int]], int]:
+        """返回 (快照回放日志后的数据, 日志行数)。"""
+        stamp = self._stamp()
+        cached = self._cache.get(str(self.path))
+        if cached and cached[0] == stamp:
+            return cached[1], cached[2]
+        try:
+            data = json.loads(self.path.read_text(encoding="utf-8"))
+        except Exception:
+            data = {}
+        n_log = 0
+        if self.log_path.exists():
+            with open(self.log_path, "rb") as f:
+                for line in f:
+                    try:
+                        _apply(data, json.loads(line))
+                    except Exception:
+                        pass   # 写到一半的末行
+                    n_log += 1
+        self._cache[str(self.path)] = (stamp, data, n_log)
+        return data, n_log
+
+    def _data(self) -> Dict[str, Dict[str, int]]:
+        return self._load()[0]
+
+    def _save(self, data: Dict[str, Dict[str, int]]):
+        tmp = self.path.with_name(self.path.name + ".tmp")
+        tmp.write_text(json.dumps(data, ensure_ascii=False), encoding="utf-8")
+        os.replace(tmp, self.path)
+        # 快照已含日志里的全部变更；清空前崩溃也没关系，回放是幂等的
+        self.log_path.unlink(missing_ok=True)
+
+    def _append(self, delta: Dict[str, Any]):
+        """调用方持有 locked()。"""
+        with open(self.log_path, "ab") as f:
+            f.write((json.dumps(delta, ensure_ascii=False) + "\n").encode("utf-8"))
+        if self._load()[1] >= DUE_LOG_COMPACT:
+            self._save(self._data())
+
+    def has_project(self, project_id: str) -> bool:
+        return project_id in self._data()
+
+    def set(self, project_id: str, item: Dict[str, Any]):
+        with self.locked():
+            due = wrong_due_at(item)
+            if self._data().get(project_id, {}).get(str(item["id"])) != due:
+                self._append({"p": project_id, "i": str(item["id"]), "d": due})
+
+    def remove(self, project_id: str, item_id: str):
+        with self.locked():
+            if str(item_id) in self._data().get(project_id, {}):
+                self._append({"p": project_id, "i": str(item_id), "d": None})
+
+    def rebuild_project(self, project_id: str, items: List[Dict[str, Any]]):
+        with self.locked():
+            self._append({"p": project_id, "all": {str(it["id"]): wrong_due_at(it) for it in items}})
+
+    def drop_project(self, project_id: str):
+        with self.locked():
+            if project_id in self._data():
+                self._append({"p": project_id, "drop": True})
+
+    def due_counts(self, until: Optional[int] = None) -> Dict[str, int]:
+        """截至 until（默认现在）各项目到期的错题数，只返回非零项。"""
+        until = until or now_ts()
+        out = {}
+        for pid, dues in self._data().items():
+            n = sum(1 for d in dues.values() if d <= until)
+            if n:
+                out[pid] = n
+        return out
+
+
+def end_of_today(now: Optional[int] = None) -> int:
+    """本地时间今天 23:59:59 的时间戳，用于“今日待复习”。"""
+    lt = time.localtime(now or now_ts())
+    return int(time.mktime((lt.tm_year, lt.tm_mon, lt.tm_mday, 23, 59, 59, 0, 0, -1)))
@@ -0,0 +1,282 @@
+"""
+无界面的 RAG 服务（aiohttp）：项目管理、建索引、检索、整轮对话编排都在这里跑，
+Streamlit 页面只是客户端（service_client.py），多个页面副本可以共用一个已预热的后端。
+- 工作线程池：检索 / 建索引 / LLM 编排都是阻塞调用，放进 SERVICE_WORKERS 个线程执行
+- 排队：同时在执行 + 排队的请求超过 SERVICE_WORKERS + SERVICE_QUEUE 时直接 503
+- 读聊天记录、按 id 取块原文这类轻量读取走单独的 SERVICE_READ_WORKERS 个线程，不排队也不 503，
+  对话 / 建索引把工作线程占满时页面照样能渲染历史
+- 共享索引：rag_core.load_index 的进程内缓存，所有请求共用同一份 FAISS 索引
+- 对话接口按 NDJSON 流式返回事件：text（流式文本）/ record（一条完整记录）/ error / done
+
+启动：python service.py [--host 127.0.0.1] [--port 8765] [--index-root ./projects] [--workers 4]
+"""
+import argparse
+import asyncio
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Callable, Dict, List
+from aiohttp import web
+from config import (
+    API_ENV_KEY,
+    DEFAULT_INDEX_ROOT,
+    SERVICE_HOST,
+    SERVICE_PORT,
+    SERVICE_WORKERS,
+    SERVICE_QUEUE,
+    SERVICE_READ_WORKERS,
+)
+from project import Project
+from registry import ProjectRegistry
+from utils import now_ts
+
+
+def _json_error(status: int, message: str) -> web.Response:
+    return web.json_response({"error": message}, status=status)
+
+
+def _doc_json(doc_id, d) -> Dict[str, Any]:
+    return {"id": doc_id, "content": d.page_content, "meta": d.metadata}
+
+
+class RagService:
+    def __init__(self, index_root: Path, workers: int = SERVICE_WORKERS, queue_size: int = SERVICE_QUEUE):
+        self.index_root = index_root
+        self.workers = workers
+        self.capacity = workers + queue_size
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="rag-worker")
+        self.read_pool = ThreadPoolExecutor(max_workers=SERVICE_READ_WORKERS, thread_name_prefix="rag-read")
+        self.inflight = 0
+
+    # --- 工作线程池 + 排队上限 ---
+    async def submit(self, fn: Callable, *args):
+        if self.inflight >= self.capacity:
+            raise web.HTTPServiceUnavailable(
+                text=json.dumps({"error": "服务繁忙，请稍后再试"}, ensure_ascii=False),
+                content_type="application/json",
+            )
+        self.inflight += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self.pool, fn, *args)
+        finally:
+            self.inflight -= 1
+
+    async def read(self, fn: Callable, *args):
+        """轻量读取：不计入排队上限。"""
+        return await asyncio.get_running_loop().run_in_executor(self.read_pool, fn, *args)
+
+    def _project(self, request: web.Request) -> Project:
+        pid = request.match_info["pid"]
+        proj = Project(self.index_root / pid)
+        if "/" in pid or pid.startswith(".") or not proj.exists():
+            raise web.HTTPNotFound(text=json.dumps({"error": f"项目 {pid} 不存在"}, ensure_ascii=False),
+                                   content_type="application/json")
+        return proj
+
+    @staticmethod
+    def _index(proj: Project):
+        from rag_core import load_index
+        vs = load_index(proj.index_dir)
+        if vs is None:
+            raise RuntimeError("索引未找到")
+        return vs
+
+    # --- 接口 ---
+    async def health(self, request: web.Request) -> web.Response:
+        return web.json_response({
+            "ok": True,
+            "workers": self.workers,
+            "inflight": self.inflight,
+            "queued": max(0, self.inflight - self.workers),
+        })
+
+    async def metrics(self, request: web.Request) -> web.Response:
+        import metrics
+        return web.Response(text=metrics.prometheus_text(), content_type="text/plain", charset="utf-8")
+
+    async def list_projects(self, request: web.Request) -> web.Response:
+        page = int(request.query.get("page", 0))
+        size = int(request.query.get("size", 20))
+        items, total = ProjectRegistry(self.index_root).page(page, size)
+        return web.json_response({"items": items, "total": total})
+
+    async def get_project(self, request: web.Request) -> web.Response:
+        proj = self._project(request)
+        proj.load_meta()
+        return web.json_response({"id": proj.root.name, **proj.meta})
+
+    async def create_project(self, request: web.Request) -> web.Response:
+        from ingest import build_project, ProjectExistsError
+        reader = await request.multipart()
+        name, files = "", []
+        async for part in reader:
+            if part.name == "name":
+                name = (await part.text()).strip()
+            elif part.name == "files" and part.filename:
+                files.append((Path(part.filename).name, await part.read()))
+        if not name or not files:
+            return _json_error(400, "需要项目名称和至少一个文件")
+        try:
+            proj = await self.submit(build_project, self.index_root, name, files)
+        except ProjectExistsError as e:
+            return _json_error(409, str(e))
+        return web.json_response({"id": proj.root.name, **proj.meta}, status=201)
+
+    async def delete_project(self, request: web.Request) -> web.Response:
+        proj = self._project(request)
+        await self.submit(proj.delete)
+        return web.json_response({"ok": True})
+
+    async def chats(self, request: web.Request) -> web.Response:
+        proj = self._project(request)
+        before = request.query.get("before")
+        limit = int(request.query.get("limit", 200))
+        records, first = await self.read(proj.load_chats_page, int(before) if before else None, limit)
+        return web.json_response({"items": records, "first": first})
+
+    async def retrieve(self, request: web.Request) -> web.Response:
+        from rag_core import retrieve, chunk_ids
+        proj = self._project(request)
+        body = await request.json()
+
+        def _run():
+            vs = self._index(proj)
+            docs = retrieve(vs, body["q"], int(body.get("k", 4)))
+            return [_doc_json(i, d) for i, d in zip(chunk_ids(vs, docs), docs)]
+
+        return web.json_response({"items": await self.submit(_run)})
+
+    async def chunks(self, request: web.Request) -> web.Response:
+        """
+        按块 id 取原文（页面渲染依据时用，页面进程不必加载索引）。
+        一次可取多条记录的依据；返回项的 id 是请求里的 id（被合并的块也按原 id 返回），取不到的省略。
+        """
+        from rag_core import resolve_chunks
+        proj = self._project(request)
+        ids = (await request.json()).get("ids") or []
+
+        def _run():
+            vs = self._index(proj)
+            out = []
+            for i in dict.fromkeys(ids):
+                docs = resolve_chunks(vs, [i])
+                if docs:
+                    out.append(_doc_json(i, docs[0]))
+            return out
+
+        return web.json_response({"items": await self.read(_run)})
+
+    async def chat(self, request: web.Request) -> web.StreamResponse:
+        """跑一整轮对话并按 NDJSON 流式推送事件；用户消息与生成的记录都由服务写入聊天记录。"""
+        from tools import run_chat_turn, streaming_kind
+        from streaming import ThrottledRenderer
+        from ds_client import get_transport
+        from turns import new_turn_id
+        proj = self._project(request)
+        body = await request.json()
+        user_msg = (body.get("message") or "").strip()
+        if not user_msg:
+            return _json_error(400, "消息为空")
+        if not os.getenv(API_ENV_KEY, "").strip():
+            return _json_error(500, "服务端未配置 API Key")
+
+        loop = asyncio.get_running_loop()
+        events: "asyncio.Queue[Dict[str, Any]]" = asyncio.Queue()
+
+        def emit(ev: Dict[str, Any]):
+            loop.call_soon_threadsafe(events.put_nowait, ev)
+
+        def _run():
+            devlog: Dict[str, Any] = {}
+            try:
+                vs = self._index(proj)
+                history = proj.load_chats(limit=20)
+                turn_id = new_turn_id()
+                proj.append_chat({"t": now_ts(), "role": "user", "kind": "msg", "text": user_msg, "turn": turn_id})
+                # 流式文本也按页面同样的节奏节流，避免每个 token 一条事件
+                text_out = ThrottledRenderer(lambda t: emit({
+                    "type": "text",
+                    "kind": streaming_kind(devlog),
+                    "text": t,
+                }))
+
+                # 和本地后台轮次一样：每条记录生成完就带上 turn 写入，不等整轮结束
+                records: List[Dict[str, Any]] = []
+
+                def on_record(rec: Dict[str, Any]):
+                    text_out.flush()
+                    rec = {**rec, "turn": turn_id}
+                    proj.append_chat(rec)
+                    records.append(rec)
+                    emit({"type": "record", "record": rec})
+
+                run_chat_turn(proj, vs, get_transport(), user_msg, devlog, history,
+                              on_text=text_out, on_record=on_record)
+                text_out.flush()
+                for msg in devlog.pop("errors", []):
+                    emit({"type": "error", "message": msg})
+                emit({"type": "done", "records": records, "devlog": {k: str(v) for k, v in devlog.items()}})
+            except Exception as e:
+                emit({"type": "error", "message": f"{type(e).__name__}: {e}"})
+                emit({"type": "done", "records": [], "devlog": {k: str(v) for k, v in devlog.items()}})
+
+        resp = web.StreamResponse(headers={"Content-Type": "application/x-ndjson"})
+        await resp.prepare(request)
+        job = asyncio.ensure_future(self.submit(_run))
+        while True:
+            getter = asyncio.ensure_future(events.get())
+            done, _ = await asyncio.wait({getter, job}, return_when=asyncio.FIRST_COMPLETED)
+            if getter not in done:
+                getter.cancel()
+                if job.exception() is not None:
+                    # 排队已满（503）等提交阶段的错误
+                    await resp.write((json.dumps({"type": "error", "message": "服务繁忙，请稍后再试"},
+                                                 ensure_ascii=False) + "\n").encode("utf-8"))
+                    break
+                continue
+            ev = getter.result()
+            await resp.write((json.dumps(ev, ensure_ascii=False) + "\n").encode("utf-8"))
+            if ev["type"] == "done":
+                break
+        await resp.write_eof()
+        return resp
+
+
+def make_app(index_root: Path, workers: int = SERVICE_WORKERS, queue_size: int = SERVICE_QUEUE) -> web.Application:
+    svc = RagService(index_root, workers, queue_size)
+    app = web.Application(client_max_size=512 * 1024 * 1024)
+    app["service"] = svc
+    app.add_routes([
+        web.get("/health", svc.health),
+        web.get("/metrics", svc.metrics),
+        web.get("/projects", svc.list_projects),
+        web.post("/projects", svc.create_project),
+        web.get("/projects/{pid}", svc.get_project),
+        web.delete("/projects/{pid}", svc.delete_project),
+        web.get("/projects/{pid}/chats", svc.chats),
+        web.post("/projects/{pid}/retrieve", svc.retrieve),
+        web.post("/projects/{pid}/chunks", svc.chunks),
+        web.post("/projects/{pid}/chat", svc.chat),
+    ])
+
+    async def _warm(app):
+        # 服务启动即在后台预热（向量模型 / LLM 连接池 / 最近的项目索引）
+        from warmup import start_warmup
+        start_warmup(index_root)
+
+    app.on_startup.append(_warm)
+    return app
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--host", default=SERVICE_HOST)
+    ap.add_argument("--port", type=int, default=SERVICE_PORT)
+    ap.add_argument("--index-root", default=str(DEFAULT_INDEX_ROOT))
+    ap.add_argument("--workers", type=int, default=SERVICE_WORKERS)
+    ap.add_argument("--queue", type=int, default=SERVICE_QUEUE)
+    args = ap.parse_args()
+    root = Path(args.index_root).resolve()
+    root.mkdir(parents=True, exist_ok=True)
+    web.run_app(make_app(root, args.workers, args.queue), host=args.host, port=args.port)
@@ -0,0 +1,140 @@
+"""
+RAG 服务（service.py）的客户端，页面进程用：设置了 RAG_SERVICE_URL 时，
+建项目 / 删项目 / 对话都交给服务执行，页面只负责渲染。
+RemoteIndex 代替本地 FAISS 索引传给渲染函数，依据原文按块 id 向服务取。
+连不上服务 / 超时 / 服务返回错误一律抛 ServiceError，页面据此降级显示。
+"""
+import json
+from functools import lru_cache
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+import httpx
+from config import SERVICE_URL
+from ingest import ProjectExistsError
+
+
+class ServiceError(RuntimeError):
+    pass
+
+
+def _raise_for(resp: httpx.Response):
+    if resp.status_code < 400:
+        return
+    try:
+        msg = resp.json().get("error") or resp.text
+    except ValueError:
+        msg = resp.text
+    if resp.status_code == 409:
+        raise ProjectExistsError(msg)
+    raise ServiceError(f"RAG 服务返回 {resp.status_code}：{msg}")
+
+
+def _doc(item: Dict[str, Any]):
+    from langchain.schema import Document
+    return Document(page_content=item["content"], metadata=item.get("meta") or {})
+
+
+class RagClient:
+    def __init__(self, base_url: str, timeout: float = 600.0):
+        self.http = httpx.Client(base_url=base_url, timeout=httpx.Timeout(timeout, connect=5.0))
+
+    def _request(self, method: str, url: str, **kwargs) -> httpx.Response:
+        try:
+            resp = self.http.request(method, url, **kwargs)
+        except httpx.HTTPError as e:
+            raise ServiceError(f"RAG 服务无响应：{type(e).__name__}: {e}") from e
+        _raise_for(resp)
+        return resp
+
+    def health(self) -> Dict[str, Any]:
+        return self._request("GET", "/health").json()
+
+    def list_projects(self, page: int = 0, size: int = 20) -> Tuple[List[Dict[str, Any]], int]:
+        data = self._request("GET", "/projects", params={"page": page, "size": size}).json()
+        return data["items"], data["total"]
+
+    def create_project(self, name: str, files: List[Tuple[str, bytes]]) -> Dict[str, Any]:
+        """重名时抛 ProjectExistsError，与本地 build_project 一致。"""
+        resp = self._request(
+            "POST",
+            "/projects",
+            data={"name": name},
+            files=[("files", (fname, data)) for fname, data in files],
+        )
+        return resp.json()
+
+    def delete_project(self, pid: str):
+        self._request("DELETE", f"/projects/{pid}")
+
+    def load_chats_page(self, pid: str, before: Optional[int], limit: int) -> Tuple[List[Dict[str, Any]], int]:
+        params = {"limit": limit, **({"before": before} if before is not None else {})}
+        data = self._request("GET", f"/projects/{pid}/chats", params=params).json()
+        return data["items"], data["first"]
+
+    def retrieve(self, pid: str, q: str, k: int = 4) -> list:
+        resp = self._request("POST", f"/projects/{pid}/retrieve", json={"q": q, "k": k})
+        return [_doc(it) for it in resp.json()["items"]]
+
+    def chunks(self, pid: str, ids: List[str]) -> Dict[str, Any]:
+        """块 id → Document，取不到的 id 不在结果里。"""
+        resp = self._request("POST", f"/projects/{pid}/chunks", json={"ids": ids})
+        return {it["id"]: _doc(it) for it in resp.json()["items"]}
+
+    def chat(self, pid: str, message: str) -> Iterator[Dict[str, Any]]:
+        """逐条产出服务推送的事件：text / record / error / done。"""
+        try:
+            with self.http.stream("POST", f"/projects/{pid}/chat", json={"message": message}) as resp:
+                if resp.status_code >= 400:
+                    resp.read()
+                    _raise_for(resp)
+                for line in resp.iter_lines():
+                    if line.strip():
+                        yield json.loads(line)
+        except httpx.HTTPError as e:
+            raise ServiceError(f"RAG 服务无响应：{type(e).__name__}: {e}") from e
+
+
+def record_hit_ids(records: List[Dict[str, Any]]) -> List[str]:
+    """一批聊天记录（含 multi 的子记录）引用的所有块 id。"""
+    out: List[str] = []
+    for rec in records:
+        subs = (rec.get("items") or []) if rec.get("kind") == "multi" else [rec]
+        for sub in subs:
+            out += sub.get("hit_ids") or []
+    return out
+
+
+class RemoteIndex:
+    """
+    渲染时代替本地索引：rag_core.resolve_chunks 遇到它会转去服务取块原文。
+    取回的块按 id 缓存在实例里；页面先 prefetch 一次要渲染的全部记录，每条记录渲染时就不再各发一次请求。
+    """
+
+    def __init__(self, client: RagClient, pid: str):
+        self.client = client
+        self.pid = pid
+        self._docs: Dict[str, Any] = {}
+        self._missing: set = set()
+        self._error: Optional[ServiceError] = None
+
+    def prefetch(self, ids: List[str]):
+        todo = [i for i in dict.fromkeys(ids) if i not in self._docs and i not in self._missing]
+        if not todo:
+            return
+        if self._error is not None:
+            raise self._error   # 本次重跑里服务已经失败过，其余记录不再逐条等超时
+        try:
+            found = self.client.chunks(self.pid, todo)
+        except ServiceError as e:
+            self._error = e
+            raise
+        self._docs.update(found)
+        self._missing.update(i for i in todo if i not in found)
+
+    def resolve_chunks(self, ids: List[str]) -> list:
+        self.prefetch(ids)
+        return [self._docs[i] for i in ids if i in self._docs]
+
+
+@lru_cache(maxsize=1)
+def get_client() -> RagClient:
+    return RagClient(SERVICE_URL)
@@ -0,0 +1,205 @@
+"""
+项目存储的 SQLite 后端（可选）：<项目目录>/project.db
+- WAL 模式：多个 Streamlit 会话同时读写同一项目时，读不阻塞写、写之间由 SQLite 加锁
+- chats / wrong 表带索引列（时间、类型、盒子、到期时间），错题按行更新而不是整体改写文件
+- 每个线程一条连接（Streamlit 每个会话跑在自己的线程里）
+
+迁移已有项目：python storage_sqlite.py migrate <项目目录> [<项目目录> ...]
+"""
+import json
+import sqlite3
+import sys
+import threading
+from pathlib import Path
+from typing import Callable, Dict, Any, List, Optional, Tuple
+from utils import wrong_due_at
+
+DB_NAME = "project.db"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS chats (
+    id   INTEGER PRIMARY KEY AUTOINCREMENT,
+    t    INTEGER,
+    role TEXT,
+    kind TEXT,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS chats_t ON chats(t);
+CREATE INDEX IF NOT EXISTS chats_kind ON chats(kind);
+
+CREATE TABLE IF NOT EXISTS wrong (
+    id   TEXT PRIMARY KEY,
+    t    INTEGER,
+    box  INTEGER,
+    last INTEGER,
+    due  INTEGER,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS wrong_box ON wrong(box);
+CREATE INDEX IF NOT EXISTS wrong_due ON wrong(due);
+
+CREATE TABLE IF NOT EXISTS meta (
+    key   TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+
+class SqliteStore:
+    kind = "sqlite"
+
+    def __init__(self, root: Path):
+        self.db_path = root / DB_NAME
+        self._local = threading.local()
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            self.db_path.parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(str(self.db_path), timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=10000")
+            conn.executescript(_SCHEMA)
+            self._local.conn = conn
+        return conn
+
+    # --- 聊天 ---
+    def append_chat(self, record: Dict[str, Any]):
+        self.conn.execute(
+            "INSERT INTO chats(t, role, kind, data) VALUES (?, ?, ?, ?)",
+            (record.get("t"), record.get("role"), record.get("kind"), json.dumps(record, ensure_ascii=False)),
+        )
+
+    def count_chats(self) -> int:
+        return self.conn.execute("SELECT COUNT(*) FROM chats").fetchone()[0]
+
+    def page_chats(self, before: Optional[int], limit: int) -> Tuple[List[Dict[str, Any]], int]:
+        """与 JsonlLog.page 同语义：取第 before 条之前的 limit 条，返回 (记录, 第一条序号)。"""
+        total = self.count_chats()
+        end = total if before is None else min(before, total)
+        start = max(0, end - limit)
+        rows = self.conn.execute(
+            "SELECT data FROM chats ORDER BY id DESC LIMIT ? OFFSET ?",
+            (end - start, total - end),
+        ).fetchall()
+        return [json.loads(r[0]) for r in reversed(rows)], start
+
+    def rewrite_chats(self, records: List[Dict[str, Any]]):
+        self.rewrite_chats_with(lambda _: records)
+
+    def rewrite_chats_with(self, fn: Callable[[List[Dict[str, Any]]], Optional[List[Dict[str, Any]]]]):
+        """与 JsonlStore 同语义；读也在 BEGIN IMMEDIATE 里，期间别的连接的追加会等到提交之后。"""
+        conn = self.conn
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            rows = conn.execute("SELECT data FROM chats ORDER BY id").fetchall()
+            records = fn([json.loads(r[0]) for r in rows])
+            if records is not None:
+                conn.execute("DELETE FROM chats")
+                conn.executemany(
+                    "INSERT INTO chats(t, role, kind, data) VALUES (?, ?, ?, ?)",
+                    [(r.get("t"), r.get("role"), r.get("kind"), json.dumps(r, ensure_ascii=False)) for r in records],
+                )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def export_chats(self, since: Optional[int] = None, until: Optional[int] = None) -> bytes:
+        rows = self.conn.execute(
+            "SELECT data FROM chats WHERE COALESCE(t, 0) BETWEEN ? AND ? ORDER BY id",
+            (since if since is not None else -2 ** 62, until if until is not None else 2 ** 62),
+        ).fetchall()
+        return "".join(r[0] + "\n" for r in rows).encode("utf-8")
+
+    def compact_chats(self) -> Dict[str, int]:
+        # 单表 + 索引，不需要分段；这里只让 WAL 落回主库
+        self.conn.execute("PRAGMA wal_checkpoint(PASSIVE)")
+        return {"segments": 0, "records": 0}
+
+    # --- 错题本 ---
+    def _wrong_row(self, it: Dict[str, Any]) -> tuple:
+        return (
+            str(it["id"]), it.get("t"), it.get("box", 1), it.get("last", it.get("t")),
+            wrong_due_at(it), json.dumps(it, ensure_ascii=False),
+        )
+
+    def log_wrong(self, record: Dict[str, Any]):
+        self.conn.execute(
+            "INSERT OR REPLACE INTO wrong(id, t, box, last, due, data) VALUES (?, ?, ?, ?, ?, ?)",
+            self._wrong_row(record),
+        )
+
+    def load_wrong(self) -> List[Dict[str, Any]]:
+        rows = self.conn.execute("SELECT data FROM wrong ORDER BY t, id").fetchall()
+        return [json.loads(r[0]) for r in rows]
+
+    def load_wrong_due(self, now: int) -> List[Dict[str, Any]]:
+        """直接走 due 索引取到期错题。"""
+        rows = self.conn.execute("SELECT data FROM wrong WHERE due <= ? ORDER BY due", (now,)).fetchall()
+        return [json.loads(r[0]) for r in rows]
+
+    def update_wrong(self, item: Dict[str, Any]):
+        # 内容没变时 WHERE 条件不成立，不产生写入
+        row = self._wrong_row(item)
+        self.conn.execute(
+            "UPDATE wrong SET t = ?, box = ?, last = ?, due = ?, data = ? WHERE id = ? AND data != ?",
+            row[1:] + (row[0], row[-1]),
+        )
+
+    def delete_wrong(self, item_id: str):
+        self.conn.execute("DELETE FROM wrong WHERE id = ?", (str(item_id),))
+
+    def wrong_stamp(self) -> Any:
+        """错题表是否被（任何连接）改过的标记：数据库文件与 WAL 的修改时间。"""
+        wal = self.db_path.with_name(self.db_path.name + "-wal")
+        return tuple(p.stat().st_mtime_ns if p.exists() else 0 for p in (self.db_path, wal))
+
+    def export_wrong(self) -> bytes:
+        return "".join(json.dumps(it, ensure_ascii=False) + "\n" for it in self.load_wrong()).encode("utf-8")
+
+    # --- 元数据（project.json 仍保留，作为项目目录的标记） ---
+    def save_meta(self, meta: Dict[str, Any]):
+        self.conn.execute(
+            "INSERT OR REPLACE INTO meta(key, value) VALUES ('project', ?)",
+            (json.dumps(meta, ensure_ascii=False),),
+        )
+
+    def load_meta(self) -> Optional[Dict[str, Any]]:
+        row = self.conn.execute("SELECT value FROM meta WHERE key = 'project'").fetchone()
+        return json.loads(row[0]) if row else None
+
+
+def migrate_jsonl_to_sqlite(root: Path) -> Dict[str, int]:
+    """
+    一次性把项目的 chats.jsonl / wrong.jsonl / project.json 导入 project.db。
+    原 JSONL 文件改名为 *.migrated 保留备份；已有 project.db 时不重复导入。
+    """
+    from chatlog import JsonlStore
+    root = Path(root)
+    if (root / DB_NAME).exists():
+        return {"chats": 0, "wrong": 0, "skipped": 1}
+    src = JsonlStore(root)
+    chats = src.chat_log.read_all()
+    wrong = src.load_wrong()
+    dst = SqliteStore(root)
+    dst.rewrite_chats(chats)
+    for it in wrong:
+        dst.log_wrong(it)
+    meta_path = root / "project.json"
+    if meta_path.exists():
+        dst.save_meta(json.loads(meta_path.read_text(encoding="utf-8")))
+    for p in (src.chat_log.active.path, src.chat_log.active.idx_path, src.chat_log.seg_dir, src.wrong_path):
+        if p.exists():
+            p.rename(p.with_name(p.name + ".migrated"))
+    return {"chats": len(chats), "wrong": len(wrong), "skipped": 0}
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3 or sys.argv[1] != "migrate":
+        print("用法：python storage_sqlite.py migrate <项目目录> [<项目目录> ...]")
+        sys.exit(1)
+    for d in sys.argv[2:]:
+        print(d, migrate_jsonl_to_sqlite(Path(d)))
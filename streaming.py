@@ -0,0 +1,198 @@
+# streaming.py
+"""
+所有工具共用的流式生成层：
+- stream_chat: 调 LLM 的流式接口，逐段回调当前累计文本，并统计首 token 时间 / 速率
+- ThrottledRenderer: 按时间或增量大小节流刷新，避免每个 token 都把整段文本重绘一遍
+- JSONObjectScanner / partial_json_field: 边生成边解析 JSON
+"""
+import time
+from dataclasses import dataclass, field
+from io import StringIO
+from typing import Callable, Dict, Any, List, Optional
+from config import STREAM_RENDER_INTERVAL, STREAM_RENDER_MAX_CHARS
+
+
+@dataclass
+class StreamStats:
+    started: float = 0.0
+    first_token_at: float = 0.0
+    finished: float = 0.0
+    n_chunks: int = 0
+    n_chars: int = 0
+    completion_tokens: int = 0   # 来自 API usage；拿不到时用 chunk 数近似
+    usage: Dict[str, Any] = field(default_factory=dict)
+
+    @property
+    def ttft(self) -> float:
+        if not self.first_token_at:
+            return 0.0
+        return self.first_token_at - self.started
+
+    @property
+    def tokens_per_sec(self) -> float:
+        # 只算首 token 之后的生成速率，排队/预填充时间已经体现在 ttft 里
+        span = self.finished - (self.first_token_at or self.started)
+        n = self.completion_tokens or self.n_chunks
+        return n / span if span > 0 else 0.0
+
+    def to_devlog(self, devlog: Dict[str, Any], tag: str):
+        devlog[f"{tag}_ttft_ms"] = int(self.ttft * 1000)
+        devlog[f"{tag}_total_ms"] = int((self.finished - self.started) * 1000)
+        devlog[f"{tag}_tokens"] = self.completion_tokens or self.n_chunks
+        devlog[f"{tag}_tok_per_s"] = round(self.tokens_per_sec, 1)
+
+
+def stream_chat(
+    llm,
+    prompt: str | List[Dict[str, str]],
+    on_text: Optional[Callable[[str], None]] = None,
+    stats: Optional[StreamStats] = None,
+    **params,
+) -> str:
+    """
+    通过 llm（ds_client.LLMTransport）流式调用，返回完整文本。
+    on_text 每收到一段就以“当前累计全文”回调一次；节流交给调用方（见 ThrottledRenderer）。
+    """
+    stats = stats if stats is not None else StreamStats()
+    stats.started = time.perf_counter()
+    buffer = StringIO()
+
+    for chunk in llm.stream(prompt, stream_options={"include_usage": True}, **params):
+        usage = getattr(chunk, "usage", None)
+        if usage is not None:
+            stats.usage = usage.model_dump() if hasattr(usage, "model_dump") else dict(usage)
+            stats.completion_tokens = stats.usage.get("completion_tokens") or 0
+        if not chunk.choices:
+            continue
+        token = chunk.choices[0].delta.content or ""
+        if not token:
+            continue
+        if not stats.first_token_at:
+            stats.first_token_at = time.perf_counter()
+        stats.n_chunks += 1
+        buffer.write(token)
+        if on_text is not None:
+            on_text(buffer.getvalue())
+
+    final_text = buffer.getvalue()
+    stats.finished = time.perf_counter()
+    stats.n_chars = len(final_text)
+    return final_text
+
+
+class ThrottledRenderer:
+    """
+    把 on_text 回调节流后交给 render_fn：
+    距上次刷新超过 interval 秒，或文本比上次多出 max_chars 个字符时才真正重绘。
+    生成结束后必须调用 flush()，保证最终文本被完整渲染。
+    """
+
+    def __init__(
+        self,
+        render_fn: Callable[[str], Any],
+        interval: float = STREAM_RENDER_INTERVAL,
+        max_chars: int = STREAM_RENDER_MAX_CHARS,
+    ):
+        self.render_fn = render_fn
+        self.interval = interval
+        self.max_chars = max_chars
+        self.renders = 0
+        self._last_t = 0.0
+        self._last_len = 0
+        self._pending: Optional[str] = None
+
+    def __call__(self, text: str):
+        self._pending = text
+        now = time.perf_counter()
+        if now - self._last_t >= self.interval or len(text) - self._last_len >= self.max_chars:
+            self._emit(now)
+
+    def _emit(self, now: float):
+        text = self._pending
+        self._pending = None
+        self._last_t = now
+        self._last_len = len(text)
+        self.renders += 1
+        self.render_fn(text)
+
+    def flush(self, text: Optional[str] = None):
+        if text is not None:
+            self._pending = text
+        if self._pending is not None:
+            self._emit(time.perf_counter())
+
+
+class JSONObjectScanner:
+    """
+    增量扫描流式输出的 JSON 文本：某一层的对象一旦闭合，就把它的原文吐出来。
+    depth 为对象所在的嵌套层级（{ 和 [ 都算一层），例如：
+    - 单个对象 {...}                -> depth=1
+    - 对象数组 [{...}, {...}]       -> depth=2
+    - {"steps": [{...}, {...}]}      -> depth=3
+    只做括号 / 字符串状态机，不负责 json.loads，解析与修复交给调用方。
+    """
+
+    def __init__(self, depth: int = 1):
+        self.depth = depth
+        self._level = 0
+        self._in_str = False
+        self._esc = False
+        self._cur: Optional[List[str]] = None
+
+    def feed(self, text: str) -> List[str]:
+        done: List[str] = []
+        for ch in text:
+            if self._cur is not None:
+                self._cur.append(ch)
+            if self._in_str:
+                if self._esc:
+                    self._esc = False
+                elif ch == "\\":
+                    self._esc = True
+                elif ch == '"':
+                    self._in_str = False
+                continue
+            if ch == '"':
+                self._in_str = True
+            elif ch in "{[":
+                self._level += 1
+                if ch == "{" and self._level == self.depth and self._cur is None:
+                    self._cur = [ch]
+            elif ch in "}]":
+                if ch == "}" and self._level == self.depth and self._cur is not None:
+                    done.append("".join(self._cur))
+                    self._cur = None
+                self._level = max(0, self._level - 1)
+        return done
+
+
+_ESCAPES = {"n": "\n", "t": "\t", "r": "", '"': '"', "\\": "\\", "/": "/"}
+
+
+def partial_json_field(text: str, key: str) -> str:
+    """
+    从还没生成完的 JSON 文本里取出某个字符串字段目前已生成的部分，用于预览。
+    字段尚未出现时返回空串。
+    """
+    marker = f'"{key}"'
+    i = text.find(marker)
+    if i < 0:
+        return ""
+    i = text.find('"', i + len(marker))
+    if i < 0:
+        return ""
+    out: List[str] = []
+    j = i + 1
+    while j < len(text):
+        ch = text[j]
+        if ch == "\\":
+            if j + 1 >= len(text):
+                break
+            out.append(_ESCAPES.get(text[j + 1], text[j + 1]))
+            j += 2
+            continue
+        if ch == '"':
+            break
+        out.append(ch)
+        j += 1
+    return "".join(out)
@@ -1,21 +1,46 @@
 # tools.py
+import contextvars
 import re
 import time
-from typing import Dict, Any, List, Tuple, Optional
+import queue
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from typing import Callable, Dict, Any, List, Tuple, Optional, Iterable, Iterator
 import streamlit as st
+from streamlit.runtime.scriptrunner import get_script_run_ctx
 from langchain.schema import Document
-from rag_core import retrieve
-from llm import _rewrite_query_if_needed, rag_answer, gen_mcq, gen_card_or_map
-from utils import now_ts
+from rag_core import retrieve, hits_record
+from llm import _rewrite_query_if_needed, rag_answer, gen_mcq, gen_mcq_batch, gen_card_or_map
+from utils import now_ts, loads_lenient
+from ds_client import LLMCancelled
+from streaming import ThrottledRenderer, StreamStats, JSONObjectScanner, stream_chat
+from prompts import PromptTemplate, prompt_text, record_cache_usage
+from budget import TokenBudget, fit_pieces, count_tokens
 import json
-from ui_components import (
-    render_evidence_cards,
-    render_mcq_block,
-    render_card_block,
-    render_mindmap_block,
-    render_answer_with_evidence,
-)
-def run_tool(
+from ui_components import render_record_block, render_stream_preview
+# 各工具的检索条数（run_tool 与 plan 预取共用）
+_RETRIEVE_K = {"answer": 4, "quiz": 8, "card": 10, "map": 10}
+
+
+def _spinner(msg: str):
+    # 在 Streamlit 脚本线程外（RAG 服务的工作线程）运行时不显示 spinner
+    return st.spinner(msg) if get_script_run_ctx(suppress_warning=True) is not None else nullcontext()
+
+
+# 工具 → 生成的记录类型（流式预览按记录类型渲染）
+TOOL_KIND = {"quiz": "mcq", "card": "card", "map": "mindmap"}
+
+
+def streaming_kind(devlog: Dict[str, Any]) -> str:
+    """不渲染时正在流式生成的记录类型：plan 看最近开始的那一步，单工具看路由结果。"""
+    steps = [int(k.split("_")[1]) for k in devlog if k.startswith("step_") and k.endswith("_tool")]
+    mode = devlog.get(f"step_{max(steps)}_tool") if steps else devlog.get("route_mode")
+    return TOOL_KIND.get(mode, "answer")
+
+
+def generate_tool(
     mode: str,
     proj,
     vs,
@@ -25,19 +50,66 @@ def run_tool(
     devlog: Dict[str, Any],
     strictness: str = "strict",
     extra_context: str = "",
-    instruction: str = "",  
+    instruction: str = "",
+    n_questions: int = 1,
+    hits: Optional[List[Document]] = None,
+    on_text: Optional[Callable[[str], None]] = None,
+    on_record: Optional[Callable[[Dict[str, Any]], None]] = None,
+    on_error: Optional[Callable[[str], None]] = None,
 ) -> List[Dict[str, Any]]:
     """
-    执行对应“工具”，负责：
-    - 检索 / 调 LLM
-    - 在当前的 st.chat_message("assistant") 容器内渲染 UI
-    - 返回需要写入 chat.jsonl 的记录列表
+    执行对应“工具”的生成部分，不调用任何 st.*（RAG 服务的工作线程里也能跑）：
+    - 检索 / 调 LLM，返回需要写入 chat.jsonl 的记录列表
+    - on_text(全文)：流式文本回调；on_record(记录)：每产出一条完整记录回调一次；
+      on_error(提示)：生成失败时的提示（错误同时写进 devlog）
+    n_questions > 1 时 quiz 走批量出题：一次调用出 N 道，每道题一条 mcq 记录
+    hits 为预先检索好的结果（见 execute_plan），为 None 时按工具各自的 k 现检索
     """
     records: List[Dict[str, Any]] = []
-    q = topic or user_msg
+    on_record = on_record or (lambda rec: None)
+    on_error = on_error or (lambda msg: None)
+
+    def _emit(rec: Dict[str, Any]):
+        records.append(rec)
+        on_record(rec)
+
+    if mode == "quiz" and n_questions > 1:
+        hits_r = hits if hits is not None else retrieve(vs, topic, k=_RETRIEVE_K["quiz"])
+        ctx = "\n\n".join(d.page_content for d in hits_r)
+        base_qid = str(int(time.time() * 1000))
+
+        def _on_question(i: int, data: Dict[str, Any]):
+            _emit({
+                "t": now_ts(),
+                "role": "assistant",
+                "kind": "mcq",
+                "qid": f"{base_qid}_{i}",
+                "data": data,
+            })
+
+        try:
+            gen_mcq_batch(
+                llm,
+                ctx,
+                devlog,
+                n=n_questions,
+                strictness=strictness,
+                extra_context=extra_context,
+                instruction=instruction,
+                topic=topic,
+                on_text=on_text,
+                on_question=_on_question,
+            )
+        except Exception as e:
+            devlog["error_mcq"] = str(e)
+            on_error(f"生成题目失败：{e}")
+        if not records:
+            on_error("没有解析出有效的题目。")
+        return records
+
     if mode == "quiz":
-        hits_r = retrieve(vs, topic, k=8)
-        ctx = "\n\n".join(d.page_content[:600] for d in hits_r)
+        hits_r = hits if hits is not None else retrieve(vs, topic, k=_RETRIEVE_K["quiz"])
+        ctx = "\n\n".join(d.page_content for d in hits_r)
         try:
             data = gen_mcq(
                 llm,
@@ -46,49 +118,44 @@ def run_tool(
                 strictness=strictness,
                 extra_context=extra_context,
                 instruction = instruction,
-                topic = topic
+                topic = topic,
+                on_text=on_text,
             )
         except Exception as e:
             devlog["error_mcq"] = str(e)
-            st.error(f"生成题目失败：{e}")
+            on_error(f"生成题目失败：{e}")
             data = {
                 "question": "生成失败",
                 "options": [],
                 "answer": "",
                 "rationale": "",
             }
-        qid = str(int(time.time() * 1000))
-        render_mcq_block(proj, data, qid)
-        records.append({
+        _emit({
             "t": now_ts(),
             "role": "assistant",
             "kind": "mcq",
-            "qid": qid,
+            "qid": str(int(time.time() * 1000)),
             "data": data,
         })
         return records
 
     if mode in ("card", "map"):
-        hits_r = retrieve(vs, topic, k=10)
-        ctx = "\n\n".join(d.page_content[:800] for d in hits_r)
+        hits_r = hits if hits is not None else retrieve(vs, topic, k=_RETRIEVE_K[mode])
+        ctx = "\n\n".join(d.page_content for d in hits_r)
         mode_cardmap = "card" if mode == "card" else "mindmap"
         try:
             out = gen_card_or_map(
                 llm,
                 ctx,
-                mode_cardmap if mode_cardmap in ("card", "mindmap") else "card",
+                mode_cardmap,
                 devlog,
                 strictness=strictness,
                 extra_context=extra_context,
                 instruction = instruction,
-                topic = topic
+                topic = topic,
+                on_text=on_text,
             )
-            if mode_cardmap == "card":
-                render_card_block(out)
-            else:
-                render_mindmap_block(out)
-
-            records.append({
+            _emit({
                 "t": now_ts(),
                 "role": "assistant",
                 "kind": mode_cardmap,
@@ -96,7 +163,7 @@ def run_tool(
             })
         except Exception as e:
             devlog["error_cardmap"] = str(e)
-            st.error(f"生成内容失败：{e}")
+            on_error(f"生成内容失败：{e}")
         return records
 
     # 默认：answer（用 topic 作为问题，避免把用户的流程指令传进回答）
@@ -104,31 +171,97 @@ def run_tool(
         q = topic or user_msg
         ans, hits_r = rag_answer(
             llm, vs, q,
-            k=4,
+            k=_RETRIEVE_K["answer"],
+            hits=hits,
             devlog=devlog,
             strictness=strictness,
             extra_context=extra_context,
-            instruction = instruction
+            instruction = instruction,
+            on_text=on_text,
         )
-        docs = [Document(page_content=h.page_content, metadata=h.metadata) for h in hits_r]
-        render_evidence_cards(proj, docs)
-        records.append({
+        _emit({
             "t": now_ts(),
             "role": "assistant",
             "kind": "answer",
             "text": ans,
-            "hits": [
-                {"content": h.page_content, "meta": h.metadata}
-                for h in hits_r
-            ],
+            **hits_record(vs, hits_r, proj.index_dir),
         })
     except Exception as e:
         devlog["error_answer"] = str(e)
-        st.error(f"生成回答失败：{e}")
+        on_error(f"生成回答失败：{e}")
 
     return records
 
+
+def run_tool(
+    mode: str,
+    proj,
+    vs,
+    llm,
+    user_msg: str,
+    topic: str,
+    devlog: Dict[str, Any],
+    strictness: str = "strict",
+    extra_context: str = "",
+    instruction: str = "",  
+    n_questions: int = 1,
+    hits: Optional[List[Document]] = None,
+) -> List[Dict[str, Any]]:
+    """
+    generate_tool + 渲染：在当前的 st.chat_message("assistant") 容器内
+    先流式预览，每条记录生成完就在同一个占位符里原地换成最终块，下一条另起占位符。
+    返回需要写入 chat.jsonl 的记录列表
+    """
+    kind = TOOL_KIND.get(mode, "answer")
+    cur = {"slot": st.empty()}
+
+    def _preview(t: str):
+        if kind == "answer":
+            cur["slot"].markdown(t)
+        else:
+            render_stream_preview(cur["slot"], kind, t)
+
+    preview = ThrottledRenderer(_preview)
+
+    def _on_record(rec: Dict[str, Any]):
+        with cur["slot"].container():
+            # 新生成的记录下一次重跑就会进历史，这里的控件 key 只需本次唯一
+            render_record_block(proj, rec, key=f"new_{uuid.uuid4().hex[:8]}", vs=vs, lazy=False)
+        cur["slot"] = st.empty()
+        preview.flush("")
+
+    records = generate_tool(
+        mode, proj, vs, llm, user_msg, topic, devlog,
+        strictness=strictness,
+        extra_context=extra_context,
+        instruction=instruction,
+        n_questions=n_questions,
+        hits=hits,
+        on_text=preview,
+        on_record=_on_record,
+        on_error=st.error,
+    )
+    cur["slot"].empty()
+    return records
+
 # tools.py 中新增
+ROUTE_PROMPT = PromptTemplate(
+    "route",
+    system=(
+        "你是一个学习助手的路由器，只负责选择最合适的工具，不直接回答问题。\n"
+        "可选工具：\n"
+        "- answer: 普通问答，解释概念、推导、总结等。\n"
+        "- quiz: 生成 1 道单选题，适合用户说“出题”“测一测”“练习题”等。\n"
+        "- card: 生成知识卡片，适合用户说“整理成知识点”“做卡片”等。\n"
+        "- map: 生成思维导图，适合用户说“帮我梳理结构”“列个框架”等。\n\n"
+        "你必须输出 JSON，格式严格为：\n"
+        '{"tool": "answer|quiz|card|map", "topic": "<用于检索的主题>"}\n'
+        "不要输出任何多余文字。"
+    ),
+    user="用户输入是：{text}\n请根据用户意图选择一个工具，并给出合适的检索主题。",
+)
+
+
 def llm_route_tool(
         llm,
         user_msg: str,
@@ -148,7 +281,7 @@ def llm_route_tool(
         devlog = {}
 
     # 1) 改写一次（之后全局都用 rewritten_q）
-    with st.spinner("正在分析并重建问题"):
+    with _spinner("正在分析并重建问题"):
         text = _rewrite_query_if_needed(llm, user_msg, history, devlog)
     devlog["route_original_q"] = user_msg
     devlog["route_rewritten_q"] = text
@@ -174,25 +307,12 @@ def llm_route_tool(
     #     return "map", topic
 
     # === 2. 没有显式工具指令，交给 LLM 决策 ===
-    system_prompt = (
-        "你是一个学习助手的路由器，只负责选择最合适的工具，不直接回答问题。\n"
-        "可选工具：\n"
-        "- answer: 普通问答，解释概念、推导、总结等。\n"
-        "- quiz: 生成 1 道单选题，适合用户说“出题”“测一测”“练习题”等。\n"
-        "- card: 生成知识卡片，适合用户说“整理成知识点”“做卡片”等。\n"
-        "- map: 生成思维导图，适合用户说“帮我梳理结构”“列个框架”等。\n\n"
-        "你必须输出 JSON，格式严格为：\n"
-        '{"tool": "answer|quiz|card|map", "topic": "<用于检索的主题>"}\n'
-        "不要输出任何多余文字。"
-    )
-
-    user_prompt = f"用户输入是：{text}\n请根据用户意图选择一个工具，并给出合适的检索主题。"
-
-    out = llm.invoke(system_prompt + "\n\n" + user_prompt)
-    raw = getattr(out, "content", str(out)).strip()
+    reply = llm.invoke(ROUTE_PROMPT.render(text=text))
+    record_cache_usage(devlog, "route", reply.usage)
+    raw = reply.content.strip()
 
     # 开发者模式下方便调试
-    if st.session_state.get("dev_mode"):
+    if get_script_run_ctx(suppress_warning=True) is not None and st.session_state.get("dev_mode"):
         st.session_state["dev_router_raw"] = raw
 
     try:
@@ -207,21 +327,7 @@ def llm_route_tool(
         return "answer", text
 
 
-def llm_make_plan(llm, user_msg: str, devlog: Dict[str, Any],  history: Optional[List[Dict[str, Any]]] = None,) -> Dict[str, Any]:
-    """
-    让 LLM 规划一个多步学习 plan，并保留教案字段。
-    - 保留并规范化: id/tool/topic/instruction/role/strictness/n_questions/read_keys/write_key/output_format
-    - 其余未知字段透传
-    - 校验/默认值:
-        tool ∈ {answer,quiz,card,map}
-        role ∈ {intro_quiz,explain,check_understanding,summary}
-        strictness ∈ {strict,soft,free}
-        output_format ∈ {text,mcq_json,markdown}，默认映射: answer→text, quiz→mcq_json, card/map→markdown
-        n_questions: 仅 quiz 使用，范围 1..10
-        read_keys: 仅允许引用已出现的 write_key（前向依赖会被丢弃）
-    """
-    text = user_msg.strip()
-    example = ('''
+_PLAN_EXAMPLE = ('''
         ```json
 {
   "steps": [
@@ -283,7 +389,11 @@ def llm_make_plan(llm, user_msg: str, devlog: Dict[str, Any],  history: Optional
 }
 ```
 ''')
-    system_prompt = (
+
+
+PLAN_PROMPT = PromptTemplate(
+    "plan",
+    system=(
     '''你是一个教学“教案员”。你不直接讲解知识，也不生成最终内容。\n
         你的任务是按“老师上课”的节奏，规划 1–6 个步骤的教学流程，供下游工具执行。\n
         你的工具分别是：answer(讲解/总结, 输出text)、quiz(单选题, 输出mcq_json)、
@@ -293,7 +403,8 @@ def llm_make_plan(llm, user_msg: str, devlog: Dict[str, Any],  history: Optional
         文字引入-出题-文字讲解-总结/出题-文字讲解-出题-总结/先总结-分别出题-最后讲解。\n
         你在回答时“必须”遵守这些规则：\n
         1.你的回答应该是JSON形式：{\"steps\":[{...}]}；\n
-        2.每一个step需要包含这些字段：id（1、2……）/tool/topic/instruction/strictness/read_keys/write_key；\n
+        2.每一个step需要包含这些字段：id（1、2……）/tool/topic/instruction/strictness/read_keys/write_key；\n        quiz步骤还可以给出n_questions字段（1–10），表示这一步一次出几道题。
+        需要“一套练习”时，请用一个quiz步骤加上n_questions，而不是拆成多个quiz步骤；\n
         3.tool字段描述这一步需要使用的工具，范围：answer、quiz、card、map。
         其中，answer和quiz应该是你教学计划的主要内容。
         map只在你认为有必要梳理所有知识的宏观结构时或用户明确指名时使用，且应该放在结尾或接近结尾。
@@ -314,116 +425,288 @@ def llm_make_plan(llm, user_msg: str, devlog: Dict[str, Any],  history: Optional
         你“禁止”输出任何多余文字。\n
         以下是你回答的一个示例：\n
         '''
-        + example
-    )
-    rewritten_q = _rewrite_query_if_needed(llm, text, history, devlog)
-    user_prompt = f"用户输入：{rewritten_q}\n请开始给出你的plan。"
-    prompt = system_prompt + "\n\n" + user_prompt
-    devlog["plan_prompt"] = prompt
-    out = llm.invoke(prompt)
-    raw = getattr(out, "content", str(out)).strip()
-    devlog["plan_raw"] = raw
-
-    # 尝试解析 JSON（容错：从文本中提取第一个 {...}）
-    try:
-        data = json.loads(raw)
-    except Exception:
-        m = re.search(r"\{.*\}", raw, re.S)
-        data = json.loads(m.group(0)) if m else {}
-
-    steps = data.get("steps")
-    if not isinstance(steps, list) or not steps:
-        # 兜底：退化为单步 answer
-        plan = {"steps": [{"id": "1", "tool": "answer", "topic": text, "instruction": "请你详细解释",
-                           "strictness": "strict", "read_keys": [], "write_key": []}]}
-        devlog["plan_json"] = json.dumps(plan, ensure_ascii=False, indent=2)
-        return plan
-
-    allowed_tools = {"answer", "quiz", "card", "map"}
-    allowed_strict = {"strict", "soft"}
-
-    norm_steps: List[Dict[str, Any]] = []
-    seen_write_keys: set[str] = set()
-
-    for i, s in enumerate(steps[:6], start=1):
-        if not isinstance(s, dict):
-            continue
-        sn = dict(s)  # 透传未知字段
-
-        # id
-        sid = str(sn.get("id") or f"s{i}")
-        sn["id"] = sid
-
-        # tool
-        tool = str(sn.get("tool", "answer")).lower()
-        if tool not in allowed_tools:
-            tool = "answer"
-        sn["tool"] = tool
+        + _PLAN_EXAMPLE
+    ),
+    user="用户输入：{q}\n请开始给出你的plan。",
+)
 
-        # topic
-        topic = str(sn.get("topic", "") or text).strip()
-        sn["topic"] = topic
 
-        # instruction
-        if "instruction" in sn:
-            sn["instruction"] = str(sn["instruction"])
-        else:
-            # 给个简短默认说明
-            sn["instruction"] = {
-                "answer": "老师讲解，先直观解释后分点说明，要点清晰。",
-                "quiz": "生成一题单选题，难度与角色匹配。",
-                "card": "生成知识卡片，提炼核心要点与易错点。",
-                "map": "生成思维导图，最多四级节点。"
-            }[tool]
-
-        # strictness
-        strict = str(sn.get("strictness", "strict")).lower()
-        if strict not in allowed_strict:
-            strict = "strict"
-        sn["strictness"] = strict
-
-        # read_keys
-        rk = sn.get("read_keys", [])
-        if not isinstance(rk, list):
-            rk = [rk]
-        rk = [str(x) for x in rk if isinstance(x, (str, int))]
-        # 只保留已出现的 write_key（去掉前向依赖）
-        rk = [k for k in rk if k in seen_write_keys]
-        sn["read_keys"] = rk
-
-        # write_key
-        wk = sn.get("write_key")
-        wk = str(wk) if wk not in (None, "") else None
-        sn["write_key"] = wk
-        if wk:
-            seen_write_keys.add(wk)
-
-        norm_steps.append(sn)
-
-    plan = {"steps": norm_steps}
-    devlog["plan_json"] = json.dumps(plan, ensure_ascii=False, indent=2)
-    return plan
+_ALLOWED_TOOLS = {"answer", "quiz", "card", "map"}
+_ALLOWED_STRICT = {"strict", "soft"}
+_MAX_PLAN_STEPS = 6
+
+
+def _fallback_plan_step(text: str) -> Dict[str, Any]:
+    # 兜底：退化为单步 answer
+    return {"id": "1", "tool": "answer", "topic": text, "instruction": "请你详细解释",
+            "strictness": "strict", "read_keys": [], "write_key": []}
+
+
+def _normalize_step(s: Any, i: int, text: str, seen_write_keys: set) -> Optional[Dict[str, Any]]:
+    """规范化 plan 中的一步（规则见 llm_make_plan）；不是对象时返回 None。会更新 seen_write_keys。"""
+    if not isinstance(s, dict):
+        return None
+    sn = dict(s)  # 透传未知字段
+
+    # id
+    sid = str(sn.get("id") or f"s{i}")
+    sn["id"] = sid
+
+    # tool
+    tool = str(sn.get("tool", "answer")).lower()
+    if tool not in _ALLOWED_TOOLS:
+        tool = "answer"
+    sn["tool"] = tool
+
+    # topic
+    topic = str(sn.get("topic", "") or text).strip()
+    sn["topic"] = topic
+
+    # instruction
+    if "instruction" in sn:
+        sn["instruction"] = str(sn["instruction"])
+    else:
+        # 给个简短默认说明
+        sn["instruction"] = {
+            "answer": "老师讲解，先直观解释后分点说明，要点清晰。",
+            "quiz": "生成单选题，难度与角色匹配。",
+            "card": "生成知识卡片，提炼核心要点与易错点。",
+            "map": "生成思维导图，最多四级节点。"
+        }[tool]
+
+    # strictness
+    strict = str(sn.get("strictness", "strict")).lower()
+    if strict not in _ALLOWED_STRICT:
+        strict = "strict"
+    sn["strictness"] = strict
+
+    # n_questions：仅 quiz 使用，1..10
+    if tool == "quiz":
+        try:
+            nq = int(sn.get("n_questions", 1))
+        except (TypeError, ValueError):
+            nq = 1
+        sn["n_questions"] = max(1, min(nq, 10))
+    else:
+        sn.pop("n_questions", None)
+
+    # read_keys
+    rk = sn.get("read_keys", [])
+    if not isinstance(rk, list):
+        rk = [rk]
+    rk = [str(x) for x in rk if isinstance(x, (str, int))]
+    # 只保留已出现的 write_key（去掉前向依赖）
+    rk = [k for k in rk if k in seen_write_keys]
+    sn["read_keys"] = rk
+
+    # write_key
+    wk = sn.get("write_key")
+    wk = str(wk) if wk not in (None, "") else None
+    sn["write_key"] = wk
+    if wk:
+        seen_write_keys.add(wk)
+
+    return sn
+
+
+class PlanStream:
+    """
+    在后台线程里流式生成 plan，每解析出一个完整、校验过的 step 就放进队列，
+    这样第 1 步可以在 plan 还没生成完时就开始检索 / 生成。
+    - 迭代本对象：按到达顺序拿到规范化后的 step，plan 生成结束后迭代结束
+    - 流式阶段一个 step 都没解析出来时，整体再容错解析一次，仍失败则退化为单步 answer
+    后台线程里不能调用任何 st.*。
+    """
+
+    _DONE = object()
+
+    def __init__(self, llm, user_msg: str, devlog: Dict[str, Any], history: Optional[List[Dict[str, Any]]] = None):
+        self.llm = llm
+        self.text = user_msg.strip()
+        self.devlog = devlog
+        self.history = history
+        self.steps: List[Dict[str, Any]] = []
+        self._seen_write_keys: set[str] = set()
+        self._listeners: List[Any] = []
+        self._lock = threading.Lock()
+        self._q: "queue.Queue[Any]" = queue.Queue()
+        # 带上当前上下文（会话级埋点）
+        self._thread = threading.Thread(target=contextvars.copy_context().run, args=(self._run,), name="plan-stream", daemon=True)
+        self._thread.start()
+
+    def subscribe(self, fn):
+        """
+        注册 step 到达回调（在后台线程里调用，例如提前开始检索）。
+        注册前已经到达的 step 会立即补发一次。
+        """
+        with self._lock:
+            for sn in self.steps:
+                fn(sn)
+            self._listeners.append(fn)
+
+    def _publish(self, sn: Dict[str, Any]):
+        with self._lock:
+            self.steps.append(sn)
+            for fn in self._listeners:
+                try:
+                    fn(sn)
+                except Exception:
+                    pass
+        self._q.put(sn)
+
+    def _accept(self, raw_step: Any):
+        if len(self.steps) >= _MAX_PLAN_STEPS:
+            return
+        sn = _normalize_step(raw_step, len(self.steps) + 1, self.text, self._seen_write_keys)
+        if sn is not None:
+            self._publish(sn)
+
+    def _run(self):
+        devlog = self.devlog
+        raw = ""
+        cancelled = False
+        try:
+            rewritten_q = _rewrite_query_if_needed(self.llm, self.text, self.history, devlog)
+            # 规划说明 + 示例 JSON 很长且固定，放在 system 段以命中前缀缓存
+            messages = PLAN_PROMPT.render(q=rewritten_q)
+            devlog["plan_prompt"] = prompt_text(messages)
+
+            scanner = JSONObjectScanner(depth=3)   # {"steps": [ {...} ]}
+            fed = 0
+
+            def _on_text(full: str):
+                nonlocal fed
+                for obj in scanner.feed(full[fed:]):
+                    self._accept(loads_lenient(obj))
+                fed = len(full)
+
+            stats = StreamStats()
+            raw = stream_chat(self.llm, messages, on_text=_on_text, stats=stats, temperature=0).strip()
+            stats.to_devlog(devlog, "plan")
+            record_cache_usage(devlog, "plan", stats.usage)
+
+            if not self.steps:
+                # 容错：整体解析（从文本中提取第一个 {...}，或直接是 step 数组）
+                data = loads_lenient(raw)
+                if data is None:
+                    m = re.search(r"\{.*\}", raw, re.S)
+                    data = loads_lenient(m.group(0)) if m else None
+                steps = data.get("steps") if isinstance(data, dict) else data
+                for raw_step in (steps if isinstance(steps, list) else []):
+                    self._accept(raw_step)
+        except LLMCancelled:
+            cancelled = True   # 轮次已取消：不补兜底步骤，execute_plan 随之结束
+        except Exception as e:
+            devlog["plan_error"] = f"{type(e).__name__}: {e}"
+        finally:
+            devlog["plan_raw"] = raw
+            if not self.steps and not cancelled:
+                self._publish(_fallback_plan_step(self.text))
+            devlog["plan_json"] = json.dumps({"steps": self.steps}, ensure_ascii=False, indent=2)
+            self._q.put(self._DONE)
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        while True:
+            item = self._q.get()
+            if item is self._DONE:
+                return
+            yield item
+
+
+def llm_stream_plan(llm, user_msg: str, devlog: Dict[str, Any], history: Optional[List[Dict[str, Any]]] = None) -> PlanStream:
+    """流式版 llm_make_plan：立即返回，可边迭代边执行（交给 execute_plan）。"""
+    return PlanStream(llm, user_msg, devlog, history)
+
+
+def llm_make_plan(llm, user_msg: str, devlog: Dict[str, Any],  history: Optional[List[Dict[str, Any]]] = None,) -> Dict[str, Any]:
+    """
+    让 LLM 规划一个多步学习 plan，并保留教案字段。
+    - 规范化: id/tool/topic/instruction/strictness/n_questions/read_keys/write_key
+    - 其余字段（如 role、output_format）原样透传，不做校验
+    - 校验/默认值:
+        tool ∈ {answer,quiz,card,map}
+        strictness ∈ {strict,soft}
+        n_questions: 仅 quiz 使用，范围 1..10
+        read_keys: 仅允许引用已出现的 write_key（前向依赖会被丢弃）
+    """
+    # 阻塞版：等整个 plan 生成完再返回
+    return {"steps": list(llm_stream_plan(llm, user_msg, devlog, history))}
+
+
+class _RetrievalPrefetcher:
+    """step 一到就在后台线程里按该工具的 k 先做检索，执行到这一步时直接取结果。"""
+
+    def __init__(self, vs):
+        self.vs = vs
+        self._pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="plan-retrieve")
+        self._futures: Dict[int, Any] = {}
+
+    def submit(self, step: Dict[str, Any]):
+        tool = step.get("tool", "answer")
+        topic = (step.get("topic") or "").strip()
+        if topic:
+            self._futures[id(step)] = self._pool.submit(
+                contextvars.copy_context().run, retrieve, self.vs, topic, _RETRIEVE_K.get(tool, 4)
+            )
+
+    def result(self, step: Dict[str, Any]) -> Optional[List[Document]]:
+        fut = self._futures.pop(id(step), None)
+        if fut is None:
+            return None
+        try:
+            return fut.result()
+        except Exception:
+            return None   # 预取失败就让 run_tool 自己再检索一次
+
+    def close(self):
+        self._pool.shutdown(wait=False)
 
 
 def execute_plan(
-    plan: Dict[str, Any],
+    plan: Dict[str, Any] | Iterable[Dict[str, Any]],
     proj,
     vs,
     llm,
     user_msg: str,
     devlog: Dict[str, Any],
+    headless: bool = False,
+    on_record: Optional[Callable[[Dict[str, Any]], None]] = None,
+    on_text: Optional[Callable[[str], None]] = None,
+    should_stop: Optional[Callable[[], bool]] = None,
 ) -> List[Dict[str, Any]]:
     """
     按 plan 依次执行多个工具步骤。
+    plan 可以是完整的 {"steps": [...]}，也可以是 PlanStream（边生成边执行）。
+    每个 step 一到就开始后台检索；生成按顺序进行，轮到某一步时它的 read_keys 必然已经写好。
+    headless=True 时不渲染（RAG 服务 / 后台轮次里用），流式文本交给 on_text，每条记录生成完交给 on_record。
+    should_stop() 为真时不再开始下一步（后台轮次被取消）。
     返回：所有步骤产生的聊天记录列表（用于写入 chat.jsonl）
     """
     records_all: List[Dict[str, Any]] = []
 
-    steps = plan.get("steps") or []
-    if not isinstance(steps, list) or not steps:
+    def _run(**kw) -> List[Dict[str, Any]]:
+        if headless:
+            return generate_tool(
+                **kw, on_text=on_text, on_record=on_record,
+                on_error=lambda msg: devlog.setdefault("errors", []).append(msg),
+            )
+        return run_tool(**kw)
+
+    prefetch = _RetrievalPrefetcher(vs)
+    if isinstance(plan, PlanStream):
+        steps = plan
+        plan.subscribe(prefetch.submit)
+    else:
+        steps = plan.get("steps") or []
+        if isinstance(steps, list):
+            for s in steps:
+                if isinstance(s, dict):
+                    prefetch.submit(s)
+    if not isinstance(steps, PlanStream) and (not isinstance(steps, list) or not steps):
+        prefetch.close()
         # 兜底：退回单工具路由
         mode, topic = llm_route_tool(llm, user_msg)
-        return run_tool(
+        return _run(
             mode=mode,
             proj=proj,
             vs=vs,
@@ -435,6 +718,7 @@ def execute_plan(
 
     # 黑板：用于跨步骤传递产物
     artifacts: Dict[str, str] = {}
+    artifact_cap = TokenBudget().cap("artifacts")
 
     def _build_extra_context(read_keys: List[str]) -> str:
         if not read_keys:
@@ -444,9 +728,8 @@ def execute_plan(
             v = artifacts.get(k)
             if v:
                 parts.append(f"[{k}]\n{str(v)}")
-        # 统一截断，防止 prompt 过长
-        extra = "\n\n".join(parts)
-        return extra[:1200] if len(extra) > 1200 else extra
+        # 按 token 截断到黑板份额，多个产物平分额度，不会整段丢掉后面的 key
+        return "\n\n".join(fit_pieces(parts, artifact_cap))
 
     def _artifact_from_records(recs: List[Dict[str, Any]]) -> str:
         """
@@ -481,58 +764,92 @@ def execute_plan(
         "card": "知识卡片",
         "map": "思维导图",
     }
-    # 依次执行每一步
-    for idx, step in enumerate(steps, start=1):
-        tool = step.get("tool", "answer")
-        topic = (step.get("topic") or user_msg or "").strip()
-        strictness = step.get("strictness", "strict")
-        instruction = step.get("instruction", "")  # 仅用于 devlog 记录
-        read_keys: List[str] = step.get("read_keys", []) or []
-        write_key = step.get("write_key")
-
-        # devlog 标注本步信息
-        devlog[f"step_{idx}_tool"] = tool
-        devlog[f"step_{idx}_topic"] = topic
-        devlog[f"step_{idx}_strictness"] = strictness
-        devlog[f"step_{idx}_instruction"] = instruction
-        devlog[f"step_{idx}_read_keys"] = ",".join(read_keys)
-        devlog[f"step_{idx}_write_key"] = write_key or ""
-
-        # 拼装跨步依赖上下文
-        extra_context = _build_extra_context(read_keys)
-        devlog[f"step_{idx}_extra_context_len"] = len(extra_context)
-        label = label_map.get(tool, "内容")
-        base_msg = f"第 {idx} 步  正在生成{label}：{topic}"
-        # 执行
-        step_records: List[Dict[str, Any]] = []
-        with st.spinner(base_msg):
-            sub = run_tool(
-                mode=tool,
-                proj=proj,
-                vs=vs,
-                llm=llm,
-                user_msg=f"(auto) {tool} for {topic}",
-                topic=topic,
-                devlog=devlog,
-                strictness=strictness,
-                extra_context=extra_context,
-                instruction = instruction
-            )
-        step_records.extend(sub)
-
-        # 累计到总记录
-        records_all.extend(step_records)
+    # 依次执行每一步；plan 还在生成时，等待下一步到达
+    steps_iter = iter(steps)
+    idx = 0
+    try:
+        while True:
+            if should_stop is not None and should_stop():
+                break
+            with _spinner("正在生成学习计划" if idx == 0 else "正在规划下一步"):
+                step = next(steps_iter, None)
+            if step is None or (should_stop is not None and should_stop()):
+                break
+            idx += 1
+            tool = step.get("tool", "answer")
+            topic = (step.get("topic") or user_msg or "").strip()
+            strictness = step.get("strictness", "strict")
+            instruction = step.get("instruction", "")  # 仅用于 devlog 记录
+            n_questions = int(step.get("n_questions", 1) or 1) if tool == "quiz" else 1
+            read_keys: List[str] = step.get("read_keys", []) or []
+            write_key = step.get("write_key")
+
+            # devlog 标注本步信息
+            devlog[f"step_{idx}_tool"] = tool
+            devlog[f"step_{idx}_topic"] = topic
+            devlog[f"step_{idx}_strictness"] = strictness
+            devlog[f"step_{idx}_instruction"] = instruction
+            devlog[f"step_{idx}_read_keys"] = ",".join(read_keys)
+            devlog[f"step_{idx}_write_key"] = write_key or ""
+            if tool == "quiz":
+                devlog[f"step_{idx}_n_questions"] = n_questions
+
+            # 拼装跨步依赖上下文
+            extra_context = _build_extra_context(read_keys)
+            devlog[f"step_{idx}_extra_context_tokens"] = count_tokens(extra_context)
+            label = label_map.get(tool, "内容")
+            base_msg = f"第 {idx} 步  正在生成{label}：{topic}"
+            # 执行
+            step_records: List[Dict[str, Any]] = []
+            with _spinner(base_msg):
+                sub = _run(
+                    mode=tool,
+                    proj=proj,
+                    vs=vs,
+                    llm=llm,
+                    user_msg=f"(auto) {tool} for {topic}",
+                    topic=topic,
+                    devlog=devlog,
+                    strictness=strictness,
+                    extra_context=extra_context,
+                    instruction = instruction,
+                    n_questions=n_questions,
+                    hits=prefetch.result(step),
+                )
+            step_records.extend(sub)
+
+            # 累计到总记录
+            records_all.extend(step_records)
+
+            # 写入黑板
+            if write_key:
+                art = _artifact_from_records(step_records)
+                if art:
+                    artifacts[write_key] = art
+                    devlog[f"step_{idx}_artifact_written"] = f"{write_key}:{len(art)}chars"
+                else:
+                    devlog[f"step_{idx}_artifact_written"] = f"{write_key}:<empty>"
+    finally:
+        prefetch.close()   # 取消时 LLMCancelled 从这里穿出，也要收掉预取线程
+    return records_all
 
-        # 写入黑板
-        if write_key:
-            art = _artifact_from_records(step_records)
-            if art:
-                artifacts[write_key] = art
-                devlog[f"step_{idx}_artifact_written"] = f"{write_key}:{len(art)}chars"
-            else:
-                devlog[f"step_{idx}_artifact_written"] = f"{write_key}:<empty>"
 
-    return records_all
+PLAN_DECIDE_PROMPT = PromptTemplate(
+    "plan_decide",
+    system=(
+        "你是学习助手的调度器，要判断是否需要一个多步骤的学习计划(plan)。\n"
+        "可选策略：\n"
+        "- False: 单一步骤，用一个工具(answer/quiz/card/map)就可以解决。\n"
+        "- True: 使用多步骤 plan，比如“先出几道题，再总结/画思维导图”等。\n\n"
+        "当用户有这些倾向时倾向于 True：\n"
+        "- 说“系统复习、综合训练、出一套题、完整复习、来一套练习”等。\n"
+        "- 问题明显很大，像“帮我全面掌握第 X 章”“从头梳理这个专题”等。\n"
+        "当只是单个问题、单个概念、一个小练习时，选择 False。\n\n"
+        "你必须只输出 JSON：{\"use_plan\": true 或 false}\n"
+        "不要输出任何其他文字。"
+    ),
+    user="用户输入是：{text}\n请判断是否需要 plan。",
+)
 
 
 def llm_should_use_plan(llm, user_msg: str, devlog: Dict[str, Any]) -> bool:
@@ -547,23 +864,9 @@ def llm_should_use_plan(llm, user_msg: str, devlog: Dict[str, Any]) -> bool:
     """
     text = user_msg.strip()
 
-    system_prompt = (
-        "你是学习助手的调度器，要判断是否需要一个多步骤的学习计划(plan)。\n"
-        "可选策略：\n"
-        "- False: 单一步骤，用一个工具(answer/quiz/card/map)就可以解决。\n"
-        "- True: 使用多步骤 plan，比如“先出几道题，再总结/画思维导图”等。\n\n"
-        "当用户有这些倾向时倾向于 True：\n"
-        "- 说“系统复习、综合训练、出一套题、完整复习、来一套练习”等。\n"
-        "- 问题明显很大，像“帮我全面掌握第 X 章”“从头梳理这个专题”等。\n"
-        "当只是单个问题、单个概念、一个小练习时，选择 False。\n\n"
-        "你必须只输出 JSON：{\"use_plan\": true 或 false}\n"
-        "不要输出任何其他文字。"
-    )
-
-    user_prompt = f"用户输入是：{text}\n请判断是否需要 plan。"
-
-    out = llm.invoke(system_prompt + "\n\n" + user_prompt)
-    raw = getattr(out, "content", str(out)).strip()
+    reply = llm.invoke(PLAN_DECIDE_PROMPT.render(text=text))
+    record_cache_usage(devlog, "plan_decide", reply.usage)
+    raw = reply.content.strip()
     devlog["plan_decide_raw"] = raw
 
     import json
@@ -578,3 +881,37 @@ def llm_should_use_plan(llm, user_msg: str, devlog: Dict[str, Any]) -> bool:
         devlog["plan_decide_error"] = f"{type(e).__name__}: {e}"
         # 兜底：默认不用 plan
         return False
+
+
+def run_chat_turn(
+    proj,
+    vs,
+    llm,
+    user_msg: str,
+    devlog: Dict[str, Any],
+    history: Optional[List[Dict[str, Any]]] = None,
+    on_text: Optional[Callable[[str], None]] = None,
+    on_record: Optional[Callable[[Dict[str, Any]], None]] = None,
+    should_stop: Optional[Callable[[], bool]] = None,
+) -> List[Dict[str, Any]]:
+    """
+    一轮对话的完整编排，不渲染（RAG 服务 / turns.py 的后台轮次用）：先判断要不要 plan，
+    要就边规划边执行；否则单工具路由。返回这一轮产出的 assistant 记录，plan 时各步各自一条，
+    和 on_record 按生成顺序收到的一致；写入时由调用方打上同一个 turn，页面按 turn 合成一个气泡。
+    """
+    if llm_should_use_plan(llm, user_msg, devlog):
+        if should_stop is not None and should_stop():
+            return []
+        plan = llm_stream_plan(llm, user_msg, devlog, history)
+        return execute_plan(plan, proj, vs, llm, user_msg, devlog, headless=True, on_record=on_record,
+                            on_text=on_text, should_stop=should_stop)
+    mode, topic = llm_route_tool(llm, user_msg, devlog, history)
+    devlog["route_mode"] = mode
+    if should_stop is not None and should_stop():
+        return []
+    return generate_tool(
+        mode, proj, vs, llm, user_msg, topic, devlog,
+        on_text=on_text,
+        on_record=on_record,
+        on_error=lambda msg: devlog.setdefault("errors", []).append(msg),
+    )
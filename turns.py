@@ -0,0 +1,180 @@
+"""
+对话轮次的后台执行（本地模式，不用 RAG 服务时）：
+- 整轮编排（要不要 plan / 路由 / 各工具生成）交给进程级线程池，不再跑在处理 chat_input 的那次重跑里；
+  用户点任何控件引起的重跑都不会打断、丢弃正在生成的轮次
+- 每条记录一生成完就写进聊天记录（带 turn 字段），plan 的各步各自一条；取消或页面离开都不会丢已完成的步骤
+- 轮次按 (会话, 轮次 id) 登记，页面定时轮询 snapshot() 渲染进度：已写入的记录、正在流式生成的文本、错误
+- cancel() 后在下一段流式文本到达时打断当前生成（plan 线程、对冲请求同样经 ds_client.cancel_event 打断），
+  plan 也不再开始下一步
+- 开发者模式“剖析下一次重跑”时，提交那次重跑立刻就结束了，剖析改在工作线程里围着整轮做，
+  结果挂在 ChatTurn.profile 上由页面取走
+"""
+import contextvars
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+from config import TURN_WORKERS, TURN_RETAIN_S
+from ds_client import LLMCancelled, cancel_event
+from utils import now_ts
+
+
+class TurnCancelled(LLMCancelled):
+    """取消后从流式回调里抛出，打断当前这次 LLM 生成（BaseException 子类，工具里的 except Exception 不会吞掉）。"""
+
+
+def new_turn_id() -> str:
+    """聊天记录里的 turn 字段：同一轮的用户消息和各条 assistant 记录共用一个。"""
+    return uuid.uuid4().hex[:12]
+
+
+class ChatTurn:
+    def __init__(self, session: str, pid: str, user_msg: str):
+        self.id = new_turn_id()
+        self.session = session
+        self.pid = pid
+        self.user_msg = user_msg
+        self.status = "running"          # running / done / error / cancelled
+        self.records: List[Dict[str, Any]] = []   # 已写入聊天记录的 assistant 记录
+        self.preview = ""                # 正在流式生成的文本（全文）
+        self.preview_kind = "answer"
+        self.errors: List[str] = []
+        self.devlog: Dict[str, Any] = {}
+        self.started = time.perf_counter()
+        self.finished = 0.0
+        self.profile_dir: Optional[Path] = None   # 设了就剖析这一轮，火焰图存到这里
+        self.profile: Optional[Dict[str, Any]] = None
+        self._cancel = threading.Event()
+        self._lock = threading.Lock()
+
+    @property
+    def done(self) -> bool:
+        return self.status != "running"
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancel.is_set()
+
+    @property
+    def elapsed(self) -> float:
+        return (self.finished or time.perf_counter()) - self.started
+
+    def cancel(self):
+        self._cancel.set()
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "status": self.status,
+                "records": list(self.records),
+                "preview": self.preview,
+                "preview_kind": self.preview_kind,
+                "errors": list(self.errors),
+            }
+
+
+class TurnExecutor:
+    def __init__(self, workers: int = TURN_WORKERS):
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="chat-turn")
+        self._turns: Dict[Tuple[str, str], ChatTurn] = {}
+        self._lock = threading.Lock()
+
+    def submit(self, session: str, proj, vs, llm, user_msg: str,
+               history: Optional[List[Dict[str, Any]]] = None, profile_dir: Optional[Path] = None) -> ChatTurn:
+        """先同步写入用户消息，再把整轮交给后台；立即返回 ChatTurn。"""
+        turn = ChatTurn(session, proj.root.name, user_msg)
+        turn.profile_dir = profile_dir
+        proj.append_chat({"t": now_ts(), "role": "user", "kind": "msg", "text": user_msg, "turn": turn.id})
+        with self._lock:
+            self._prune()
+            self._turns[(session, turn.id)] = turn
+        # 带上当前上下文（会话级埋点）
+        self._pool.submit(contextvars.copy_context().run, self._run, turn, proj, vs, llm, history)
+        return turn
+
+    def get(self, session: str, turn_id: str) -> Optional[ChatTurn]:
+        with self._lock:
+            return self._turns.get((session, turn_id))
+
+    def active(self, session: str, pid: str) -> List[ChatTurn]:
+        """该会话在该项目上还没被页面取走的轮次（包括刚结束的），按提交顺序。"""
+        with self._lock:
+            turns = [t for (s, _), t in self._turns.items() if s == session and t.pid == pid]
+        return sorted(turns, key=lambda t: t.started)
+
+    def forget(self, session: str, turn_id: str):
+        with self._lock:
+            self._turns.pop((session, turn_id), None)
+
+    def _prune(self):
+        """回收结束太久没人来取的轮次（会话已关闭）。调用方持有锁。"""
+        now = time.perf_counter()
+        for key, t in list(self._turns.items()):
+            if t.done and now - t.finished > TURN_RETAIN_S:
+                del self._turns[key]
+
+    def _run(self, turn: ChatTurn, proj, vs, llm, history: Optional[List[Dict[str, Any]]]):
+        from tools import run_chat_turn, streaming_kind
+
+        def on_text(text: str):
+            if turn.cancelled:
+                raise TurnCancelled()
+            with turn._lock:
+                turn.preview = text
+                turn.preview_kind = streaming_kind(turn.devlog)
+
+        def on_record(rec: Dict[str, Any]):
+            if turn.cancelled:
+                return   # 取消后不再写入新记录
+            rec = {**rec, "turn": turn.id}
+            proj.append_chat(rec)
+            with turn._lock:
+                turn.records.append(rec)
+                turn.preview = ""
+
+        prof = None
+        if turn.profile_dir is not None:
+            # 在工作线程里启动：采样目标就是跑这一轮的线程，外加它期间新起的线程
+            from profiler import SamplingProfiler
+            prof = SamplingProfiler().start()
+        status, errors = "done", []
+        cancel_event.set(turn._cancel)   # 本线程的上下文是 submit 时拷贝的，只影响这一轮
+        try:
+            # 返回值不再写入：各条记录已经在 on_record 里逐条写过
+            run_chat_turn(proj, vs, llm, turn.user_msg, turn.devlog, history,
+                          on_text=on_text, on_record=on_record, should_stop=lambda: turn.cancelled)
+        except LLMCancelled:
+            pass
+        except Exception as e:
+            status = "error"
+            errors.append(f"生成失败：{type(e).__name__}: {e}")
+        if prof is not None:
+            prof.stop()
+            try:
+                turn.profile = prof.summary(prof.save(turn.profile_dir, label="chat-turn"))
+            except OSError as e:
+                errors.append(f"剖析结果保存失败：{e}")
+        with turn._lock:
+            if turn.cancelled:
+                turn.status = "cancelled"
+            else:
+                turn.status = status
+                turn.errors = turn.devlog.pop("errors", []) + errors
+            turn.preview = ""
+            turn.finished = time.perf_counter()
+
+
+_executor: Optional[TurnExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def get_turn_executor() -> TurnExecutor:
+    """进程级单例：所有会话共用一个线程池，轮次不随某次重跑结束。"""
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = TurnExecutor()
+    return _executor
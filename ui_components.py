@@ -2,10 +2,13 @@ import html
 import time
 import streamlit as st
 from pathlib import Path
-from typing import List, Dict, Any
-from langchain.schema import Document
-from io_readers import convert_to_pdf_with_libreoffice, pdf_page_to_image
-import streamlit.components.v1 as components
+from typing import List, Dict, Any, TYPE_CHECKING
+from streaming import partial_json_field
+import metrics
+
+# LangChain、PDF 渲染和 components 只在真正画依据 / 思维导图时才导入
+if TYPE_CHECKING:
+    from langchain.schema import Document
 
 def _render_block_container(kind: str, title: str | None = None):
     """
@@ -39,41 +42,96 @@ def _render_block_container(kind: str, title: str | None = None):
     return container
 
 
-def render_evidence_cards(proj, hits: List[Document]):
+def render_evidence_cards(proj, hits: List["Document"], key: str = "ev"):
     """
-    在一个小 expander 里展示依据列表。
-    不再占整块大卡片，由上层决定放在哪个位置。
+    依据列表。st.expander 折叠时内容照样会执行（会触发 PDF 转换和渲染），
+    所以改用开关：打开“依据”才列出片段，单条再打开“页面预览”才生成页面图片。
     """
     if not hits:
         return
 
-    with st.expander("📎 依据", expanded=False):
-        for d in hits:
-            meta = d.metadata or {}
-            src = meta.get("source", "?")
-            tag = Path(src).name
-            page = meta.get("page")
-            slide = meta.get("slide")
-            label = f"{tag} · " + (f"P{page}" if page else (f"S{slide}" if slide else ""))
-
-            with st.expander(label):
-                src_path = proj.files_dir / tag
-                shown = False
-                if src_path.exists():
-                    preview_pdf = (
-                        src_path
-                        if src_path.suffix.lower() == ".pdf"
-                        else convert_to_pdf_with_libreoffice(src_path, proj.preview_dir / "pdf")
-                    )
-                    page_num = page or slide
-                    if preview_pdf and page_num:
-                        img = pdf_page_to_image(preview_pdf, page_num)
-                        if img is not None:
-                            st.image(img, use_column_width=True)
-                            shown = True
-                if not shown:
-                    txt = d.page_content or ""
-                    st.write(txt[:1000] + ("..." if len(txt) > 1000 else ""))
+    if not st.toggle(f"📎 依据（{len(hits)}）", key=f"{key}_open"):
+        return
+    for n, d in enumerate(hits):
+        meta = d.metadata or {}
+        src = meta.get("source", "?")
+        tag = Path(src).name
+        page = meta.get("page")
+        slide = meta.get("slide")
+        label = f"{tag} · " + (f"P{page}" if page else (f"S{slide}" if slide else ""))
+        if meta.get("dup_sources"):
+            from dedup import dup_label
+            label += f"（{dup_label(meta)}）"
+
+        with st.container(border=True):
+            st.caption(label)
+            src_path = proj.files_dir / tag
+            page_num = page or slide
+            shown = False
+            if src_path.exists() and page_num and st.toggle("页面预览", key=f"{key}_{n}_img"):
+                from io_readers import convert_to_pdf_with_libreoffice, pdf_page_to_image
+                preview_pdf = (
+                    src_path
+                    if src_path.suffix.lower() == ".pdf"
+                    else convert_to_pdf_with_libreoffice(src_path, proj.preview_dir / "pdf")
+                )
+                if preview_pdf:
+                    img = pdf_page_to_image(preview_pdf, page_num)
+                    if img is not None:
+                        st.image(img, use_column_width=True)
+                        shown = True
+            if not shown:
+                txt = d.page_content or ""
+                st.write(txt[:1000] + ("..." if len(txt) > 1000 else ""))
+
+
+def render_record_block(proj, rec: Dict[str, Any], key: str, vs=None, lazy: bool = True):
+    """
+    渲染一条 assistant 记录（answer / mcq / card / mindmap），历史记录与新生成的结果共用。
+    lazy=True（历史记录）时思维导图先只显示大纲，打开才创建 iframe。
+    """
+    from rag_core import record_hits
+    kind = rec.get("kind", "msg")
+
+    with metrics.span("render", kind=kind):
+        if kind == "answer":
+            # 新记录只存块 id，这里才从索引 docstore 取回原文
+            from service_client import ServiceError
+            try:
+                docs, note = record_hits(vs, rec), "索引已重建，这条回答的依据已不可用。"
+            except ServiceError:
+                # RAG 服务暂时取不到原文：回答照常显示，只是没有依据
+                docs, note = [], "RAG 服务暂时无响应，这条回答的依据暂不可用。"
+            render_answer_with_evidence(proj, rec.get("text", ""), docs, key=key)
+            if rec.get("hit_ids") and not docs:
+                st.caption(note)
+
+        elif kind == "mcq":
+            render_mcq_block(
+                proj,
+                rec.get("data", {}),
+                qid=str(rec.get("qid") or rec.get("t") or f"mcq_{key}"),
+            )
+
+        elif kind == "card":
+            render_card_block(rec.get("text", ""))
+
+        elif kind == "mindmap":
+            render_mindmap_block(rec.get("text", ""), key=key if lazy else None)
+
+
+def render_stream_preview(slot, kind: str, text: str):
+    """
+    流式生成过程中的预览，每次都在同一个占位符里整体重绘（调用方负责节流）：
+    - mcq: 只显示已生成的题干，整道题生成完再换成可作答的题目块
+    - card / mindmap: 直接按 Markdown 显示，思维导图生成完再换成 markmap iframe
+    """
+    with slot.container():
+        with _render_block_container(kind, "生成中…"):
+            if kind == "mcq":
+                st.markdown(f"**题目：** {partial_json_field(text, 'question')}")
+            else:
+                st.markdown(text or "")
 
 
 def render_mcq_block(proj, data: Dict[str, Any], qid: str):
@@ -140,11 +198,15 @@ def render_card_block(text: str):
         st.markdown(text or "", unsafe_allow_html=False)
 
 
-def render_mindmap_block(text: str):
+def render_mindmap_block(text: str, key: str | None = None):
     """
     思维导图：同样用卡片容器包裹，内部仍用 Markdown 解析层级列表。
+    给了 key（历史记录）时先只显示 Markdown 大纲，打开开关才创建 markmap iframe。
     """
     with _render_block_container("mindmap", None):
+        if key is not None and not st.toggle("显示思维导图", key=f"{key}_map"):
+            st.markdown(text or "")
+            return
         """
     自己用 markmap-autoloader 渲染思维导图，
     这样 iframe 里的 CSS 完全由我们控制，可以改字体颜色 / 分支颜色。
@@ -208,12 +270,14 @@ def render_mindmap_block(text: str):
 
 
         # 这里决定 iframe 本身有多高，相当于“可视高度”
+        import streamlit.components.v1 as components
         components.html(html_code, height=500, scrolling=True)
 
 def render_answer_with_evidence(
     proj,
     answer_text: str,
-    hits: List[Document] | None,
+    hits: List["Document"] | None,
+    key: str = "ev",
 ):
     """
     左边显示回答，右边一个小“📎 依据”按钮（expander）。
@@ -225,4 +289,4 @@ def render_answer_with_evidence(
 
     with col_ev:
         if hits:
-            render_evidence_cards(proj, hits)
+            render_evidence_cards(proj, hits, key=key)
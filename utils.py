@@ -1,8 +1,22 @@
 import hashlib
+import json
+import os
+import threading
 import time
-from typing import Dict, Any, List
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Any, Iterator, List, Optional
 import unicodedata
 import re
+
+try:
+    import fcntl
+except ImportError:     # Windows：只有进程内的线程锁
+    fcntl = None
+
+_flocks: Dict[str, List[int]] = {}   # 锁文件路径 -> [fd, 重入层数]；只在持有对应线程锁时读写
+
+
 def sha1_of_bytes(data: bytes) -> str:
     h = hashlib.sha1(); h.update(data); return h.hexdigest()
 
@@ -11,39 +25,52 @@ def now_ts() -> int:
     return int(time.time())
 
 
-def due_wrong(items: List[Dict[str, Any]], now: int | None = None) -> List[Dict[str, Any]]:
-    now = now or now_ts()
-    due = []
-    for it in items:
-        box = it.get("box", 1)
-        last = it.get("last", it.get("t", now))
-        gap_days = {1: 1, 2: 2, 3: 4}.get(box, 1)
-        if now - last >= gap_days * 86400:
-            due.append(it)
-    return due
-import hashlib
-import time
-from typing import Dict, Any, List
 
+@contextmanager
+def file_lock(lock_path: Path, lock: "threading.RLock") -> Iterator[None]:
+    """
+    线程锁 + 跨进程的 fcntl.flock(lock_path)。多个 Streamlit / 服务 / bulk_build 进程共用 INDEX_ROOT 时，
+    读-改-写的一整串操作不会交错。lock 须是可重入锁，同一线程里可嵌套使用。
+    """
+    with lock:
+        if fcntl is None:
+            yield
+            return
+        key = str(Path(lock_path).resolve())
+        held = _flocks.get(key)
+        if held is not None:
+            held[1] += 1
+            try:
+                yield
+            finally:
+                held[1] -= 1
+            return
+        fd = os.open(key, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            _flocks[key] = [fd, 0]
+            try:
+                yield
+            finally:
+                del _flocks[key]
+                fcntl.flock(fd, fcntl.LOCK_UN)
+        finally:
+            os.close(fd)
 
-def sha1_of_bytes(data: bytes) -> str:
-    h = hashlib.sha1(); h.update(data); return h.hexdigest()
+# 错题复习间隔（Leitner 盒子 -> 天数）
+REVIEW_GAP_DAYS = {1: 1, 2: 2, 3: 4}
 
 
-def now_ts() -> int:
-    return int(time.time())
+def wrong_due_at(it: Dict[str, Any]) -> int:
+    """错题下次到期的时间戳：上次复习时间 + 所在盒子的间隔。"""
+    last = int(it.get("last", it.get("t", 0)) or 0)
+    return last + REVIEW_GAP_DAYS.get(it.get("box", 1), 1) * 86400
 
 
 def due_wrong(items: List[Dict[str, Any]], now: int | None = None) -> List[Dict[str, Any]]:
     now = now or now_ts()
-    due = []
-    for it in items:
-        box = it.get("box", 1)
-        last = it.get("last", it.get("t", now))
-        gap_days = {1: 1, 2: 2, 3: 4}.get(box, 1)
-        if now - last >= gap_days * 86400:
-            due.append(it)
-    return due
+    return [it for it in items if wrong_due_at(it) <= now]
+
 
 def slugify_name(name: str) -> str:
     """将任意项目名转为仅包含 ascii 字符的安全目录名"""
@@ -57,4 +84,24 @@ def slugify_name(name: str) -> str:
     # 防止全被替换空掉
     if not name_ascii.strip("_"):
         name_ascii = f"proj_{now_ts()}"
-    return name_ascii[:64]  # 防止太长
\ No newline at end of file
+    return name_ascii[:64]  # 防止太长
+
+
+def loads_lenient(text: str) -> Optional[Any]:
+    """
+    尽量把 LLM 输出的“近似 JSON”解析出来，失败返回 None。
+    依次尝试：原样解析 → 去掉 ```json 围栏 → 删尾逗号、补换行处漏掉的逗号。
+    """
+    if not text:
+        return None
+    try:
+        return json.loads(text)
+    except Exception:
+        pass
+    t = re.sub(r"^\s*```(?:json)?\s*|\s*```\s*$", "", text.strip())
+    t = re.sub(r",\s*([}\]])", r"\1", t)                      # 尾逗号
+    t = re.sub(r'(["}\]\d]|true|false|null)(\s*\n\s*)"', r'\1,\2"', t)  # 换行处漏掉的逗号
+    try:
+        return json.loads(t)
+    except Exception:
+        return None
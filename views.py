@@ -1,51 +1,78 @@
 # views.py
-import os
 import time
 import json
-import shutil
+import uuid
 from pathlib import Path
-from typing import List
+from typing import Any, Dict, List, Tuple
 import streamlit as st
-from config import DEFAULT_INDEX_ROOT, K_RETRIEVE_DEFAULT
+from config import DEFAULT_INDEX_ROOT, K_RETRIEVE_DEFAULT, CHAT_WINDOW_RECORDS, CHAT_PAGE_RECORDS, TURN_POLL_INTERVAL
 from project import Project
-from utils import now_ts, due_wrong
-from io_readers import read_pdf, read_pptx, read_docx, read_txt
-from rag_core import get_embeddings, split_docs, save_index, try_load_index, retrieve
-from llm import get_llm
-from utils import slugify_name
-from llm import get_llm
-from tools import execute_plan, llm_make_plan, run_tool, llm_route_tool, llm_should_use_plan
-from ui_components import (
-    render_evidence_cards,
-    render_mcq_block,
-    render_card_block,
-    render_mindmap_block,
-    render_answer_with_evidence
-)
-def render_assistant_record_body(proj, rec, idx):
+from archive import cached_archive, export_archive, import_archive
+from utils import now_ts
+from scheduler import WrongScheduler, end_of_today
+from rag_core import load_index
+from ingest import build_project, ProjectExistsError
+from service_client import SERVICE_URL, RemoteIndex, ServiceError, get_client, record_hit_ids
+from streaming import ThrottledRenderer
+from turns import get_turn_executor
+import metrics
+from prompts import cache_totals
+from warmup import record_timing, timings
+from ui_components import render_record_block, render_stream_preview
+def _record_summary(rec) -> str:
+    """历史记录折叠时的一行摘要。"""
     kind = rec.get("kind", "msg")
+    if kind == "multi":
+        return " + ".join(_record_summary(sub) for sub in rec.get("items") or [])
+    if kind == "mcq":
+        text = "练习题：" + (rec.get("data") or {}).get("question", "")
+    elif kind == "card":
+        text = "知识卡片：" + (rec.get("text") or "").strip().split("\n")[0].lstrip("# ")
+    elif kind == "mindmap":
+        text = "思维导图：" + (rec.get("text") or "").strip().split("\n")[0].lstrip("# ")
+    else:
+        text = rec.get("text") or ""
+    text = " ".join(text.split())
+    return text[:60] + ("…" if len(text) > 60 else "")
 
-    if kind == "answer":
-        from langchain.schema import Document
-        hits = rec.get("hits") or []
-        docs = [
-            Document(page_content=h["content"], metadata=h["meta"])
-            for h in hits
-        ]
-        render_answer_with_evidence(proj, rec.get("text", ""), docs)
-
-    elif kind == "mcq":
-        render_mcq_block(
-            proj,
-            rec.get("data", {}),
-            qid=str(rec.get("qid") or rec.get("t") or f"mcq_{idx}"),
-        )
 
-    elif kind == "card":
-        render_card_block(rec.get("text", ""))
+def _turn_groups(records: List[Dict[str, Any]]) -> List[Tuple[int, Dict[str, Any]]]:
+    """
+    把同一轮（turn 字段相同）连续的 assistant 记录合成一条 multi 显示，返回 (首条下标, 记录)。
+    plan 的各步是分开写入的单条记录；老数据里整轮存成一条 multi 的照旧显示。
+    """
+    out: List[Tuple[int, Dict[str, Any]]] = []
+    for i, rec in enumerate(records):
+        if out and rec.get("role") == "assistant" and rec.get("turn") is not None:
+            prev = out[-1][1]
+            if prev.get("role") == "assistant" and prev.get("turn") == rec["turn"]:
+                if prev.get("kind") != "multi":
+                    prev = {"t": prev.get("t"), "role": "assistant", "kind": "multi", "turn": rec["turn"], "items": [prev]}
+                    out[-1] = (out[-1][0], prev)
+                prev["items"].append(rec)
+                continue
+        out.append((i, rec))
+    return out
 
-    elif kind == "mindmap":
-        render_mindmap_block(rec.get("text", ""))
+
+def render_chat_record(proj, rec, idx, vs=None):
+    role = rec.get("role", "user")
+    kind = rec.get("kind", "msg")
+    if role == "user":
+        with st.chat_message("user"):
+            st.markdown(rec.get("text", ""))
+        return
+    with st.chat_message("assistant"):
+        if kind == "multi":
+            # 多工具合并成一次回答
+            for j, sub in enumerate(rec.get("items", []) or []):
+                render_assistant_record_body(proj, sub, f"{idx}_{j}", vs)
+        else:
+            render_assistant_record_body(proj, rec, idx, vs)
+
+
+def render_assistant_record_body(proj, rec, idx, vs=None):
+    render_record_block(proj, rec, key=f"h{idx}_{rec.get('t', '')}", vs=vs)
 
 
 def render_new_project_view(projects: List[Project], INDEX_ROOT: Path):
@@ -75,7 +102,10 @@ def render_new_project_view(projects: List[Project], INDEX_ROOT: Path):
                         st.session_state["view"] = "对话"
                         st.rerun()
                     if c2.button("删除", key=f"del_{proj.root.name}"):
-                        shutil.rmtree(proj.root, ignore_errors=True)
+                        if SERVICE_URL:
+                            get_client().delete_project(proj.root.name)
+                        else:
+                            proj.delete()
                         st.rerun()
 
     # 右列：新建项目
@@ -96,64 +126,34 @@ def render_new_project_view(projects: List[Project], INDEX_ROOT: Path):
             elif not up_files:
                 st.warning("请先上传至少一个文件。")
             else:
-                # 目录名：安全的 ascii slug
-                dir_name = slugify_name(display_name)
-                proj_dir = INDEX_ROOT / dir_name
-                proj = Project(proj_dir)
-                if proj.exists():
-                    st.error(f"目录名 {dir_name} 已存在。请换一个项目名称。")
-                else:
-                    proj.root.mkdir(parents=True, exist_ok=True)
-                    proj.files_dir.mkdir(parents=True, exist_ok=True)
-
-                    docs_all = []
-                    files_meta = []
-                    progress = st.progress(0, text="保存文件…")
-
-                    # 1) 保存 + 解析
-                    for idx, f in enumerate(up_files, start=1):
-                        b = f.read()
-                        (proj.files_dir / f.name).write_bytes(b)
-                        files_meta.append(str(proj.files_dir / f.name))
-                        progress.progress(
-                            min(5 + int(idx / max(1, len(up_files)) * 10), 15),
-                            text=f"读取 {f.name}"
+                bar = st.progress(0, text="保存文件…")
+                try:
+                    if SERVICE_URL:
+                        get_client().create_project(display_name, [(f.name, f.read()) for f in up_files])
+                    else:
+                        build_project(
+                            INDEX_ROOT, display_name, [(f.name, f.read()) for f in up_files],
+                            progress=lambda pct, text: bar.progress(pct, text=text),
                         )
-                        ext = f.name.lower().split(".")[-1]
-                        if ext == "pdf":
-                            docs_all += read_pdf(b, f.name)
-                        elif ext == "pptx":
-                            docs_all += read_pptx(b, f.name)
-                        elif ext == "docx":
-                            docs_all += read_docx(b, f.name)
-                        elif ext == "txt":
-                            docs_all += read_txt(b, f.name)
-
-                    # 2) 切分
-                    progress.progress(30, text="分块中…")
-                    chunks = split_docs(docs_all)
-
-                    # 3) 嵌入与索引
-                    progress.progress(45, text="计算向量…")
-                    _ = get_embeddings()
-                    progress.progress(60, text="建立索引…")
-                    from langchain_community.vectorstores import FAISS
-                    vs = FAISS.from_documents(chunks, _)
-
-                    # 4) 保存
-                    save_index(vs, proj.index_dir)
-                    progress.progress(85, text="写入元数据…")
-                    proj.meta = {
-                        "name": display_name,          # 显示中文名
-                        "dir_name": dir_name,          # 目录名（可选）
-                        "created_at": now_ts(),
-                        "files": files_meta
-                    }
-                    proj.save_meta()
-                    progress.progress(100, text="完成")
+                except ProjectExistsError as e:
+                    st.error(str(e))
+                else:
+                    bar.progress(100, text="完成")
                     st.success("项目已创建。可以在左侧“历史项目”里打开。")
                     st.rerun()
 
+        st.divider()
+        st.subheader("从备份恢复")
+        backup = st.file_uploader("上传“导出索引 ZIP”得到的文件", type=["zip"], key="restore_zip")
+        if backup is not None and st.button("恢复项目"):
+            try:
+                proj = import_archive(backup, INDEX_ROOT, name=new_name.strip() or None)
+            except Exception as e:
+                st.error(f"恢复失败：{e}")
+            else:
+                st.success(f"已恢复为项目 {proj.meta.get('name')}（无需重新计算向量）。")
+                st.rerun()
+
 
 def render_chat_view(INDEX_ROOT: Path):
     if not st.session_state.get("project_id"):
@@ -166,7 +166,12 @@ def render_chat_view(INDEX_ROOT: Path):
             st.stop()
         proj.load_meta()
 
-        vs = try_load_index(proj.index_dir)
+        if SERVICE_URL:
+            # 索引只在 RAG 服务里加载，页面渲染依据时按块 id 向服务取原文
+            vs = RemoteIndex(get_client(), proj.root.name)
+        else:
+            with st.spinner("加载索引…"):
+                vs = load_index(proj.index_dir)
         if not vs:
             st.error("索引未找到。")
             st.stop()
@@ -174,97 +179,209 @@ def render_chat_view(INDEX_ROOT: Path):
         st.title(f"💬 {proj.meta.get('name', proj.root.name)}")
         st.caption("像 ChatGPT 一样提问；也支持 /quiz、/card、/map 指令")
 
-        chats = proj.load_chats(limit=200)
+        # 只完整渲染最近 CHAT_WINDOW_RECORDS 条；更早的按页读出后只显示一行摘要，
+        # 点开某一条才完整渲染，重跑耗时不随历史长度增长
+        pages_key = f"chat_pages_{proj.root.name}"
+        n_pages = st.session_state.get(pages_key, 0)
+        n_load = CHAT_WINDOW_RECORDS + CHAT_PAGE_RECORDS * n_pages
+        if SERVICE_URL:
+            try:
+                chats, first_idx = get_client().load_chats_page(proj.root.name, None, n_load)
+            except ServiceError as e:
+                st.warning(f"暂时读不到聊天记录：{e}")
+                chats, first_idx = [], 0
+            try:
+                # 最近几条记录的依据一次取回，逐条渲染时不再各自请求
+                vs.prefetch(record_hit_ids(chats[-CHAT_WINDOW_RECORDS:]))
+            except ServiceError:
+                pass   # 各条记录渲染时显示“依据暂不可用”
+        else:
+            chats, first_idx = proj.load_chats_page(None, n_load)
+        # 同一轮的多条记录合成一个气泡；一轮跨过窗口边界时整轮算作更早的记录
+        n_older = max(len(chats) - CHAT_WINDOW_RECORDS, 0)
+        groups = _turn_groups(chats)
+        older = [(i, rec) for i, rec in groups if i < n_older]
+        recent = [(i, rec) for i, rec in groups if i >= n_older]
+        if first_idx > 0 and st.button(f"加载更早的记录（还有 {first_idx} 条）"):
+            st.session_state[pages_key] = n_pages + 1
+            st.rerun()
+
+        for i, rec in older:
+            idx = first_idx + i
+            icon = "🧑" if rec.get("role") == "user" else "🤖"
+            if st.toggle(f"{icon} {_record_summary(rec)}", key=f"hist_open_{proj.root.name}_{idx}"):
+                render_chat_record(proj, rec, idx, vs)
 
-        # 历史对话（只在主区显示）
-        for i, rec in enumerate(chats):
-            role = rec.get("role", "user")
-            kind = rec.get("kind", "msg")
+        # 还在后台生成的轮次：已写入的 assistant 记录先不进历史，由进度区渲染
+        live = [] if SERVICE_URL else get_turn_executor().active(st.session_state["session_id"], proj.root.name)
+        live_ids = {t.id for t in live}
 
-            if role == "user":
-                with st.chat_message("user"):
-                    if kind == "msg":
-                        st.markdown(rec.get("text", ""))
-                    else:
-                        st.markdown(rec.get("text", ""))
+        # 最近的对话完整显示
+        for i, rec in recent:
+            if rec.get("role") == "assistant" and rec.get("turn") in live_ids:
                 continue
-            
-            # assistant
-            with st.chat_message("assistant"):
-                if kind == "multi":
-                    # 多工具合并成一次回答
-                    items = rec.get("items", []) or []
-                    for j, sub in enumerate(items):
-                        render_assistant_record_body(proj, sub, f"{i}_{j}")
-                else:
-                    render_assistant_record_body(proj, rec, i)
-        # 输入区
-        user_msg = st.chat_input("输入问题、或 /quiz 关键词，/card 主题，/map 主题")
+            render_chat_record(proj, rec, first_idx + i, vs)
+        _render_turn_notice()
+        if live:
+            _render_live_turns(proj, vs, [t.id for t in live])
+        # 输入区（上一轮还在生成时先不接受新问题）
+        user_msg = st.chat_input("输入问题、或 /quiz 关键词，/card 主题，/map 主题", disabled=bool(live))
         if user_msg:
             # 立即回显
             with st.chat_message("user"):
                 st.markdown(user_msg)
-            proj.append_chat({
-                "t": now_ts(),
-                "role": "user",
-                "kind": "msg",
-                "text": user_msg
-            })
-
-            llm = get_llm()
-            devlog = {}
-            use_plan = llm_should_use_plan(llm, user_msg, devlog)
-            with st.chat_message("assistant"):
-                if use_plan:
-                    # 1) 先让 LLM 生成学习 plan
-                    with st.spinner("正在生成学习计划"):
-                        plan = llm_make_plan(llm, user_msg, devlog,chats)
-                    # 2) 再按 plan 执行多个工具
-                    step_records = execute_plan(
-                        plan=plan,
-                        proj=proj,
-                        vs=vs,
-                        llm=llm,
-                        user_msg=user_msg,
-                        devlog=devlog,
-                    )
-                    multi_rec = {
-                        "t": now_ts(),
-                        "role": "assistant",
-                        "kind": "multi",
-                        "items": step_records,   # 保留每个工具的结构
-                    }
-                    # 等会儿统一 append
-                    records = [multi_rec]
-                else:
-                    mode, topic = llm_route_tool(llm, user_msg)
-                    mode2msg = {
-                        "answer": "正在生成讲解回答…",
-                        "quiz": "正在出练习题…",
-                        "card": "正在整理知识卡片…",
-                        "map": "正在绘制思维导图…",
-                    }
-                    spinner_msg = mode2msg.get(mode, "正在生成内容…")
-                    with st.spinner(spinner_msg):
-                        records = run_tool(
-                            mode=mode,
-                            proj=proj,
-                            vs=vs,
-                            llm=llm,
-                            user_msg=user_msg,
-                            topic=topic,
-                            devlog=devlog,
-                            history=chats
-                        )
+            if SERVICE_URL:
+                # 整轮编排和写聊天记录都在服务端，页面只渲染事件流
+                t_query = time.perf_counter()
+                with st.chat_message("assistant"):
+                    devlog = _render_remote_turn(proj, vs, user_msg)
+                _record_turn(time.perf_counter() - t_query)
+                _render_devlog(devlog)
+                return
+            # 整轮在后台线程池里跑，期间的重跑不会打断它；重跑后由进度区轮询渲染
+            from llm import get_llm
+            # 这次重跑在剖析中：整轮在后台线程跑，剖析也跟过去（这次重跑本身马上就结束了）
+            profile_dir = proj.root / "profiles" if st.session_state.get("profiling") else None
+            get_turn_executor().submit(st.session_state["session_id"], proj, vs, get_llm(), user_msg, chats,
+                                       profile_dir=profile_dir)
+            st.rerun()
 
-                # 写入 assistant 侧聊天记录
-                for rec in records:
-                    proj.append_chat(rec)
-                if st.session_state.get("dev_mode"):
-                    with st.expander("🔧 开发者模式：Prompt & 原始返回"):
-                        for k, v in devlog.items():
-                            st.markdown(f"**{k}**")
-                            st.code(v)
+
+@st.fragment(run_every=TURN_POLL_INTERVAL)
+def _render_live_turns(proj: Project, vs, turn_ids: List[str]):
+    """后台轮次的进度：已写入的记录、正在流式生成的文本、停止按钮；结束后整页重跑，记录进入历史。"""
+    executor = get_turn_executor()
+    session = st.session_state["session_id"]
+    for tid in turn_ids:
+        turn = executor.get(session, tid)
+        if turn is None:
+            continue
+        snap = turn.snapshot()
+        if turn.done:
+            executor.forget(session, tid)
+            if turn.profile:
+                st.session_state["last_profile"] = turn.profile
+            st.session_state["turn_notice"] = {"status": snap["status"], "errors": snap["errors"], "devlog": turn.devlog}
+            _record_turn(turn.elapsed)
+            st.rerun()
+        with st.chat_message("assistant"):
+            for j, rec in enumerate(snap["records"]):
+                render_record_block(proj, rec, key=f"turn_{tid}_{j}", vs=vs, lazy=False)
+            slot = st.empty()
+            if not snap["preview"]:
+                slot.caption("正在生成…")
+            elif snap["preview_kind"] == "answer":
+                slot.markdown(snap["preview"])
+            else:
+                render_stream_preview(slot, snap["preview_kind"], snap["preview"])
+            if st.button("⏹ 停止生成", key=f"turn_cancel_{tid}", disabled=turn.cancelled):
+                turn.cancel()
+
+
+def _render_turn_notice():
+    """上一轮结束时的提示与开发者日志（只显示一次）。"""
+    notice = st.session_state.pop("turn_notice", None)
+    if not notice:
+        return
+    if notice["status"] == "cancelled":
+        st.info("已停止生成，已完成的部分已保存。")
+    for msg in notice["errors"]:
+        st.error(msg)
+    _render_devlog(notice["devlog"])
+
+
+def _render_remote_turn(proj: Project, vs, user_msg: str) -> Dict[str, Any]:
+    """把 RAG 服务推送的事件流渲染出来：流式文本进预览槽位，完整记录出来后替换掉预览。"""
+    cur = {"slot": st.empty(), "kind": "answer"}
+
+    def _preview(t: str):
+        if cur["kind"] == "answer":
+            cur["slot"].markdown(t)
+        else:
+            render_stream_preview(cur["slot"], cur["kind"], t)
+
+    preview = ThrottledRenderer(_preview)
+    devlog: Dict[str, Any] = {}
+    try:
+        for ev in get_client().chat(proj.root.name, user_msg):
+            if ev["type"] == "text":
+                cur["kind"] = ev.get("kind") or "answer"
+                preview(ev["text"])
+            elif ev["type"] == "record":
+                preview.flush()
+                with cur["slot"].container():
+                    # 新生成的记录下一次重跑就会进历史，这里的控件 key 只需本次唯一
+                    render_record_block(proj, ev["record"], key=f"new_{uuid.uuid4().hex[:8]}", vs=vs, lazy=False)
+                cur["slot"] = st.empty()
+            elif ev["type"] == "error":
+                st.error(ev["message"])
+            elif ev["type"] == "done":
+                devlog = ev.get("devlog") or {}
+    except Exception as e:
+        st.error(f"RAG 服务调用失败：{e}")
+    return devlog
+
+
+def _record_turn(dt: float):
+    record_timing("query_s", dt, first="first_query_s")
+    metrics.observe("rag_span_seconds", dt, span="chat_turn", remote="1" if SERVICE_URL else "0")
+
+
+def _metrics_rows(ms: metrics.MetricSet) -> List[Dict[str, Any]]:
+    snap = ms.snapshot()
+    rows = []
+    for h in snap["histograms"]:
+        label = ",".join(f"{k}={v}" for k, v in h["labels"].items())
+        rows.append({
+            "指标": h["name"] + (f"{{{label}}}" if label else ""),
+            "次数": h["count"],
+            "p50(s)": h["p50"],
+            "p95(s)": h["p95"],
+            "max(s)": h["max"],
+            "合计(s)": h["sum"],
+        })
+    for c in snap["counters"]:
+        label = ",".join(f"{k}={v}" for k, v in c["labels"].items())
+        rows.append({"指标": c["name"] + (f"{{{label}}}" if label else ""), "次数": c["value"]})
+    return rows
+
+
+def _render_metrics():
+    """各阶段耗时直方图：本会话 / 本进程，可下载 Prometheus 文本或 JSON。"""
+    sess = metrics.session_metrics()
+    tab_s, tab_p = st.tabs(["本会话", "本进程"])
+    for tab, ms in ((tab_s, sess), (tab_p, metrics.process_metrics())):
+        with tab:
+            rows = _metrics_rows(ms) if ms is not None else []
+            if rows:
+                st.dataframe(rows, use_container_width=True)
+            else:
+                st.caption("暂无数据")
+    # 固定 key，内容传函数：点下载时才生成，不在每次重跑里重建
+    downloads = (
+        ("prom", "下载 Prometheus 文本", metrics.prometheus_text, "text/plain"),
+        ("json", "下载 JSON", lambda: json.dumps(metrics.process_metrics().snapshot(), ensure_ascii=False, indent=2),
+         "application/json"),
+    )
+    with tab_p:
+        for col, (name, label, data, mime) in zip(st.columns(len(downloads)), downloads):
+            col.download_button(label, data, file_name=f"rag_metrics.{name}", mime=mime, key=f"metrics_dl_{name}")
+
+
+def _render_devlog(devlog: Dict[str, Any]):
+    if st.session_state.get("dev_mode"):
+        with st.expander("🔧 开发者模式：Prompt & 原始返回"):
+            st.caption("启动与延迟（秒）：" + "，".join(f"{k}={v:.2f}" for k, v in timings().items()))
+            ct = cache_totals()
+            st.caption(
+                f"前缀缓存（本进程累计）：{ct['calls']} 次调用，"
+                f"{ct['cached_tokens']}/{ct['prompt_tokens']} prompt tokens 命中，"
+                f"命中率 {ct['hit_rate']:.1%}"
+            )
+            _render_metrics()
+            for k, v in devlog.items():
+                st.markdown(f"**{k}**")
+                st.code(v)
 
 
 def render_wrongbook_view(INDEX_ROOT: Path):
@@ -272,31 +389,53 @@ def render_wrongbook_view(INDEX_ROOT: Path):
     if not st.session_state.get("project_id"):
         st.info("请先在左侧选择一个项目。")
     else:
-        proj = Project(INDEX_ROOT / st.session_state["project_id"])
-        items = proj.load_wrong()
-        st.caption(f"总错题：{len(items)}")
-        due = due_wrong(items)
+        pid = st.session_state["project_id"]
+        proj = Project(INDEX_ROOT / pid)
+        # 调度器按项目缓存在会话里；只有错题本被别的会话改过（标记变化）才重新加载
+        cached = st.session_state.get("wrong_sched")
+        stamp = proj.wrong_stamp()
+        if not cached or cached[0] != pid or cached[1] != stamp:
+            items = proj.load_wrong()
+            proj.sync_due_index(items)
+            cached = (pid, stamp, WrongScheduler(items))
+            st.session_state["wrong_sched"] = cached
+        sched = cached[2]
+        st.caption(f"总错题：{len(sched)}")
+
+        others = {k: v for k, v in proj.due_index.due_counts(end_of_today()).items() if k != pid}
+        if others:
+            st.caption("其他项目今日待复习：" + "，".join(f"{k} {v} 题" for k, v in others.items()))
+
+        def _saved():
+            # 自己写入后记下新标记，下次重跑直接复用内存里的堆
+            st.session_state["wrong_sched"] = (pid, proj.wrong_stamp(), sched)
+            st.rerun()
+
+        due = sched.due(limit=10)
         if due:
-            st.warning(f"需要复习：{len(due)}")
-            keep = items[:]
-            for i, it in enumerate(due[:10], 1):
+            st.warning(f"需要复习：{sched.count_due()}")
+            for i, it in enumerate(due, 1):
                 st.markdown(f"**{i}. {it.get('q','(no question)')}**")
                 st.write("\n".join(it.get("opts", [])))
                 c1, c2, c3 = st.columns(3)
+                # 只在点击时按 id 写一条，内容没变就不落盘
                 if c1.button("掌握", key=f"up_{i}"):
-                    it["box"] = min(it.get("box", 1) + 1, 3)
-                    it["last"] = now_ts()
+                    new = {**it, "box": min(it.get("box", 1) + 1, 3), "last": now_ts()}
+                    if sched.update(new):
+                        proj.update_wrong(new)
+                    _saved()
                 if c2.button("仍错", key=f"down_{i}"):
-                    it["box"] = 1
-                    it["last"] = now_ts()
+                    new = {**it, "box": 1, "last": now_ts()}
+                    if sched.update(new):
+                        proj.update_wrong(new)
+                    _saved()
                 if c3.button("删除", key=f"del_{i}"):
-                    it["del"] = True
-            keep = [it for it in keep if not it.get("del")]
-            with open(proj.wrong_path, "w", encoding="utf-8") as f:
-                for it in keep:
-                    f.write(json.dumps(it, ensure_ascii=False) + "\n")
+                    if sched.remove(it["id"]):
+                        proj.delete_wrong(it["id"])
+                    _saved()
         else:
-            st.info("没有到期的复习项。")
+            nxt = sched.next_due()
+            st.info("没有到期的复习项。" + (f"下一道将在 {time.strftime('%m-%d %H:%M', time.localtime(nxt))} 到期。" if nxt else ""))
 
 
 def render_export_view(INDEX_ROOT: Path):
@@ -307,10 +446,14 @@ def render_export_view(INDEX_ROOT: Path):
         proj = Project(INDEX_ROOT / st.session_state["project_id"])
         colA, colB = st.columns(2)
         with colA:
-            if proj.chat_path.exists():
+            # 只导出最近一段时间时，时间范围外的历史分段不会被解压
+            ranges = {"全部": None, "最近 7 天": 7, "最近 30 天": 30, "最近 90 天": 90}
+            days = ranges[st.selectbox("对话范围", list(ranges), index=0)]
+            chats = proj.export_chats(since=now_ts() - days * 86400 if days else None)
+            if chats:
                 st.download_button(
                     "导出对话 JSONL",
-                    data=proj.chat_path.read_bytes(),
+                    data=chats,
                     file_name=f"{proj.root.name}_chats.jsonl"
                 )
             if proj.meta_path.exists():
@@ -319,24 +462,25 @@ def render_export_view(INDEX_ROOT: Path):
                     data=proj.meta_path.read_bytes(),
                     file_name=f"{proj.root.name}_meta.json"
                 )
-            if proj.wrong_path.exists():
+            wrong = proj.export_wrong()
+            if wrong:
                 st.download_button(
                     "导出错题本 JSONL",
-                    data=proj.wrong_path.read_bytes(),
+                    data=wrong,
                     file_name=f"{proj.root.name}_wrong.jsonl"
                 )
         with colB:
             if proj.index_dir.exists():
-                import io, zipfile
-                buf = io.BytesIO()
-                with zipfile.ZipFile(buf, "w", zipfile.ZIP_DEFLATED) as zf:
-                    for root, _, files in os.walk(proj.index_dir):
-                        for f in files:
-                            full = Path(root) / f
-                            zf.write(full, full.relative_to(proj.index_dir))
-                st.download_button(
-                    "导出索引 ZIP",
-                    data=buf.getvalue(),
-                    file_name=f"{proj.root.name}_index.zip",
-                    mime="application/zip",
-                )
+                # 只在点击时打包；同一索引版本的包缓存在磁盘上，之后直接下载
+                cached = cached_archive(proj)
+                if cached is None and st.button("打包索引 ZIP"):
+                    with st.spinner("打包中…"):
+                        cached = export_archive(proj)
+                if cached is not None:
+                    # 传可调用对象：点下载时才读文件，平时的重跑不把整个包读进内存
+                    st.download_button(
+                        f"导出索引 ZIP（{cached.stat().st_size / 1e6:.1f} MB）",
+                        data=cached.read_bytes,
+                        file_name=f"{proj.root.name}_index.zip",
+                        mime="application/zip",
+                    )
@@ -0,0 +1,87 @@
+"""
+冷启动优化：
+- 重模块（LangChain / FAISS / OpenAI SDK / PDF 渲染）都改成第一次用到时才导入，页面先出来
+- start_warmup: 进程里第一个会话打开时，在后台线程预先导入这些模块、加载向量模型和 tokenizer、
+  建好 LLM 连接池，并把最近用过的几个项目索引载入 rag_core.load_index 的缓存
+- record_timing / timings: 记录导入耗时、预热各步耗时和首个问题的端到端延迟，开发者模式里展示
+
+命令行：python warmup.py [INDEX_ROOT]  同步执行一次预热并打印各步耗时（JSON）
+"""
+import importlib
+import json
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+from config import DEFAULT_INDEX_ROOT, WARMUP_PROJECTS
+
+_lock = threading.Lock()
+_timings: Dict[str, float] = {}
+
+# 预热时提前导入的模块（即用户第一次提问 / 建项目时才会导入的那些）
+_HEAVY_MODULES = ["langchain_community.vectorstores", "llm", "tools", "io_readers"]
+
+
+def record_timing(name: str, seconds: float, first: Optional[str] = None):
+    """记录一次耗时；给了 first 时，进程内第一次的值另存在 first 名下（之后不覆盖）。"""
+    with _lock:
+        _timings[name] = seconds
+        if first and first not in _timings:
+            _timings[first] = seconds
+
+
+def timings() -> Dict[str, float]:
+    with _lock:
+        return dict(_timings)
+
+
+def _timed(name: str, fn: Callable):
+    t0 = time.perf_counter()
+    try:
+        return fn()
+    except Exception:
+        return None
+    finally:
+        record_timing(f"warmup_{name}_s", time.perf_counter() - t0)
+
+
+def _recent_projects(index_root: Path, n: int) -> List[str]:
+    """按聊天记录最后写入时间挑最近用过的 n 个项目。"""
+    from registry import ProjectRegistry
+
+    def last_used(pid: str) -> float:
+        root = index_root / pid
+        stamps = [p.stat().st_mtime for p in (root / "chats.jsonl", root / "project.db-wal", root / "project.db") if p.exists()]
+        return max(stamps, default=0.0)
+
+    ids = [e["id"] for e in ProjectRegistry(index_root).list()]
+    return sorted(ids, key=last_used, reverse=True)[:n]
+
+
+def warmup(index_root: Path, n_projects: int = WARMUP_PROJECTS):
+    t0 = time.perf_counter()
+    for mod in _HEAVY_MODULES:
+        _timed(f"import_{mod}", lambda m=mod: importlib.import_module(m))
+
+    from rag_core import get_embeddings, load_index
+    from ds_client import get_transport
+    from budget import get_tokenizer
+    _timed("embeddings", lambda: get_embeddings().embed_query("预热"))
+    _timed("tokenizer", get_tokenizer)
+    _timed("llm_client", get_transport)
+    for pid in _recent_projects(index_root, n_projects):
+        _timed(f"index_{pid}", lambda p=pid: load_index(index_root / p / "index"))
+    record_timing("warmup_total_s", time.perf_counter() - t0)
+
+
+def start_warmup(index_root: Path) -> threading.Thread:
+    th = threading.Thread(target=warmup, args=(index_root,), name="warmup", daemon=True)
+    th.start()
+    return th
+
+
+if __name__ == "__main__":
+    root = Path(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_INDEX_ROOT
+    warmup(root.resolve())
+    print(json.dumps({k: round(v, 3) for k, v in timings().items()}, ensure_ascii=False, indent=2))